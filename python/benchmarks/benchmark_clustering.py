@@ -0,0 +1,52 @@
+import argparse
+import time
+
+import geopandas as gpd
+import ipums_api
+
+from python.pipeline.clustering import ClusteringMethod
+from python.pipeline.pipeline import _create_clusters_from_raster
+
+logger = ipums_api.get_logger('benchmark_clustering')
+
+
+def benchmark_clustering(convolved_raster_table_name: str, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int) -> dict:
+    """
+    Time the SQL (ST_PixelAsPolygons + ST_ClusterDBSCAN) and grid clustering paths on the same convolved raster
+
+    Both paths write to temporary cluster tables, which are compared and dropped afterwards.
+
+    Returns:
+    - A dict with the wall time of each path, the number of clusters each produced and the
+      area of the symmetric difference between the two cluster footprints
+    """
+    results = {}
+    for clustering_method in ClusteringMethod:
+        cluster_table_name = f'benchmark_cluster_{clustering_method.value}'
+        ipums_api.execute_sql(query=f"DROP TABLE IF EXISTS {cluster_table_name};")
+
+        start_time = time.perf_counter()
+        _create_clusters_from_raster(convolved_raster_table_name=convolved_raster_table_name, cluster_table_name=cluster_table_name, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points, clustering_method=clustering_method)
+        results[f'{clustering_method.value}_seconds'] = time.perf_counter() - start_time
+
+        with ipums_api.db_connection() as con:
+            clusters = gpd.GeoDataFrame.from_postgis(f"SELECT cluster_id, geom FROM {cluster_table_name} WHERE cluster_id IS NOT NULL", con, geom_col='geom')
+        results[f'{clustering_method.value}_n_clusters'] = len(clusters)
+        results[f'{clustering_method.value}_footprint'] = clusters.geometry.union_all()
+        ipums_api.execute_sql(query=f"DROP TABLE {cluster_table_name};")
+
+    sql_footprint, grid_footprint = results.pop('sql_footprint'), results.pop('grid_footprint')
+    results['symmetric_difference_area'] = sql_footprint.symmetric_difference(grid_footprint).area
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the SQL and grid clustering paths on a convolved raster table')
+    parser.add_argument('--year', type=int, default=1900)
+    parser.add_argument('--pixel-threshold', type=float, default=100)
+    parser.add_argument('--dbscan-eps', type=float, default=100)
+    parser.add_argument('--dbscan-min-points', type=int, default=1)
+    args = parser.parse_args()
+
+    benchmark = benchmark_clustering(convolved_raster_table_name=f'convolved_raster_{args.year}', pixel_threshold=args.pixel_threshold, dbscan_eps=args.dbscan_eps, dbscan_min_points=args.dbscan_min_points)
+    logger.info(f"Clustering benchmark for {args.year}: {benchmark}")
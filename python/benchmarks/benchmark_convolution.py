@@ -0,0 +1,66 @@
+import argparse
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import ipums_api
+
+from python.pipeline.convolution import get_2d_exponential_kernel, convolve2d, convolve2d_tiled, ConvolutionMethod
+from python.benchmarks.benchmark_results import get_benchmark_metadata, save_benchmark_results, load_benchmark_results, compare_benchmark_results
+
+logger = ipums_api.get_logger('benchmark_convolution')
+
+
+def benchmark_convolution(image_shapes: List[Tuple[int, int]], kernel_sizes: List[int], decay_rate: float = 0.2, density: float = 0.02, tile_size: int = None, n_repeats: int = 3, seed: int = 0) -> Dict:
+    """
+    Microbenchmark get_2d_exponential_kernel and every convolve2d backend, without a database
+
+    The images are sparse population-like grids: a fraction density of the pixels holds a
+    heavy-tailed count, the rest is zero, as in the rasterized census.
+
+    Returns:
+    - Benchmark metadata and, per benchmark name, the best wall time over n_repeats runs
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+    for kernel_size in kernel_sizes:
+        results[f'kernel_k{kernel_size}'] = _time_best_of(lambda: get_2d_exponential_kernel(size=kernel_size, decay_rate=decay_rate), n_repeats=n_repeats)
+
+    for height, width in image_shapes:
+        image = np.where(rng.random((height, width)) < density, rng.pareto(1.5, (height, width)) * 10, 0.0)
+        for kernel_size in kernel_sizes:
+            kernel = get_2d_exponential_kernel(size=kernel_size, decay_rate=decay_rate)
+            for method in ConvolutionMethod:
+                results[f'convolve2d_{method.value}_{height}x{width}_k{kernel_size}'] = _time_best_of(lambda: convolve2d(image=image, kernel=kernel, method=method), n_repeats=n_repeats)
+            if tile_size is not None:
+                results[f'convolve2d_tiled_{height}x{width}_k{kernel_size}'] = _time_best_of(lambda: convolve2d_tiled(image=image, kernel=kernel, tile_size=tile_size), n_repeats=n_repeats)
+
+    return {**get_benchmark_metadata(image_shapes=image_shapes, kernel_sizes=kernel_sizes, decay_rate=decay_rate, density=density, tile_size=tile_size, n_repeats=n_repeats, seed=seed), 'results': results}
+
+
+def _time_best_of(func: Callable, n_repeats: int) -> Dict:
+    seconds = []
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start_time)
+    return {'seconds': min(seconds)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the convolution kernels (no database needed)')
+    parser.add_argument('--image-shapes', type=lambda s: tuple(int(v) for v in s.split('x')), nargs='+', default=[(512, 512), (1500, 2300), (2900, 4600)], help='e.g. 1500x2300')
+    parser.add_argument('--kernel-sizes', type=int, nargs='+', default=[5, 11, 21, 41])
+    parser.add_argument('--tile-size', type=int, default=None)
+    parser.add_argument('--n-repeats', type=int, default=3)
+    parser.add_argument('--output', type=str, default=None, help='JSON file the results are saved to')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of a baseline run to compare against')
+    args = parser.parse_args()
+
+    benchmark = benchmark_convolution(image_shapes=args.image_shapes, kernel_sizes=args.kernel_sizes, tile_size=args.tile_size, n_repeats=args.n_repeats)
+    for name, result in benchmark['results'].items():
+        logger.info(f"{name}: {result['seconds']:.4f}s")
+    if args.output is not None:
+        save_benchmark_results(results=benchmark, path=args.output)
+    if args.compare is not None:
+        logger.info(f"Comparison with {args.compare}:\n{compare_benchmark_results(baseline=load_benchmark_results(path=args.compare), current=benchmark).to_string()}")
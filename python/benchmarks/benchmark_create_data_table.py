@@ -0,0 +1,49 @@
+import argparse
+import time
+
+import ipums_api
+
+from python.pipeline.pipeline import _dedup_and_merge_geo_and_dem_tables_in_steps, _dedup_and_merge_geo_and_dem_tables_to_create_data_table
+
+logger = ipums_api.get_logger('benchmark_create_data_table')
+
+
+def benchmark_create_data_table(year: int, geo_table_ingested: bool = False) -> dict:
+    """
+    Time the step-by-step and the single-pass dedup-and-merge of step 1 on copies of dem_{year} and geo_{year}
+
+    The original tables are left untouched. Returns the wall time of each path and the number
+    of rows found in only one of the two resulting tables (0 when the row sets are identical).
+    """
+    paths = {'steps': _dedup_and_merge_geo_and_dem_tables_in_steps, 'single_pass': _dedup_and_merge_geo_and_dem_tables_to_create_data_table}
+    results = {}
+    for name, dedup_and_merge in paths.items():
+        geo_table_name, dem_table_name, data_table_name = f'benchmark_geo_{name}', f'benchmark_dem_{name}', f'benchmark_census_{name}'
+        ipums_api.execute_sql(query=f"DROP TABLE IF EXISTS {geo_table_name}, {dem_table_name}, {data_table_name};"
+                                    f"CREATE TABLE {geo_table_name} AS SELECT * FROM geo_{year};"
+                                    f"CREATE TABLE {dem_table_name} AS SELECT * FROM dem_{year};")
+
+        start_time = time.perf_counter()
+        dedup_and_merge(geo_table_name=geo_table_name, dem_table_name=dem_table_name, data_table_name=data_table_name, geo_table_ingested=geo_table_ingested)
+        results[f'{name}_seconds'] = time.perf_counter() - start_time
+        ipums_api.execute_sql(query=f"DROP TABLE {geo_table_name}, {dem_table_name};")
+
+    with ipums_api.db_connection() as con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM ("
+                           "(SELECT * FROM benchmark_census_steps EXCEPT ALL SELECT * FROM benchmark_census_single_pass) UNION ALL "
+                           "(SELECT * FROM benchmark_census_single_pass EXCEPT ALL SELECT * FROM benchmark_census_steps)) AS difference")
+            results['n_differing_rows'] = cursor.fetchone()[0]
+
+    ipums_api.execute_sql(query="DROP TABLE benchmark_census_steps, benchmark_census_single_pass;")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the step-by-step and single-pass implementations of step 1')
+    parser.add_argument('--year', type=int, default=1850)
+    parser.add_argument('--geo-table-ingested', action='store_true')
+    args = parser.parse_args()
+
+    benchmark = benchmark_create_data_table(year=args.year, geo_table_ingested=args.geo_table_ingested)
+    logger.info(f"Step 1 benchmark for {args.year}: {benchmark}")
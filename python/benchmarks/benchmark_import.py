@@ -0,0 +1,67 @@
+import argparse
+import subprocess
+import sys
+import time
+from typing import Dict
+
+import ipums_api
+
+from python.benchmarks.benchmark_results import get_benchmark_metadata, save_benchmark_results, load_benchmark_results, compare_benchmark_results
+
+logger = ipums_api.get_logger('benchmark_import')
+
+# Heavy dependencies reported as loaded or not after each snippet
+heavy_modules = ['numpy', 'pandas', 'geopandas', 'shapely', 'rasterio', 'scipy', 'pyarrow', 'psycopg2', 'dotenv']
+# Snippets timed in a fresh interpreter each, so every run is a cold start
+import_snippets = {
+    'import': "import ipums_api",
+    'import_census_year': "import ipums_api; ipums_api.next_census_year(1850)",
+    'import_execute_sql': "import ipums_api; ipums_api.execute_sql",
+    'import_db_api': "import ipums_api; ipums_api.get_cluster_ids",
+    'import_all': "import ipums_api.db_api, ipums_api.streaming, ipums_api.industry_analytics, ipums_api.cluster_lookup, ipums_api.vector_tiles",
+}
+
+
+def benchmark_import(n_repeats: int = 5) -> Dict:
+    """
+    Time cold starts of ipums_api, each in a new Python process (no database needed)
+
+    Returns:
+    - Benchmark metadata and, per snippet, the best wall time over n_repeats processes and the
+      heavy dependencies it loaded
+    """
+    results = {}
+    for name, snippet in import_snippets.items():
+        results[name] = {**_time_best_of(snippet=snippet, n_repeats=n_repeats), 'loaded_modules': _get_loaded_modules(snippet=snippet)}
+    return {**get_benchmark_metadata(n_repeats=n_repeats, python=sys.version), 'results': results}
+
+
+def _time_best_of(snippet: str, n_repeats: int) -> Dict:
+    seconds = []
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', snippet], check=True)
+        seconds.append(time.perf_counter() - start_time)
+    return {'seconds': min(seconds)}
+
+
+def _get_loaded_modules(snippet: str):
+    check = f"{snippet}; import sys; print(','.join(m for m in {heavy_modules!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', check], check=True, capture_output=True, text=True).stdout.strip()
+    return output.split(',') if output else []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold start time of importing ipums_api (no database needed)')
+    parser.add_argument('--n-repeats', type=int, default=5)
+    parser.add_argument('--output', type=str, default=None, help='JSON file the results are saved to')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of a baseline run to compare against')
+    args = parser.parse_args()
+
+    benchmark = benchmark_import(n_repeats=args.n_repeats)
+    for name, result in benchmark['results'].items():
+        logger.info(f"{name}: {result['seconds']:.4f}s, loads {', '.join(result['loaded_modules']) or 'no heavy dependency'}")
+    if args.output is not None:
+        save_benchmark_results(results=benchmark, path=args.output)
+    if args.compare is not None:
+        logger.info(f"Comparison with {args.compare}:\n{compare_benchmark_results(baseline=load_benchmark_results(path=args.compare), current=benchmark).to_string()}")
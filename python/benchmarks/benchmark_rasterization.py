@@ -0,0 +1,52 @@
+import argparse
+import time
+
+import numpy as np
+import ipums_api
+
+from python.pipeline.rasterization import RasterizationMethod
+from python.pipeline.pipeline import _rasterize_census_places
+from ipums_api.raster_postgis import load_raster
+
+logger = ipums_api.get_logger('benchmark_rasterization')
+
+
+def benchmark_rasterization(year: int) -> dict:
+    """
+    Time the SQL (ST_SetValues) and numpy (np.bincount) rasterization of census_{year}
+
+    Both paths write to temporary raster tables, which are compared and dropped afterwards.
+    ST_SetValues overwrites pixels hit by several census places while the numpy path sums
+    them, so the two rasters only differ on those collision pixels.
+
+    Returns:
+    - A dict with the wall time of each path, the total population of each raster, the
+      number of differing pixels and the largest per-pixel difference
+    """
+    results, rasters = {}, {}
+    for rasterization_method in RasterizationMethod:
+        raster_table_name = f'benchmark_rasterized_census_place_{rasterization_method.value}'
+        ipums_api.execute_sql(query=f"DROP TABLE IF EXISTS {raster_table_name};")
+
+        start_time = time.perf_counter()
+        _rasterize_census_places(data_table_name=f'census_{year}', rasterized_census_place_table_name=raster_table_name, rasterization_method=rasterization_method, raster_overview_factors=())
+        results[f'{rasterization_method.value}_seconds'] = time.perf_counter() - start_time
+
+        with ipums_api.db_connection() as con:
+            rasters[rasterization_method] = load_raster(con=con, raster_table=raster_table_name).values
+        results[f'{rasterization_method.value}_population'] = float(rasters[rasterization_method].sum())
+        ipums_api.execute_sql(query=f"DROP TABLE {raster_table_name};")
+
+    difference = np.abs(rasters[RasterizationMethod.SQL] - rasters[RasterizationMethod.NUMPY])
+    results['n_differing_pixels'] = int(np.count_nonzero(difference))
+    results['max_pixel_difference'] = float(difference.max())
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the SQL and numpy rasterization of census places')
+    parser.add_argument('--year', type=int, default=1850)
+    args = parser.parse_args()
+
+    benchmark = benchmark_rasterization(year=args.year)
+    logger.info(f"Rasterization benchmark for {args.year}: {benchmark}")
@@ -0,0 +1,48 @@
+import json
+import subprocess
+import time
+from typing import Dict
+
+import pandas as pd
+
+
+def get_benchmark_metadata(**parameters) -> Dict:
+    """
+    Describe a benchmark run: commit, time and parameters, so results can be compared across commits
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'timestamp': time.time(), 'parameters': parameters}
+
+
+def save_benchmark_results(results: Dict, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+
+
+def load_benchmark_results(path: str) -> Dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare_benchmark_results(baseline: Dict, current: Dict, tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Compare the timings of two benchmark runs saved with save_benchmark_results
+
+    Parameters:
+    - baseline: results of the reference run
+    - current: results of the run to check
+    - tolerance: relative slowdown above which a benchmark is flagged as a regression
+
+    Returns:
+    - A DataFrame indexed by benchmark name with the seconds of both runs, their ratio and a
+      regression flag, for the benchmarks present in both runs
+    """
+    baseline_seconds = pd.Series({name: result['seconds'] for name, result in baseline['results'].items()}, dtype=float)
+    current_seconds = pd.Series({name: result['seconds'] for name, result in current['results'].items()}, dtype=float)
+    comparison = pd.DataFrame({'baseline_seconds': baseline_seconds, 'current_seconds': current_seconds}).dropna()
+    comparison['ratio'] = comparison['current_seconds'] / comparison['baseline_seconds']
+    comparison['regression'] = comparison['ratio'] > 1 + tolerance
+    return comparison.sort_values('ratio', ascending=False)
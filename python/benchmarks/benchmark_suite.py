@@ -0,0 +1,100 @@
+import argparse
+import os
+from typing import Dict, List
+
+import ipums_api
+
+from python.benchmarks.synthetic_data import generate_synthetic_data
+from python.benchmarks.benchmark_results import get_benchmark_metadata, save_benchmark_results, load_benchmark_results, compare_benchmark_results
+from python.pipeline.pipeline import preprocess_data, create_data_table, create_clusters, create_cluster_data_tables
+from python.pipeline.convolution import ConvolutionMethod
+from python.pipeline.clustering import ClusteringMethod
+from python.pipeline.rasterization import RasterizationMethod
+
+logger = ipums_api.get_logger('benchmark_suite')
+
+path_sql_functions = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'sql')
+
+
+def run_benchmark_suite(n_persons: int, years: List[int] = (1850, 1860), convolution_kernel_size: int = 11, convolution_kernel_decay_rate: float = 0.2, pixel_threshold: float = 100, dbscan_eps: float = 100, dbscan_min_points: int = 1,
+                        convolution_method: ConvolutionMethod = ConvolutionMethod.DIRECT, clustering_method: ClusteringMethod = ClusteringMethod.SQL, rasterization_method: RasterizationMethod = RasterizationMethod.SQL,
+                        single_pass_data_table: bool = False, seed: float = 0.5) -> Dict:
+    """
+    Run every pipeline step and ipums_api getter on synthetic data and record their wall time and peak RSS
+
+    The synthetic tables are generated first (see generate_synthetic_data), so the database
+    must be a scratch one, e.g. the postgis_benchmark service of docker-compose.yml. The
+    ipums_api cache is disabled so that getters always hit the database.
+
+    Returns:
+    - Benchmark metadata and, per step, sub-step and getter, its wall time and peak RSS
+    """
+    ipums_api.disable_cache()
+    ipums_api.enable_profiling()
+    ipums_api.clear_profile_records()
+
+    with ipums_api.profile(kind='benchmark', name='generate_synthetic_data'):
+        generate_synthetic_data(years=years, n_persons=n_persons, seed=seed)
+
+    with ipums_api.profile(kind='benchmark', name='step 0'):
+        preprocess_data(census_place_table_name='census_place', usa_state_geom_table='usa_state_geom', industry_table_name='industry_1950', path_sql_functions=path_sql_functions)
+
+    for year in years:
+        with ipums_api.profile(kind='benchmark', name='step 1', year=year):
+            create_data_table(geo_table_name=f'geo_{year}', dem_table_name=f'dem_{year}', data_table_name=f'census_{year}', census_place_table_name='census_place', industry_table_name='industry_1950', single_pass=single_pass_data_table)
+        with ipums_api.profile(kind='benchmark', name='step 2', year=year):
+            create_clusters(data_table_name=f'census_{year}', rasterized_census_place_table_name=f'rasterized_census_place_{year}', cluster_table_name=f'cluster_{year}', convolved_raster_table_name=f'convolved_raster_{year}',
+                            convolution_kernel_size=convolution_kernel_size, convolution_kernel_decay_rate=convolution_kernel_decay_rate, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points,
+                            convolution_method=convolution_method, clustering_method=clustering_method, rasterization_method=rasterization_method)
+        with ipums_api.profile(kind='benchmark', name='step 3', year=year):
+            create_cluster_data_tables(data_table_name=f'census_{year}', cluster_table_name=f'cluster_{year}', cluster_industry_table_name=f'cluster_industry_{year}', industry_table_name='industry_1950',
+                                       cluster_census_place_table_name=f'cluster_census_place_{year}', cluster_geometry_table_name=f'cluster_geometry_{year}')
+
+    getters = {'get_cluster_ids': lambda year: ipums_api.get_cluster_ids(year=year),
+               'get_cluster_population': lambda year: ipums_api.get_cluster_population(year=year),
+               'get_cluster_geometry': lambda year: ipums_api.get_cluster_geometry(year=year),
+               'get_cluster_industry_n_workers': lambda year: ipums_api.get_cluster_industry_n_workers(year=year),
+               'get_cluster_census_places': lambda year: ipums_api.get_cluster_census_places(year=year),
+               'get_n_persons': lambda year: ipums_api.get_n_persons(year=year),
+               'get_census_place_occupation_n_persons': lambda year: ipums_api.get_census_place_occupation_n_persons(year=year),
+               'get_census_place_raster_array': lambda year: ipums_api.get_census_place_raster_array(year=year),
+               'get_census_place_raster_points': lambda year: ipums_api.get_census_place_raster_points(year=year),
+               'get_census_place_raster': lambda year: ipums_api.get_census_place_raster(year=year)}
+    with ipums_api.profile(kind='getter', name='get_census_places'):
+        ipums_api.get_census_places()
+    for year in years:
+        for name, getter in getters.items():
+            with ipums_api.profile(kind='getter', name=name, year=year):
+                getter(year)
+    if len(years) > 1:
+        with ipums_api.profile(kind='getter', name='get_cluster_multiyear_matching'):
+            ipums_api.get_cluster_multiyear_matching(year_start=min(years), year_end=max(years))
+
+    summary = ipums_api.get_profile_summary(records=[r for r in ipums_api.get_profile_records() if r['kind'] != 'sql'])
+    results = {f'{kind}/{name}': {'seconds': row['seconds'], 'peak_rss_bytes': row['peak_rss_bytes']} for (kind, name), row in summary.iterrows()}
+    metadata = get_benchmark_metadata(n_persons=n_persons, years=list(years), convolution_kernel_size=convolution_kernel_size, convolution_kernel_decay_rate=convolution_kernel_decay_rate, pixel_threshold=pixel_threshold,
+                                      dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points, convolution_method=convolution_method.value, clustering_method=clustering_method.value,
+                                      rasterization_method=rasterization_method.value, single_pass_data_table=single_pass_data_table, seed=seed)
+    return {**metadata, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the pipeline and the ipums_api getters on synthetic data in a scratch database (POSTGRES_DB must contain "benchmark")')
+    parser.add_argument('--n-persons', type=int, default=10 ** 6)
+    parser.add_argument('--years', type=int, nargs='+', default=[1850, 1860])
+    parser.add_argument('--convolution-method', type=ConvolutionMethod, default=ConvolutionMethod.DIRECT)
+    parser.add_argument('--clustering-method', type=ClusteringMethod, default=ClusteringMethod.SQL)
+    parser.add_argument('--rasterization-method', type=RasterizationMethod, default=RasterizationMethod.SQL)
+    parser.add_argument('--single-pass-data-table', action='store_true')
+    parser.add_argument('--output', type=str, default=None, help='JSON file the results are saved to')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of a baseline run to compare against')
+    args = parser.parse_args()
+
+    benchmark = run_benchmark_suite(n_persons=args.n_persons, years=args.years, convolution_method=args.convolution_method, clustering_method=args.clustering_method,
+                                    rasterization_method=args.rasterization_method, single_pass_data_table=args.single_pass_data_table)
+    for name, result in benchmark['results'].items():
+        logger.info(f"{name}: {result['seconds']:.2f}s, peak RSS {result['peak_rss_bytes'] / 1024 ** 2:.0f} MB")
+    if args.output is not None:
+        save_benchmark_results(results=benchmark, path=args.output)
+    if args.compare is not None:
+        logger.info(f"Comparison with {args.compare}:\n{compare_benchmark_results(baseline=load_benchmark_results(path=args.compare), current=benchmark).to_string()}")
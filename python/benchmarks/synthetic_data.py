@@ -0,0 +1,100 @@
+from typing import List
+
+import ipums_api
+
+logger = ipums_api.get_logger('synthetic_data')
+
+# Continental United States in EPSG:4326, the extent of the template raster
+usa_bbox = (-124.7, 25.0, -67.0, 49.4)
+max_census_place_id = 69491
+
+
+def generate_synthetic_data(years: List[int], n_persons: int, n_census_places: int = max_census_place_id, n_cities: int = 2000, n_industries: int = 150, city_spread: float = 0.3,
+                            duplicate_fraction: float = 0.001, missing_geo_fraction: float = 0.05, invalid_census_place_fraction: float = 0.01, seed: float = 0.5) -> None:
+    """
+    Create raw census_place, usa_state_geom, industry_1950, dem_{year} and geo_{year} tables filled with synthetic data
+
+    The tables have the layout of the bash loaders, so the pipeline runs on them from step 0.
+    All rows are generated server-side with generate_series, which scales to 100M persons.
+    Census places are scattered around n_cities random city centers, persons pick census
+    places with a heavy-tailed popularity, and a few histids are duplicated, missing from the
+    geo table or matched to out-of-range census places, as in the IPUMS extracts. Only runs
+    against a database whose name contains 'benchmark', as existing tables and the pipeline
+    outputs of the years are dropped.
+
+    Parameters:
+    - years: census years to generate dem_{year} and geo_{year} for
+    - n_persons: number of persons per year
+    - n_census_places: number of census places
+    - n_cities: number of city centers the census places are scattered around
+    - n_industries: number of industry codes
+    - city_spread: standard deviation in degrees of the census places around their city center
+    - duplicate_fraction: fraction of histids that occur twice
+    - missing_geo_fraction: fraction of persons without a geo row
+    - invalid_census_place_fraction: fraction of geo rows with a census place id above max_census_place_id
+    - seed: seed of the server-side random generator, in [-1, 1]
+    """
+    _check_benchmark_database()
+    xmin, ymin, xmax, ymax = usa_bbox
+
+    logger.debug("Generating census_place, usa_state_geom and industry_1950")
+    query = (f"CREATE EXTENSION IF NOT EXISTS postgis;"
+             f"DROP TABLE IF EXISTS census_place, usa_state_geom, industry_1950 CASCADE;"
+             f"SELECT setseed({seed});"
+             f"CREATE TABLE census_place (id INTEGER, potential_match VARCHAR(50), lat FLOAT, lon FLOAT, geom GEOGRAPHY(Point, 4326));"
+             f"INSERT INTO census_place "
+             f"WITH cities AS ("
+             f"SELECT city, {xmin} + {xmax - xmin} * random() AS lon, {ymin} + {ymax - ymin} * random() AS lat "
+             f"FROM generate_series(0, {n_cities - 1}) AS city), "
+             f"places AS ("
+             f"SELECT id, id % {n_cities} AS city, {city_spread} * sqrt(-2 * ln(1 - random())) AS radius, 2 * pi() * random() AS angle "
+             f"FROM generate_series(1, {n_census_places}) AS id), "
+             f"place_coordinates AS ("
+             f"SELECT id, LEAST(GREATEST(cities.lat + radius * sin(angle), {ymin}), {ymax}) AS lat, LEAST(GREATEST(cities.lon + radius * cos(angle), {xmin}), {xmax}) AS lon "
+             f"FROM places JOIN cities ON places.city = cities.city) "
+             f"SELECT id, 'place_' || id, lat, lon, ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography "
+             f"FROM place_coordinates;"
+             f"CREATE TABLE usa_state_geom (state_code VARCHAR(2), state_name VARCHAR(25), geom GEOMETRY(MultiPolygon, 4326));"
+             f"INSERT INTO usa_state_geom "
+             f"SELECT lpad((state_row * 8 + state_col)::text, 2, '0'), 'State ' || (state_row * 8 + state_col), "
+             f"ST_Multi(ST_MakeEnvelope({xmin} + state_col * {(xmax - xmin) / 8}, {ymin} + state_row * {(ymax - ymin) / 6}, {xmin} + (state_col + 1) * {(xmax - xmin) / 8}, {ymin} + (state_row + 1) * {(ymax - ymin) / 6}, 4326)) "
+             f"FROM generate_series(0, 5) AS state_row CROSS JOIN generate_series(0, 7) AS state_col;"
+             f"CREATE TABLE industry_1950 (code INTEGER, description VARCHAR(70), refined_categories VARCHAR(70), broad_categories VARCHAR(70), "
+             f"agri_non_agri VARCHAR(70), detailed VARCHAR(70), no_agriculture VARCHAR(70), all_group_by VARCHAR (70));"
+             f"INSERT INTO industry_1950 "
+             f"SELECT code, 'Industry ' || code, 'Refined ' || code % 20, 'Broad ' || code % 8, CASE WHEN code < 10 THEN 'Agriculture' ELSE 'Non agriculture' END, "
+             f"'Detailed ' || code % 40, CASE WHEN code < 10 THEN 'Agriculture' ELSE 'Industry ' || code % 40 END, 'All' "
+             f"FROM generate_series(0, {n_industries - 1}) AS code;")
+    ipums_api.execute_sql(query=query)
+
+    n_unique_persons = n_persons - int(n_persons * duplicate_fraction)
+    for year in years:
+        logger.debug(f"Generating dem_{year} and geo_{year} with {n_persons} persons")
+        # Persons beyond n_unique_persons reuse the histids of the first ones
+        histid_index = f"CASE WHEN i > {n_unique_persons} THEN i - {n_unique_persons} ELSE i END"
+        histid = f"uuid_in(md5('{year}_' || {histid_index})::cstring)::text"
+        # Pipeline outputs of an earlier run are dropped as well, so the pipeline can run again from step 1
+        query = (f"DROP TABLE IF EXISTS dem_{year}, geo_{year}, census_{year}, rasterized_census_place_{year}, convolved_raster_{year}, cluster_{year}, cluster_industry_{year}, cluster_census_place_{year}, cluster_geometry_{year} CASCADE;"
+                 f"SELECT setseed({seed});"
+                 f"CREATE TABLE dem_{year} (year INTEGER, occ1950 INTEGER, ind1950 INTEGER, histid VARCHAR(36), hik VARCHAR(21));"
+                 f"INSERT INTO dem_{year} "
+                 f"SELECT {year}, floor(1000 * random())::INTEGER, floor({n_industries} * random())::INTEGER, upper({histid}), "
+                 f"CASE WHEN random() < 0.5 THEN lpad(i::text, 21, '0') ELSE '                     ' END "
+                 f"FROM generate_series(1, {n_persons}) AS i;"
+                 f"CREATE TABLE geo_{year} (potential_match VARCHAR(50), match_type VARCHAR(50), lat FLOAT, lon FLOAT, state_fips_geomatch VARCHAR(2), county_fips_geomatch VARCHAR(5), "
+                 f"cluster_k5 INTEGER, cpp_placeid INTEGER, histid VARCHAR(36));"
+                 f"INSERT INTO geo_{year} (cpp_placeid, histid) "
+                 f"SELECT CASE WHEN random() < {invalid_census_place_fraction} THEN {max_census_place_id + 1} + floor(1000 * random())::INTEGER "
+                 f"ELSE 1 + floor({n_census_places} * power(random(), 3))::INTEGER END, {histid} "
+                 f"FROM generate_series(1, {n_persons}) AS i "
+                 f"WHERE random() >= {missing_geo_fraction};")
+        ipums_api.execute_sql(query=query)
+
+
+def _check_benchmark_database() -> None:
+    with ipums_api.db_connection() as con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT current_database()")
+            database_name = cursor.fetchone()[0]
+    if 'benchmark' not in database_name:
+        raise ValueError(f"Synthetic data drops the census tables, refusing to generate it in database {database_name} (its name must contain 'benchmark')")
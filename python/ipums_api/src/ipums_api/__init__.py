@@ -1,2 +1,34 @@
-from .db_api import get_cluster_ids, get_industry_codes, get_cluster_population, get_cluster_multiyear_matching, get_cluster_industry_n_workers, IndustryClassification, get_cluster_geometry, get_census_places, get_census_place_raster
-from .utils import next_census_year, previous_census_year, get_db_connection, execute_sql, get_logger
+import importlib
+
+# Public names and the submodule defining them. Submodules are imported on first attribute
+# access, so `import ipums_api` does not load pandas, geopandas, rasterio or psycopg2 up front
+_lazy_attributes = {
+    **{name: 'db_api' for name in ['get_cluster_ids', 'get_industry_codes', 'get_cluster_population', 'get_cluster_multiyear_matching', 'get_cluster_industry_n_workers',
+                                   'IndustryClassification', 'get_cluster_geometry', 'get_census_places', 'get_census_place_raster', 'get_census_place_raster_array',
+                                   'get_census_place_raster_points', 'get_cluster_census_places', 'get_cluster_population_multiyear', 'get_cluster_geometry_multiyear',
+                                   'get_cluster_industry_n_workers_multiyear', 'get_n_persons', 'get_census_place_occupation_n_persons', 'get_cluster_geometry_simplified']},
+    **{name: 'utils' for name in ['next_census_year', 'previous_census_year', 'get_db_connection', 'db_connection', 'init_db_pool', 'close_db_pool', 'execute_sql',
+                                  'table_exists', 'get_logger']},
+    **{name: 'config' for name in ['load_config']},
+    **{name: 'cache' for name in ['enable_cache', 'disable_cache', 'clear_cache']},
+    **{name: 'profiling' for name in ['enable_profiling', 'disable_profiling', 'profile', 'get_profile_records', 'clear_profile_records', 'get_profile_summary']},
+    **{name: 'streaming' for name in ['iter_query', 'iter_census_places', 'iter_cluster_geometry', 'iter_cluster_industry_n_workers', 'iter_census_persons', 'export_to_parquet']},
+    **{name: 'industry_analytics' for name in ['load_industry_matrices', 'get_cluster_industry_shares', 'get_cluster_industry_diversity', 'get_matched_cluster_industry_changes']},
+    **{name: 'cluster_lookup' for name in ['LookupMethod', 'get_point_cluster_ids', 'get_point_cluster_ids_multiyear', 'get_cluster_index', 'clear_cluster_indexes']},
+    **{name: 'vector_tiles' for name in ['get_cluster_tile', 'clear_tile_cache', 'serve_cluster_tiles']},
+}
+
+__all__ = list(_lazy_attributes)
+
+
+def __getattr__(name):
+    if name not in _lazy_attributes:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{_lazy_attributes[name]}', __name__), name)
+    # Later accesses find the attribute directly and no longer go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
@@ -0,0 +1,180 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Union
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from .config import load_env_file
+from .utils import db_connection, get_logger
+
+logger = get_logger('cache')
+
+# Filled by get_cache_config on first use, so importing this module does not read config.env
+cache_config = {}
+_eviction_lock = threading.Lock()
+
+
+def get_cache_config() -> dict:
+    if not cache_config:
+        load_env_file()
+        cache_config.update({
+            # Opt-in, as table versions only change synchronously when a table is recreated or rewritten (see get_table_versions)
+            "enabled": os.getenv('IPUMS_API_CACHE', '0') != '0',
+            "cache_dir": os.getenv('IPUMS_API_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ipums_api')),
+            "max_bytes": int(os.getenv('IPUMS_API_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+        })
+    return cache_config
+
+
+def enable_cache(cache_dir: str = None, max_bytes: int = None) -> None:
+    get_cache_config()
+    cache_config['enabled'] = True
+    if cache_dir is not None:
+        cache_config['cache_dir'] = cache_dir
+    if max_bytes is not None:
+        cache_config['max_bytes'] = max_bytes
+
+
+def disable_cache() -> None:
+    get_cache_config()['enabled'] = False
+
+
+def clear_cache() -> None:
+    for file_path in _get_cache_files():
+        os.remove(file_path)
+
+
+def get_table_versions(table_names: List[str], con=None) -> Dict[str, Union[List[int], None]]:
+    """
+    Get a version of each table from the catalog
+
+    The version combines the table oid (new when the pipeline drops and recreates a table),
+    its relfilenode (new when the table is rewritten or truncated) and its cumulative number
+    of inserted, updated and deleted tuples (changes on in-place modifications). The tuple
+    counts are reported to the statistics collector asynchronously, so right after an in-place
+    modification the version can still be the previous one. Missing tables have version None.
+    """
+    query = ("SELECT c.oid::BIGINT, c.relfilenode::BIGINT, COALESCE(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0) "
+             "FROM pg_class c LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid "
+             "WHERE c.oid = to_regclass(%s)")
+    versions = {}
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            for table_name in table_names:
+                cursor.execute(query, (table_name,))
+                version = cursor.fetchone()
+                versions[table_name] = None if version is None else [int(v) for v in version]
+    return versions
+
+
+def cached(tables: Callable[[Dict], List[str]]):
+    """
+    Cache the DataFrame returned by a getter on disk, keyed by the function, its arguments and the versions of the tables it reads
+
+    Results are stored as (Geo)Parquet files in cache_config['cache_dir'] and evicted least
+    recently used first once the directory grows beyond cache_config['max_bytes']. The con
+    argument is used for the version lookup but is not part of the key.
+
+    Parameters:
+    - tables: function mapping the bound arguments of the getter to the tables it reads
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not get_cache_config()['enabled']:
+                return func(*args, **kwargs)
+
+            bound_args = signature.bind(*args, **kwargs)
+            bound_args.apply_defaults()
+            arguments = {name: value for name, value in bound_args.arguments.items() if name != 'con'}
+            table_versions = get_table_versions(table_names=tables(arguments), con=bound_args.arguments.get('con'))
+            key = _get_cache_key(func_name=func.__qualname__, arguments=arguments, table_versions=table_versions)
+
+            result = _read_cache(key=key)
+            if result is not None:
+                logger.debug(f"Cache hit for {func.__qualname__}")
+                return result
+
+            result = func(*args, **kwargs)
+            _write_cache(key=key, result=result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _get_cache_key(func_name: str, arguments: Dict, table_versions: Dict) -> str:
+    key_json = json.dumps({'function': func_name, 'arguments': arguments, 'table_versions': table_versions}, sort_keys=True, default=_json_default)
+    return hashlib.sha256(key_json.encode()).hexdigest()
+
+
+def _json_default(value):
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, 'value'):
+        return value.value
+    return str(value)
+
+
+def _read_cache(key: str) -> Union['pd.DataFrame', None]:
+    # Imported here so enabling or clearing the cache does not load the geo stack
+    import pandas as pd
+    import geopandas as gpd
+
+    for suffix, reader in (('geoparquet', gpd.read_parquet), ('parquet', pd.read_parquet)):
+        file_path = os.path.join(get_cache_config()['cache_dir'], f'{key}.{suffix}')
+        if not os.path.exists(file_path):
+            continue
+        result = reader(file_path)
+        # The modification time doubles as the last access time for LRU eviction
+        os.utime(file_path)
+        return result
+    return None
+
+
+def _write_cache(key: str, result: 'pd.DataFrame') -> None:
+    import geopandas as gpd
+
+    os.makedirs(get_cache_config()['cache_dir'], exist_ok=True)
+    suffix = 'geoparquet' if isinstance(result, gpd.GeoDataFrame) else 'parquet'
+    file_path = os.path.join(get_cache_config()['cache_dir'], f'{key}.{suffix}')
+    tmp_file_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    result.to_parquet(tmp_file_path)
+    os.replace(tmp_file_path, file_path)
+    _evict(max_bytes=get_cache_config()['max_bytes'])
+
+
+def _evict(max_bytes: int) -> None:
+    with _eviction_lock:
+        cache_files = []
+        for file_path in _get_cache_files():
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            cache_files.append((stat.st_mtime, stat.st_size, file_path))
+
+        total_bytes = sum(size for _, size, _ in cache_files)
+        for _, size, file_path in sorted(cache_files):
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+
+def _get_cache_files() -> List[str]:
+    cache_dir = get_cache_config()['cache_dir']
+    if not os.path.isdir(cache_dir):
+        return []
+    return [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith('parquet')]
@@ -0,0 +1,131 @@
+import threading
+from enum import Enum
+from typing import List, Dict
+
+import numpy as np
+import pandas as pd
+import shapely
+from affine import Affine
+from pyproj import Transformer
+from rasterio import features
+
+from .utils import db_connection, get_logger
+from .cache import get_table_versions
+from .db_api import cluster_table_name, get_cluster_geometry
+from .raster_postgis import get_raster_metadata
+
+logger = get_logger('cluster_lookup')
+
+cluster_srid = 5070
+_cluster_indexes = {}
+_cluster_indexes_lock = threading.Lock()
+
+
+class LookupMethod(Enum):
+    STRTREE = 'strtree'
+    GRID = 'grid'
+
+
+def get_point_cluster_ids(x: np.ndarray, y: np.ndarray, year: int, crs: str = 'EPSG:4326', method: LookupMethod = LookupMethod.GRID, batch_size: int = 10 ** 6, con=None) -> np.ndarray:
+    """
+    Find the cluster of year containing each point
+
+    The cluster geometries are indexed in memory once per year and method (see get_cluster_index)
+    and the points are projected to EPSG:5070 and looked up in batches of batch_size.
+
+    Parameters:
+    - x: x coordinates of the points (longitudes for EPSG:4326)
+    - y: y coordinates of the points (latitudes for EPSG:4326)
+    - year: census year of the clusters
+    - crs: CRS of the coordinates
+    - method: STRTREE tests the points against the cluster polygons, GRID reads the cluster of
+      their 1 km pixel from the clusters rasterized on the pipeline grid, which is exact as the
+      clusters are unions of its pixels
+    - batch_size: number of points looked up at a time
+
+    Returns:
+    - An int32 numpy array with the cluster id of each point, -1 for points outside every cluster
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    assert x.shape == y.shape, "x and y must have the same shape"
+    cluster_index = get_cluster_index(year=year, method=method, con=con)
+    transformer = Transformer.from_crs(crs, f'EPSG:{cluster_srid}', always_xy=True)
+
+    cluster_ids = np.full(x.shape, -1, dtype=np.int32)
+    flat_x, flat_y, flat_cluster_ids = x.reshape(-1), y.reshape(-1), cluster_ids.reshape(-1)
+    for start in range(0, len(flat_x), batch_size):
+        batch_x, batch_y = transformer.transform(flat_x[start:start + batch_size], flat_y[start:start + batch_size])
+        lookup = _lookup_grid if method == LookupMethod.GRID else _lookup_strtree
+        flat_cluster_ids[start:start + batch_size] = lookup(cluster_index=cluster_index, x=np.asarray(batch_x), y=np.asarray(batch_y))
+    return cluster_ids
+
+
+def get_point_cluster_ids_multiyear(x: np.ndarray, y: np.ndarray, years: List[int], crs: str = 'EPSG:4326', method: LookupMethod = LookupMethod.GRID, batch_size: int = 10 ** 6, con=None) -> pd.DataFrame:
+    """
+    Find the clusters of several years containing each point
+
+    Returns:
+    - A DataFrame with one int32 column of cluster ids per year and one row per point, see get_point_cluster_ids
+    """
+    assert len(years) > 0, "At least one year must be given"
+    return pd.DataFrame({year: get_point_cluster_ids(x=x, y=y, year=year, crs=crs, method=method, batch_size=batch_size, con=con).reshape(-1) for year in years})
+
+
+def get_cluster_index(year: int, method: LookupMethod = LookupMethod.GRID, con=None) -> Dict:
+    """
+    Get the in-memory index of the clusters of a year, built on first use
+
+    Indexes are kept per (year, method) and rebuilt when cluster_{year} changes (see cache.get_table_versions).
+
+    Returns:
+    - For STRTREE, a dict with the STRtree of the cluster polygons and their cluster_ids; for
+      GRID, a dict with the int32 grid of cluster ids (-1 outside clusters) and its transform
+    """
+    table_version = get_table_versions(table_names=[f"{cluster_table_name}{year}"], con=con)
+    key = (year, method.value)
+    with _cluster_indexes_lock:
+        cluster_index = _cluster_indexes.get(key)
+        if cluster_index is None or cluster_index['table_version'] != table_version:
+            logger.debug(f"Building the {method.value} index of {cluster_table_name}{year}")
+            build_index = _build_grid_index if method == LookupMethod.GRID else _build_strtree_index
+            cluster_index = {**build_index(year=year, con=con), 'table_version': table_version}
+            _cluster_indexes[key] = cluster_index
+    return cluster_index
+
+
+def clear_cluster_indexes() -> None:
+    with _cluster_indexes_lock:
+        _cluster_indexes.clear()
+
+
+def _build_strtree_index(year: int, con=None) -> Dict:
+    cluster_geo = get_cluster_geometry(year=year, con=con)
+    return {'tree': shapely.STRtree(cluster_geo.geometry.to_numpy()), 'cluster_ids': cluster_geo.index.to_numpy(dtype=np.int32)}
+
+
+def _build_grid_index(year: int, con=None) -> Dict:
+    # The convolved raster the clusters were extracted from gives the pipeline grid
+    with db_connection(con=con) as con_:
+        metadata = get_raster_metadata(con=con_, raster_table=f'convolved_raster_{year}')
+    cluster_geo = get_cluster_geometry(year=year, con=con)
+    transform = Affine(metadata['scalex'], metadata['skewx'], metadata['upperleftx'], metadata['skewy'], metadata['scaley'], metadata['upperlefty'])
+    grid = features.rasterize(zip(cluster_geo.geometry, cluster_geo.index.astype(np.int32)), out_shape=(metadata['height'], metadata['width']), transform=transform, fill=-1, dtype=np.int32)
+    return {'grid': grid, 'transform': transform}
+
+
+def _lookup_strtree(cluster_index: Dict, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    # Clusters never touch (touching pixels are DBSCAN neighbours), so each point is within at most one
+    point_indices, tree_indices = cluster_index['tree'].query(shapely.points(x, y), predicate='within')
+    cluster_ids = np.full(len(x), -1, dtype=np.int32)
+    cluster_ids[point_indices] = cluster_index['cluster_ids'][tree_indices]
+    return cluster_ids
+
+
+def _lookup_grid(cluster_index: Dict, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    grid, transform = cluster_index['grid'], cluster_index['transform']
+    cols = np.floor((x - transform.c) / transform.a).astype(np.int64)
+    rows = np.floor((y - transform.f) / transform.e).astype(np.int64)
+    inside = (rows >= 0) & (rows < grid.shape[0]) & (cols >= 0) & (cols < grid.shape[1])
+    cluster_ids = np.full(len(x), -1, dtype=np.int32)
+    cluster_ids[inside] = grid[rows[inside], cols[inside]]
+    return cluster_ids
@@ -1,14 +1,71 @@
-from dotenv import load_dotenv
 import os
+import threading
 
-load_dotenv(dotenv_path='/Users/andrea/Desktop/PhD/Data/ipums/config.env')
+# Filled by load_config, on the first connection unless it is called explicitly
+db_config = {}
+db_pool_config = {}
+_config_lock = threading.Lock()
+_env_file_loaded = False
 
-db_config = {
-    "dbname": os.getenv('POSTGRES_DB'),
-    "host": os.getenv('POSTGRES_HOST'),
-    "port": os.getenv('POSTGRES_PORT'),
-    "user": os.getenv('POSTGRES_USER'),
-    "password": os.getenv('POSTGRES_PASSWORD')
-}
 
+def load_env_file(env_path: str = None) -> None:
+    """
+    Load a .env file into the environment, without overriding variables that are already set
 
+    Without env_path, the file is IPUMS_API_ENV_PATH if set, else config.env in the working
+    directory if it exists, and is only loaded once.
+
+    Parameters:
+    - env_path: .env file to load
+    """
+    global _env_file_loaded
+    with _config_lock:
+        if env_path is None and _env_file_loaded:
+            return
+        env_path_ = env_path if env_path is not None else os.getenv('IPUMS_API_ENV_PATH')
+        if env_path_ is None and os.path.exists('config.env'):
+            env_path_ = 'config.env'
+        if env_path_ is not None:
+            assert os.path.exists(env_path_), f"Config file {env_path_} does not exist"
+            # Imported here so importing ipums_api has no side effects
+            from dotenv import load_dotenv
+            load_dotenv(dotenv_path=env_path_)
+        _env_file_loaded = True
+
+
+def load_config(env_path: str = None) -> None:
+    """
+    Resolve the database settings from the environment and an optional .env file (see load_env_file)
+
+    Variables already set in the environment take precedence over the file.
+
+    Parameters:
+    - env_path: .env file with the POSTGRES_* variables
+    """
+    load_env_file(env_path=env_path)
+    with _config_lock:
+        db_config.clear()
+        db_config.update({
+            "dbname": os.getenv('POSTGRES_DB'),
+            "host": os.getenv('POSTGRES_HOST'),
+            "port": os.getenv('POSTGRES_PORT'),
+            "user": os.getenv('POSTGRES_USER'),
+            "password": os.getenv('POSTGRES_PASSWORD')
+        })
+        db_pool_config.clear()
+        db_pool_config.update({
+            "minconn": int(os.getenv('POSTGRES_POOL_MINCONN', 1)),
+            "maxconn": int(os.getenv('POSTGRES_POOL_MAXCONN', 8))
+        })
+
+
+def get_db_config() -> dict:
+    if not db_config:
+        load_config()
+    return db_config
+
+
+def get_db_pool_config() -> dict:
+    if not db_pool_config:
+        load_config()
+    return db_pool_config
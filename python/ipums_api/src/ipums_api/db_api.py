@@ -1,15 +1,22 @@
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Tuple
 from enum import Enum
 
 import numpy as np
 import pandas as pd
-import networkx as nx
 import geopandas as gpd
+import xarray as xr
+from scipy import sparse
+from scipy.sparse import csgraph
 
-from .utils import get_db_connection, next_census_year, get_logger
+from .utils import db_connection, next_census_year, get_logger
+from .cache import cached
+from .raster_postgis import load_raster
 
 cluster_table_name = 'cluster_'
 cluster_industry_table_name = f'cluster_industry_'
+cluster_census_place_table_name = 'cluster_census_place_'
+census_table_name = 'census_'
+cluster_geometry_table_name = 'cluster_geometry_'
 logger = get_logger('db_api')
 
 
@@ -23,153 +30,390 @@ class IndustryClassification(Enum):
     ALL = 'all_group_by'
 
 
-def get_cluster_ids(year: int, pop_low: int = 0, pop_high: int = None) -> List[int]:
+def get_cluster_ids(year: int, pop_low: int = 0, pop_high: int = None, con=None) -> List[int]:
     pop_high_ = 10 ** 10 if pop_high is None else pop_high
     query = (f"SELECT cluster_id FROM {cluster_table_name}{year} "
              f"WHERE population >= {pop_low} AND population <= {pop_high_}")
 
-    con = get_db_connection()
-    with con.cursor() as cursor:
-        cursor.execute(query)
-        cluster_ids = cursor.fetchall()
-    con.close()
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            cursor.execute(query)
+            cluster_ids = cursor.fetchall()
 
     cluster_ids = [cid[0] for cid in cluster_ids]
     return cluster_ids
 
 
-def get_cluster_geometry(year: int, cluster_ids: List[int] = None) -> pd.DataFrame:
-    cluster_ids_ = _process_cluster_ids(year=year, cluster_ids=cluster_ids)
-    con = get_db_connection()
-    query = f"SELECT cluster_id, geom FROM {cluster_table_name}{year} WHERE cluster_id = ANY(%s)"
-    cluster_geo = gpd.GeoDataFrame.from_postgis(query, con, params=(cluster_ids_,), geom_col='geom')
+@cached(tables=lambda args: [f"{cluster_table_name}{args['year']}"])
+def get_cluster_geometry(year: int, cluster_ids: List[int] = None, con=None) -> pd.DataFrame:
+    with db_connection(con=con) as con_:
+        cluster_ids_ = _process_cluster_ids(year=year, cluster_ids=cluster_ids, con=con_)
+        query = f"SELECT cluster_id, geom FROM {cluster_table_name}{year} WHERE cluster_id = ANY(%s)"
+        cluster_geo = gpd.GeoDataFrame.from_postgis(query, con_, params=(cluster_ids_,), geom_col='geom')
     cluster_geo = cluster_geo.set_index('cluster_id')
-    con.close()
     return cluster_geo
 
 
-def get_census_places() -> pd.DataFrame:
-    con = get_db_connection()
+@cached(tables=lambda args: [f"{cluster_geometry_table_name}{args['year']}"])
+def get_cluster_geometry_simplified(year: int, zoom: int, cluster_ids: List[int] = None, con=None) -> gpd.GeoDataFrame:
+    """
+    Get the cluster geometry of a year simplified for a web map zoom level, in EPSG:3857
+
+    The geometry is read from the level of cluster_geometry_{year} closest below zoom (or its
+    coarsest level), so it holds about one vertex per screen pixel. Clusters that collapse at
+    that level are left out.
+    """
+    cluster_filter, params = ("", [zoom]) if cluster_ids is None else ("AND cluster_id = ANY(%s)", [zoom, [int(cid) for cid in cluster_ids]])
+    query = (f"SELECT cluster_id, population, geom FROM {cluster_geometry_table_name}{year} "
+             f"WHERE zoom = {_get_cluster_geometry_zoom_level_sql(year=year)} {cluster_filter}")
+    with db_connection(con=con) as con_:
+        cluster_geo = gpd.GeoDataFrame.from_postgis(query, con_, params=params, geom_col='geom')
+    return cluster_geo.set_index('cluster_id')
+
+
+def _get_cluster_geometry_zoom_level_sql(year: int) -> str:
+    # Subquery of the level of cluster_geometry_{year} used for the zoom passed as its first parameter
+    return (f"COALESCE((SELECT MAX(zoom) FROM {cluster_geometry_table_name}{year} WHERE zoom <= %s), "
+            f"(SELECT MIN(zoom) FROM {cluster_geometry_table_name}{year}))")
+
+
+@cached(tables=lambda args: ['census_place'])
+def get_census_places(con=None) -> pd.DataFrame:
     query = "SELECT * FROM census_place"
-    census_places = gpd.GeoDataFrame.from_postgis(query, con, geom_col='geom')
-    con.close()
+    with db_connection(con=con) as con_:
+        census_places = gpd.GeoDataFrame.from_postgis(query, con_, geom_col='geom')
     return census_places
 
 
-def get_census_place_raster(year: int, convolved: bool = True) -> pd.DataFrame:
-    raster_table_name = f'convolved_raster_{year}' if convolved else f'rasterized_census_places_{year}'
-    con = get_db_connection()
+@cached(tables=lambda args: [_get_census_place_raster_table_name(year=args['year'], convolved=args['convolved'])])
+def get_census_place_raster(year: int, convolved: bool = True, con=None) -> pd.DataFrame:
+    raster_table_name = _get_census_place_raster_table_name(year=year, convolved=convolved)
     query = (f"WITH pixels AS ("
              f"SELECT (ST_PixelAsPolygons(rast, 1, TRUE)).* FROM {raster_table_name})"
              f"SELECT val AS population, geom AS geom "
              f"FROM pixels;")
-    census_place_raster = gpd.GeoDataFrame.from_postgis(query, con, geom_col='geom')
-    con.close()
+    with db_connection(con=con) as con_:
+        census_place_raster = gpd.GeoDataFrame.from_postgis(query, con_, geom_col='geom')
     return census_place_raster
 
 
-def get_industry_codes() -> List[int]:
+def get_census_place_raster_array(year: int, convolved: bool = True, bbox: Tuple[float, float, float, float] = None, bbox_srid: int = 5070, downsample: int = None,
+                                  resampling_algorithm: str = 'NearestNeighbour', con=None) -> xr.DataArray:
+    """
+    Load the (convolved) census place raster of a year as a rioxarray DataArray
+
+    Clipping to bbox and downsampling by an integer factor are done server-side, so only the
+    requested pixels are transferred.
+    """
+    raster_table_name = _get_census_place_raster_table_name(year=year, convolved=convolved)
+    with db_connection(con=con) as con_:
+        raster = load_raster(con=con_, raster_table=raster_table_name, bbox=bbox, bbox_srid=bbox_srid, downsample=downsample, resampling_algorithm=resampling_algorithm)
+    return raster
+
+
+@cached(tables=lambda args: [_get_census_place_raster_table_name(year=args['year'], convolved=args['convolved'])])
+def get_census_place_raster_points(year: int, convolved: bool = True, bbox: Tuple[float, float, float, float] = None, bbox_srid: int = 5070, con=None) -> pd.DataFrame:
+    """
+    Get the non-zero pixels of the (convolved) census place raster of a year as points at the pixel centroids
+    """
+    raster_table_name = _get_census_place_raster_table_name(year=year, convolved=convolved)
+    tile_filter, pixel_filter, params = "", "", None
+    if bbox is not None:
+        envelope = "ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, %s), ST_SRID(rast))"
+        tile_filter = f"WHERE ST_Intersects(rast, {envelope})"
+        pixel_filter = "AND ST_Intersects(geom, ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, %s), ST_SRID(geom)))"
+        params = (*bbox, bbox_srid) * 2
+
+    query = (f"WITH pixels AS ("
+             f"SELECT (ST_PixelAsCentroids(rast, 1, TRUE)).* FROM {raster_table_name} {tile_filter})"
+             f"SELECT val AS population, geom AS geom "
+             f"FROM pixels "
+             f"WHERE val <> 0 {pixel_filter};")
+    with db_connection(con=con) as con_:
+        census_place_raster_points = gpd.GeoDataFrame.from_postgis(query, con_, params=params, geom_col='geom')
+    return census_place_raster_points
+
+
+def _get_census_place_raster_table_name(year: int, convolved: bool) -> str:
+    return f'convolved_raster_{year}' if convolved else f'rasterized_census_place_{year}'
+
+
+@cached(tables=lambda args: [f"{cluster_census_place_table_name}{args['year']}"])
+def get_cluster_census_places(year: int, cluster_ids: List[int] = None, con=None) -> pd.DataFrame:
+    """
+    Get the census places falling within each cluster of a year from the precomputed crosswalk
+    """
+    with db_connection(con=con) as con_:
+        cluster_ids_ = _process_cluster_ids(year=year, cluster_ids=cluster_ids, con=con_)
+        with con_.cursor() as cursor:
+            cursor.execute(f"SELECT cluster_id, census_place_id FROM {cluster_census_place_table_name}{year} "
+                           f"WHERE cluster_id = ANY(%s) "
+                           f"ORDER BY cluster_id, census_place_id", (cluster_ids_,))
+            cluster_census_places = cursor.fetchall()
+
+    cluster_census_places = pd.DataFrame(cluster_census_places, columns=['cluster_id', 'census_place_id']).astype({'cluster_id': int, 'census_place_id': int})
+    return cluster_census_places
+
+
+def get_industry_codes(con=None) -> List[int]:
     query = f"SELECT code FROM industry_1950"
 
-    con = get_db_connection()
-    with con.cursor() as cursor:
-        cursor.execute(query)
-        industry_codes = cursor.fetchall()
-    con.close()
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            cursor.execute(query)
+            industry_codes = cursor.fetchall()
 
     industry_codes = [cid[0] for cid in industry_codes]
     return industry_codes
 
 
-def get_cluster_population(year: int, cluster_ids: List[int] = None) -> pd.DataFrame:
-    cluster_ids_ = _process_cluster_ids(year=year, cluster_ids=cluster_ids)
-
-    con = get_db_connection()
-    with con.cursor() as cursor:
-        cursor.execute(f"SELECT cluster_id, population FROM {cluster_table_name}{year} "
-                       f"WHERE cluster_id = ANY(%s)", (cluster_ids_,))
-        cluster_population = cursor.fetchall()
-    con.close()
+def get_cluster_population(year: int, cluster_ids: List[int] = None, con=None) -> pd.DataFrame:
+    with db_connection(con=con) as con_:
+        cluster_ids_ = _process_cluster_ids(year=year, cluster_ids=cluster_ids, con=con_)
+        with con_.cursor() as cursor:
+            cursor.execute(f"SELECT cluster_id, population FROM {cluster_table_name}{year} "
+                           f"WHERE cluster_id = ANY(%s)", (cluster_ids_,))
+            cluster_population = cursor.fetchall()
 
     cluster_population = pd.DataFrame(cluster_population, columns=['cluster_id', 'population']).astype({'cluster_id': int, 'population': float}).set_index('cluster_id')
     return cluster_population
 
 
-def get_cluster_multiyear_matching(year_start: int, year_end: int) -> List[Dict]:
-    matching_graph = nx.Graph()
-    current_year = year_start
-    while current_year < year_end:
-        next_year = next_census_year(year=current_year)
-        matching_year = _get_cluster_intersection_matching(year=current_year)
-        edges = [(f"{current_year}_{row['id_1']}", f"{next_year}_{row['id_2']}") for i, row in matching_year.iterrows()]
-        matching_graph.add_edges_from(edges)
-        current_year = next_year
+def get_cluster_multiyear_matching(year_start: int, year_end: int, con=None) -> List[Dict]:
+    matching = _get_cluster_multiyear_intersection_matching(year_start=year_start, year_end=year_end, con=con)
+    if matching.empty:
+        return []
 
-    connected_components = list(nx.connected_components(matching_graph))
+    # Encode (year, cluster_id) nodes as integers so components can be computed on a sparse graph
+    stride = int(max(matching['id_1'].max(), matching['id_2'].max())) + 1
+    node_keys = np.concatenate([matching['year_1'].to_numpy() * stride + matching['id_1'].to_numpy(),
+                                matching['year_2'].to_numpy() * stride + matching['id_2'].to_numpy()])
+    nodes, node_index = np.unique(node_keys, return_inverse=True)
+    node_index = node_index.reshape(-1)
+    n_edges = len(matching)
+    graph = sparse.coo_matrix((np.ones(n_edges, dtype=np.int8), (node_index[:n_edges], node_index[n_edges:])), shape=(len(nodes), len(nodes)))
+    _, component_labels = csgraph.connected_components(graph, directed=False)
+
+    # nodes are sorted by (year, cluster_id), so a stable sort by label keeps each component ordered
+    order = np.argsort(component_labels, kind='stable')
+    node_years, node_cluster_ids = nodes[order] // stride, nodes[order] % stride
+    component_bounds = np.flatnonzero(np.diff(component_labels[order])) + 1
 
     matching_json = []
-    for i, component in enumerate(connected_components):
+    for i, (years, cluster_ids) in enumerate(zip(np.split(node_years, component_bounds), np.split(node_cluster_ids, component_bounds))):
+        year_bounds = np.flatnonzero(np.diff(years)) + 1
+        component_years = [int(y) for y in years[np.concatenate([[0], year_bounds])]]
         component_dict = {'component_id': i}
-        for node in component:
-            year, cluster_id = (int(x) for x in node.split('_'))
-            if year not in component_dict:
-                component_dict[year] = [cluster_id]
-            else:
-                component_dict[year].append(cluster_id)
-
-        years = sorted(k for k in component_dict if k != 'component_id')
-        component_dict['years'] = years
+        for year, year_cluster_ids in zip(component_years, np.split(cluster_ids, year_bounds)):
+            component_dict[year] = year_cluster_ids.tolist()
+        component_dict['years'] = component_years
         matching_json.append(component_dict)
 
     return matching_json
 
 
-def _get_cluster_intersection_matching(year: int) -> pd.DataFrame:
-    next_year = next_census_year(year=year)
-    con = get_db_connection()
+def _get_cluster_multiyear_intersection_matching(year_start: int, year_end: int, con=None) -> pd.DataFrame:
+    year_pairs = []
+    current_year = year_start
+    while current_year < year_end:
+        next_year = next_census_year(year=current_year)
+        year_pairs.append((current_year, next_year))
+        current_year = next_year
 
-    with con.cursor() as cursor:
-        query = (f"SELECT c1.cluster_id AS id1, c2.cluster_id AS id2 "
-                 f"FROM {cluster_table_name}{year} c1 JOIN {cluster_table_name}{next_year} c2 "
-                 f"ON ST_Intersects(c1.geom, c2.geom)")
-        cursor.execute(query)
-        matching = cursor.fetchall()
-    con.close()
+    if not year_pairs:
+        return pd.DataFrame(columns=['year_1', 'id_1', 'year_2', 'id_2'], dtype=np.int64)
 
-    matching = pd.DataFrame(matching, columns=['id_1', 'id_2']).astype({'id_1': int, 'id_2': int})
-    return matching
+    query = " UNION ALL ".join(f"SELECT {year} AS year_1, c1.cluster_id AS id_1, {next_year} AS year_2, c2.cluster_id AS id_2 "
+                               f"FROM {cluster_table_name}{year} c1 JOIN {cluster_table_name}{next_year} c2 "
+                               f"ON ST_Intersects(c1.geom, c2.geom)" for year, next_year in year_pairs)
 
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            cursor.execute(query)
+            matching = cursor.fetchall()
+
+    matching = pd.DataFrame(matching, columns=['year_1', 'id_1', 'year_2', 'id_2']).astype(np.int64)
+    return matching
 
-def get_cluster_industry_n_workers(year: int, cluster_ids: List[int] = None, industry_classification: IndustryClassification = IndustryClassification.BASE_CODES) -> pd.DataFrame:
-    cluster_ids_ = _process_cluster_ids(year=year, cluster_ids=cluster_ids)
 
-    con = get_db_connection()
-    with con.cursor() as cursor:
-        cursor.execute(f"WITH cluster_industry_n_workers AS ( "
-                       f"SELECT cluster_id, ind1950, n_workers FROM {cluster_industry_table_name}{year} "
-                       f"WHERE cluster_id = ANY(%s))"
-                       f"SELECT cluster_id, {industry_classification.value} AS industry_code, SUM(n_workers) AS n_workers "
-                       f"FROM cluster_industry_n_workers JOIN industry_1950 "
-                       f"ON cluster_industry_n_workers.ind1950 = industry_1950.code "
-                       f"GROUP BY cluster_id, industry_code", (cluster_ids_,))
-        n_workers_by_cluster_and_industry = cursor.fetchall()
-    con.close()
+def get_cluster_industry_n_workers(year: int, cluster_ids: List[int] = None, industry_classification: IndustryClassification = IndustryClassification.BASE_CODES, con=None) -> pd.DataFrame:
+    with db_connection(con=con) as con_:
+        cluster_ids_ = _process_cluster_ids(year=year, cluster_ids=cluster_ids, con=con_)
+        with con_.cursor() as cursor:
+            cursor.execute(f"WITH cluster_industry_n_workers AS ( "
+                           f"SELECT cluster_id, ind1950, n_workers FROM {cluster_industry_table_name}{year} "
+                           f"WHERE cluster_id = ANY(%s))"
+                           f"SELECT cluster_id, {industry_classification.value} AS industry_code, SUM(n_workers) AS n_workers "
+                           f"FROM cluster_industry_n_workers JOIN industry_1950 "
+                           f"ON cluster_industry_n_workers.ind1950 = industry_1950.code "
+                           f"GROUP BY cluster_id, industry_code", (cluster_ids_,))
+            n_workers_by_cluster_and_industry = cursor.fetchall()
 
     n_workers_by_cluster_and_industry = pd.DataFrame(n_workers_by_cluster_and_industry, columns=['cluster_id', 'industry_code', 'n_workers']).astype({'cluster_id': int, 'industry_code': str, 'n_workers': float})
     return n_workers_by_cluster_and_industry
 
 
-def _process_cluster_ids(year: int, cluster_ids: Union[List[int], np.ndarray, None]) -> List[int]:
+def get_cluster_population_multiyear(years: List[int], cluster_ids: Dict[int, List[int]] = None, con=None) -> pd.DataFrame:
+    """
+    Get the population of the clusters of several years with one query
+
+    Parameters:
+    - years: census years
+    - cluster_ids: optional cluster ids per year; years without ids (or cluster_ids=None) get all their clusters
+
+    Returns:
+    - A DataFrame indexed by (year, cluster_id) with an int32 population column
+    """
+    assert len(years) > 0, "At least one year must be given"
+    subqueries, params = [], []
+    for year in years:
+        cluster_filter, cluster_params = _get_multiyear_cluster_filter(year=year, cluster_ids=cluster_ids)
+        subqueries.append(f"SELECT {year} AS year, cluster_id, population FROM {cluster_table_name}{year} {cluster_filter}")
+        params += cluster_params
+
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            cursor.execute(" UNION ALL ".join(subqueries), params)
+            cluster_population = cursor.fetchall()
+
+    cluster_population = pd.DataFrame(cluster_population, columns=['year', 'cluster_id', 'population']).astype({'year': np.int16, 'cluster_id': np.int32, 'population': np.int32})
+    return cluster_population.set_index(['year', 'cluster_id'])
+
+
+@cached(tables=lambda args: [f"{cluster_table_name}{year}" for year in args['years']])
+def get_cluster_geometry_multiyear(years: List[int], cluster_ids: Dict[int, List[int]] = None, con=None) -> pd.DataFrame:
+    """
+    Get the geometry of the clusters of several years with one query
+
+    Returns:
+    - A GeoDataFrame indexed by (year, cluster_id), see get_cluster_population_multiyear
+    """
+    assert len(years) > 0, "At least one year must be given"
+    subqueries, params = [], []
+    for year in years:
+        cluster_filter, cluster_params = _get_multiyear_cluster_filter(year=year, cluster_ids=cluster_ids)
+        subqueries.append(f"SELECT {year} AS year, cluster_id, geom FROM {cluster_table_name}{year} {cluster_filter}")
+        params += cluster_params
+
+    with db_connection(con=con) as con_:
+        cluster_geo = gpd.GeoDataFrame.from_postgis(" UNION ALL ".join(subqueries), con_, params=params, geom_col='geom')
+    cluster_geo = cluster_geo.astype({'year': np.int16, 'cluster_id': np.int32}).set_index(['year', 'cluster_id'])
+    return cluster_geo
+
+
+def get_cluster_industry_n_workers_multiyear(years: List[int], cluster_ids: Dict[int, List[int]] = None, industry_classification: IndustryClassification = IndustryClassification.BASE_CODES, con=None) -> pd.DataFrame:
+    """
+    Get the number of workers by cluster and industry of several years with one query
+
+    Returns:
+    - A long DataFrame indexed by (year, cluster_id) with a categorical industry_code column and an
+      int32 n_workers column, see get_cluster_population_multiyear
+    """
+    assert len(years) > 0, "At least one year must be given"
+    subqueries, params = [], []
+    for year in years:
+        cluster_filter, cluster_params = _get_multiyear_cluster_filter(year=year, cluster_ids=cluster_ids)
+        subqueries.append(f"SELECT {year} AS year, cluster_id, {industry_classification.value}::TEXT AS industry_code, SUM(n_workers) AS n_workers "
+                          f"FROM {cluster_industry_table_name}{year} JOIN industry_1950 "
+                          f"ON {cluster_industry_table_name}{year}.ind1950 = industry_1950.code "
+                          f"{cluster_filter} "
+                          f"GROUP BY cluster_id, industry_code")
+        params += cluster_params
+
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            cursor.execute(" UNION ALL ".join(subqueries), params)
+            n_workers_by_cluster_and_industry = cursor.fetchall()
+
+    n_workers_by_cluster_and_industry = pd.DataFrame(n_workers_by_cluster_and_industry, columns=['year', 'cluster_id', 'industry_code', 'n_workers']).astype(
+        {'year': np.int16, 'cluster_id': np.int32, 'industry_code': 'category', 'n_workers': np.int32})
+    return n_workers_by_cluster_and_industry.set_index(['year', 'cluster_id'])
+
+
+def get_n_persons(year: int, census_place_ids: List[int] = None, cluster_ids: List[int] = None, industry_codes: List[int] = None, occupation_codes: List[int] = None, con=None) -> int:
+    """
+    Count the persons of census_{year} matching all the given filters
+
+    census_{year} is range partitioned by census place, so filtering by census places (or by
+    clusters, which are resolved to their census places first) only scans the matching partitions.
+
+    Parameters:
+    - year: census year
+    - census_place_ids: census places the persons live in
+    - cluster_ids: clusters of year the persons live in
+    - industry_codes: ind1950 codes of the persons
+    - occupation_codes: occ1950 codes of the persons
+
+    Returns:
+    - The number of persons
+    """
+    with db_connection(con=con) as con_:
+        person_filter, params = _get_person_filter(year=year, census_place_ids=census_place_ids, cluster_ids=cluster_ids, industry_codes=industry_codes, occupation_codes=occupation_codes, con=con_)
+        with con_.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {census_table_name}{year} {person_filter}", params)
+            n_persons = cursor.fetchone()[0]
+    return int(n_persons)
+
+
+@cached(tables=lambda args: [f"{census_table_name}{args['year']}"] + ([] if args['cluster_ids'] is None else [f"{cluster_census_place_table_name}{args['year']}"]))
+def get_census_place_occupation_n_persons(year: int, census_place_ids: List[int] = None, cluster_ids: List[int] = None, industry_codes: List[int] = None, occupation_codes: List[int] = None, con=None) -> pd.DataFrame:
+    """
+    Count the persons of census_{year} by census place and occupation
+
+    Takes the same filters as get_n_persons. Persons without a census place or an occupation code are left out.
+
+    Returns:
+    - A DataFrame indexed by (census_place_id int32, occ1950 int16) with an int32 n_persons column
+    """
+    with db_connection(con=con) as con_:
+        person_filter, params = _get_person_filter(year=year, census_place_ids=census_place_ids, cluster_ids=cluster_ids, industry_codes=industry_codes, occupation_codes=occupation_codes, con=con_)
+        person_filter = f"{person_filter} AND" if person_filter else "WHERE"
+        with con_.cursor() as cursor:
+            cursor.execute(f"SELECT census_place_id, occ1950, COUNT(*) AS n_persons FROM {census_table_name}{year} "
+                           f"{person_filter} census_place_id IS NOT NULL AND occ1950 IS NOT NULL "
+                           f"GROUP BY census_place_id, occ1950 "
+                           f"ORDER BY census_place_id, occ1950", params)
+            n_persons = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+
+    index = pd.MultiIndex.from_arrays([n_persons[:, 0].astype(np.int32), n_persons[:, 1].astype(np.int16)], names=['census_place_id', 'occ1950'])
+    return pd.DataFrame({'n_persons': n_persons[:, 2].astype(np.int32)}, index=index)
+
+
+def _get_person_filter(year: int, census_place_ids: Union[List[int], None], cluster_ids: Union[List[int], None], industry_codes: Union[List[int], None], occupation_codes: Union[List[int], None], con=None) -> Tuple[str, List]:
+    # Clusters are resolved to census place ids client side: partitions are only pruned at
+    # planning time when census_place_id is compared to constants, not to a joined table
+    if cluster_ids is not None:
+        cluster_census_place_ids = get_cluster_census_places(year=year, cluster_ids=cluster_ids, con=con)['census_place_id']
+        census_place_ids = cluster_census_place_ids if census_place_ids is None else np.intersect1d(census_place_ids, cluster_census_place_ids)
+
+    conditions, params = [], []
+    for column, values in [('census_place_id', census_place_ids), ('ind1950', industry_codes), ('occ1950', occupation_codes)]:
+        if values is not None:
+            conditions.append(f"{column} = ANY(%s)")
+            params.append([int(v) for v in values])
+    if not conditions:
+        return "", []
+    return "WHERE " + " AND ".join(conditions), params
+
+
+def _get_multiyear_cluster_filter(year: int, cluster_ids: Union[Dict[int, List[int]], None]) -> Tuple[str, List]:
+    # Without ids the filter is left out, rather than fetching every id to feed = ANY(%s)
+    if cluster_ids is None or cluster_ids.get(year) is None:
+        return "", []
+    return "WHERE cluster_id = ANY(%s)", [[int(cid) for cid in cluster_ids[year]]]
+
+
+def _process_cluster_ids(year: int, cluster_ids: Union[List[int], np.ndarray, None], con=None) -> List[int]:
     if cluster_ids is None:
-        return get_cluster_ids(year=year)
+        return get_cluster_ids(year=year, con=con)
     else:
         cluster_ids = [int(cid) for cid in cluster_ids]
         return cluster_ids
 
 
-def _process_industry_codes(industry_codes: Union[List[int], np.ndarray, None]) -> List[int]:
+def _process_industry_codes(industry_codes: Union[List[int], np.ndarray, None], con=None) -> List[int]:
     if industry_codes is None:
-        return get_industry_codes()
+        return get_industry_codes(con=con)
     else:
         industry_codes = [int(cid) for cid in industry_codes]
         return industry_codes
@@ -0,0 +1,243 @@
+from typing import List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .utils import db_connection, get_logger
+from .db_api import census_table_name, cluster_census_place_table_name, IndustryClassification, get_cluster_multiyear_matching
+
+logger = get_logger('industry_analytics')
+
+
+def load_industry_matrices(years: List[int], con=None) -> Dict:
+    """
+    Load the census place x industry counts and the cluster crosswalks of several years as sparse matrices
+
+    Each table is read once, after which every measure of this module is computed in memory
+    with sparse matrix products, for all years and industry classifications at once. Rows of
+    the census place matrices are stacked across years (row year_index * n_census_places + census_place_id),
+    so that the cluster indicator matrix is block diagonal by year.
+
+    Parameters:
+    - years: census years, whose census_{year} and cluster_census_place_{year} tables must exist
+
+    Returns:
+    - A dict with
+      - years: the census years, sorted, in the order of the year blocks of the matrices
+      - n_census_places: number of census place rows per year (largest census place id + 1)
+      - census_place_industry: (years x census places, industry codes) csr matrix of person counts
+      - cluster_census_place: (year and cluster, years x census places) csr indicator matrix
+      - cluster_index: (year, cluster_id) MultiIndex of the rows of cluster_census_place
+      - industry_codes: ind1950 codes of the columns of census_place_industry
+      - classification_indicator: (industry codes, classification categories) csr indicator matrix
+      - category_index: (classification, industry_code) MultiIndex of the columns of classification_indicator
+    """
+    assert len(years) > 0, "At least one year must be given"
+    # Year blocks are in ascending order, which the measures rely on to find the block of a year
+    years = sorted(set(years))
+    counts_query = " UNION ALL ".join(f"SELECT {year} AS year, census_place_id, ind1950, COUNT(*) AS n_workers FROM {census_table_name}{year} "
+                                      f"WHERE census_place_id IS NOT NULL AND ind1950 IS NOT NULL "
+                                      f"GROUP BY census_place_id, ind1950" for year in years)
+    crosswalk_query = " UNION ALL ".join(f"SELECT {year} AS year, cluster_id, census_place_id FROM {cluster_census_place_table_name}{year}" for year in years)
+    classification_columns = [classification.value for classification in IndustryClassification]
+
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            cursor.execute(counts_query)
+            counts = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 4)
+            cursor.execute(crosswalk_query)
+            crosswalk = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+            cursor.execute(f"SELECT {', '.join(f'{column}::TEXT' for column in classification_columns)} FROM industry_1950 ORDER BY code")
+            industries = pd.DataFrame(cursor.fetchall(), columns=classification_columns)
+
+    year_index = {year: i for i, year in enumerate(years)}
+    n_census_places = int(max(counts[:, 1].max(initial=0), crosswalk[:, 2].max(initial=0))) + 1
+    industry_codes = industries[IndustryClassification.BASE_CODES.value].astype(int).to_numpy()
+
+    count_rows = np.vectorize(year_index.get, otypes=[np.int64])(counts[:, 0]) * n_census_places + counts[:, 1] if len(counts) else np.array([], dtype=np.int64)
+    count_cols = np.searchsorted(industry_codes, counts[:, 2])
+    census_place_industry = sparse.csr_matrix((counts[:, 3], (count_rows, count_cols)), shape=(len(years) * n_census_places, len(industry_codes)))
+
+    cluster_keys = pd.MultiIndex.from_arrays([crosswalk[:, 0], crosswalk[:, 1]], names=['year', 'cluster_id'])
+    cluster_rows, cluster_index = cluster_keys.factorize(sort=True)
+    crosswalk_cols = np.vectorize(year_index.get, otypes=[np.int64])(crosswalk[:, 0]) * n_census_places + crosswalk[:, 2] if len(crosswalk) else np.array([], dtype=np.int64)
+    cluster_census_place = sparse.csr_matrix((np.ones(len(crosswalk), dtype=np.int64), (cluster_rows, crosswalk_cols)), shape=(len(cluster_index), len(years) * n_census_places))
+
+    # One block of columns per classification, each industry code falls in exactly one category of each block
+    indicator_rows, categories = [], []
+    for classification in IndustryClassification:
+        codes, uniques = pd.factorize(industries[classification.value].astype(str), sort=True)
+        indicator_rows.append(sparse.csr_matrix((np.ones(len(codes), dtype=np.int64), (np.arange(len(codes)), codes)), shape=(len(codes), len(uniques))))
+        categories += [(classification.value, category) for category in uniques]
+    classification_indicator = sparse.hstack(indicator_rows, format='csr')
+    category_index = pd.MultiIndex.from_tuples(categories, names=['classification', 'industry_code'])
+
+    logger.debug(f"Loaded {census_place_industry.nnz} census place x industry counts and {len(cluster_index)} clusters of {len(years)} years")
+    return {'years': years, 'n_census_places': n_census_places, 'census_place_industry': census_place_industry, 'cluster_census_place': cluster_census_place,
+            'cluster_index': cluster_index.set_names(['year', 'cluster_id']), 'industry_codes': industry_codes, 'classification_indicator': classification_indicator, 'category_index': category_index}
+
+
+def get_cluster_industry_shares(matrices: Dict, classifications: List[IndustryClassification] = None) -> pd.DataFrame:
+    """
+    Get the number of workers, the industry share and the location quotient of each cluster, industry and classification
+
+    The location quotient is the share of the industry in the cluster divided by its share in
+    the whole census of the same year (all census places, inside clusters or not).
+
+    Parameters:
+    - matrices: output of load_industry_matrices
+    - classifications: industry classifications (defaults to all of them)
+
+    Returns:
+    - A long DataFrame indexed by (year, cluster_id, classification, industry_code) with an int32
+      n_workers column and float share and location_quotient columns, for non-zero counts only
+    """
+    cluster_counts, category_index, block = _get_cluster_category_counts(matrices=matrices, classifications=classifications)
+    national_shares = _get_block_shares(counts=_get_national_category_counts(matrices=matrices, classifications=classifications), block=block)
+    cluster_shares = _get_block_shares(counts=cluster_counts, block=block).tocoo()
+
+    year_rows = np.searchsorted(matrices['years'], matrices['cluster_index'].get_level_values('year')[cluster_shares.row])
+    national_share = np.asarray(national_shares[year_rows, cluster_shares.col]).ravel()
+    n_workers = np.asarray(cluster_counts[cluster_shares.row, cluster_shares.col]).ravel()
+
+    shares = pd.DataFrame({'year': matrices['cluster_index'].get_level_values('year')[cluster_shares.row].astype(np.int16),
+                           'cluster_id': matrices['cluster_index'].get_level_values('cluster_id')[cluster_shares.row].astype(np.int32),
+                           'classification': pd.Categorical(category_index.get_level_values('classification')[cluster_shares.col]),
+                           'industry_code': pd.Categorical(category_index.get_level_values('industry_code')[cluster_shares.col]),
+                           'n_workers': n_workers.astype(np.int32), 'share': cluster_shares.data, 'location_quotient': cluster_shares.data / national_share})
+    return shares.set_index(['year', 'cluster_id', 'classification', 'industry_code']).sort_index()
+
+
+def get_cluster_industry_diversity(matrices: Dict, classifications: List[IndustryClassification] = None) -> pd.DataFrame:
+    """
+    Get diversity indices of the industry mix of each cluster, for each classification
+
+    Parameters:
+    - matrices: output of load_industry_matrices
+    - classifications: industry classifications (defaults to all of them)
+
+    Returns:
+    - A DataFrame indexed by (year, cluster_id, classification) with the n_workers, the number of
+      industries with workers (n_industries), the Herfindahl-Hirschman index (sum of squared
+      shares) and the Shannon entropy (in nats) of the industry shares
+    """
+    cluster_counts, category_index, block = _get_cluster_category_counts(matrices=matrices, classifications=classifications)
+    shares = _get_block_shares(counts=cluster_counts, block=block)
+    entropy_terms = shares.copy()
+    entropy_terms.data = -shares.data * np.log(shares.data)
+
+    n_workers, n_industries = cluster_counts @ block, (cluster_counts > 0).astype(np.int64) @ block
+    herfindahl, entropy = shares.multiply(shares).tocsr() @ block, entropy_terms @ block
+
+    classification_names = category_index.get_level_values('classification').unique()
+    index = pd.MultiIndex.from_product([np.arange(len(matrices['cluster_index'])), np.arange(len(classification_names))])
+    rows, cols = index.get_level_values(0), index.get_level_values(1)
+    diversity = pd.DataFrame({'year': matrices['cluster_index'].get_level_values('year')[rows].astype(np.int16),
+                              'cluster_id': matrices['cluster_index'].get_level_values('cluster_id')[rows].astype(np.int32),
+                              'classification': pd.Categorical(classification_names[cols]),
+                              'n_workers': np.asarray(n_workers.toarray()).ravel().astype(np.int32),
+                              'n_industries': np.asarray(n_industries.toarray()).ravel().astype(np.int32),
+                              'herfindahl': np.asarray(herfindahl.toarray()).ravel(),
+                              'shannon_entropy': np.asarray(entropy.toarray()).ravel()})
+    return diversity.set_index(['year', 'cluster_id', 'classification']).sort_index()
+
+
+def get_matched_cluster_industry_changes(matrices: Dict, classifications: List[IndustryClassification] = None, con=None) -> pd.DataFrame:
+    """
+    Get the change of the industry mix along the clusters matched across consecutive years
+
+    Clusters are grouped in the components of get_cluster_multiyear_matching, so merged or
+    split clusters are compared as a whole. Each component is compared between each pair of
+    consecutive loaded years it spans.
+
+    Parameters:
+    - matrices: output of load_industry_matrices
+    - classifications: industry classifications (defaults to all of them)
+
+    Returns:
+    - A long DataFrame indexed by (component_id, year, next_year, classification, industry_code)
+      with the n_workers and share of both years and their differences, for industries with
+      workers in either year
+    """
+    cluster_counts, category_index, block = _get_cluster_category_counts(matrices=matrices, classifications=classifications)
+    years = matrices['years']
+    components = get_cluster_multiyear_matching(year_start=min(years), year_end=max(years), con=con)
+
+    # Indicator of the clusters of each (component, year), restricted to the loaded years and clusters
+    component_year_keys, component_rows, cluster_rows = [], [], []
+    for component in components:
+        for year in component['years']:
+            cluster_positions = matrices['cluster_index'].get_indexer([(year, cluster_id) for cluster_id in component[year]]) if year in years else np.array([], dtype=np.int64)
+            cluster_positions = cluster_positions[cluster_positions >= 0]
+            if len(cluster_positions):
+                component_rows += [len(component_year_keys)] * len(cluster_positions)
+                cluster_rows += cluster_positions.tolist()
+                component_year_keys.append((component['component_id'], year))
+    component_year_index = pd.MultiIndex.from_arrays([[key[0] for key in component_year_keys], [key[1] for key in component_year_keys]], names=['component_id', 'year'])
+    component_indicator = sparse.csr_matrix((np.ones(len(cluster_rows), dtype=np.int64), (component_rows, cluster_rows)), shape=(len(component_year_keys), len(matrices['cluster_index'])))
+    component_counts = (component_indicator @ cluster_counts).tocsr()
+
+    # Rows are in (component, year) order, so consecutive rows of the same component are consecutive years
+    component_ids = component_year_index.get_level_values('component_id').to_numpy(dtype=np.int64)
+    previous_rows = np.flatnonzero(component_ids[:-1] == component_ids[1:])
+    next_rows = previous_rows + 1
+    previous_counts, next_counts = component_counts[previous_rows], component_counts[next_rows]
+    previous_shares = _get_block_shares(counts=previous_counts, block=block)
+    next_shares = _get_block_shares(counts=next_counts, block=block)
+
+    pattern = (previous_counts + next_counts).tocoo()
+    rows, cols = pattern.row, pattern.col
+    changes = pd.DataFrame({'component_id': component_ids[previous_rows][rows].astype(np.int32),
+                            'year': component_year_index.get_level_values('year')[previous_rows][rows].astype(np.int16),
+                            'next_year': component_year_index.get_level_values('year')[next_rows][rows].astype(np.int16),
+                            'classification': pd.Categorical(category_index.get_level_values('classification')[cols]),
+                            'industry_code': pd.Categorical(category_index.get_level_values('industry_code')[cols]),
+                            'n_workers': _get_sparse_values(matrix=previous_counts, rows=rows, cols=cols).astype(np.int32),
+                            'next_n_workers': _get_sparse_values(matrix=next_counts, rows=rows, cols=cols).astype(np.int32),
+                            'share': _get_sparse_values(matrix=previous_shares, rows=rows, cols=cols),
+                            'next_share': _get_sparse_values(matrix=next_shares, rows=rows, cols=cols)})
+    changes['n_workers_change'] = changes['next_n_workers'] - changes['n_workers']
+    changes['share_change'] = changes['next_share'] - changes['share']
+    return changes.set_index(['component_id', 'year', 'next_year', 'classification', 'industry_code']).sort_index()
+
+
+def _get_classification_columns(matrices: Dict, classifications: List[IndustryClassification] = None) -> Tuple[np.ndarray, pd.MultiIndex, sparse.csr_matrix]:
+    # Columns of classification_indicator of the requested classifications, and the indicator of their classification blocks
+    classification_values = [classification.value for classification in (IndustryClassification if classifications is None else classifications)]
+    category_classifications = matrices['category_index'].get_level_values('classification')
+    columns = np.flatnonzero(category_classifications.isin(classification_values))
+    category_index = matrices['category_index'][columns]
+    block_codes, _ = pd.factorize(category_index.get_level_values('classification'))
+    block = sparse.csr_matrix((np.ones(len(columns), dtype=np.int64), (np.arange(len(columns)), block_codes)), shape=(len(columns), block_codes.max(initial=-1) + 1))
+    return columns, category_index, block
+
+
+def _get_cluster_category_counts(matrices: Dict, classifications: List[IndustryClassification] = None) -> Tuple[sparse.csr_matrix, pd.MultiIndex, sparse.csr_matrix]:
+    # (clusters of all years, categories of all classifications) counts with one chain of sparse products
+    columns, category_index, block = _get_classification_columns(matrices=matrices, classifications=classifications)
+    cluster_counts = matrices['cluster_census_place'] @ matrices['census_place_industry'] @ matrices['classification_indicator'][:, columns]
+    return cluster_counts.tocsr(), category_index, block
+
+
+def _get_national_category_counts(matrices: Dict, classifications: List[IndustryClassification] = None) -> sparse.csr_matrix:
+    columns, _, _ = _get_classification_columns(matrices=matrices, classifications=classifications)
+    n_years, n_census_places = len(matrices['years']), matrices['n_census_places']
+    year_indicator = sparse.csr_matrix((np.ones(n_years * n_census_places, dtype=np.int64), (np.repeat(np.arange(n_years), n_census_places), np.arange(n_years * n_census_places))),
+                                       shape=(n_years, n_years * n_census_places))
+    return (year_indicator @ matrices['census_place_industry'] @ matrices['classification_indicator'][:, columns]).tocsr()
+
+
+def _get_sparse_values(matrix: sparse.csr_matrix, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    # Indexing a sparse matrix with empty index arrays gives a matrix rather than an array
+    if len(rows) == 0:
+        return np.array([], dtype=matrix.dtype)
+    return np.asarray(matrix[rows, cols]).ravel()
+
+
+def _get_block_shares(counts: sparse.csr_matrix, block: sparse.csr_matrix) -> sparse.csr_matrix:
+    # Divide each count by the total of its row within its classification block
+    totals = np.asarray((counts @ block).toarray(), dtype=float)
+    shares = counts.tocoo().astype(float)
+    shares.data = shares.data / totals[shares.row, block.indices[shares.col]]
+    return shares.tocsr()
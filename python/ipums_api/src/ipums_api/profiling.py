@@ -0,0 +1,214 @@
+import contextvars
+import json
+import os
+import re
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from .config import load_env_file
+from .utils import get_logger
+
+logger = get_logger('profiling')
+
+# Filled by get_profiling_config on first use, so importing this module does not read config.env
+profiling_config = {}
+_records = []
+_records_lock = threading.Lock()
+_frames = contextvars.ContextVar('profiling_frames', default=())
+# Profiled blocks of all threads of the process, to detect overlapping peak RSS readings
+_active_frames = []
+_active_frames_lock = threading.Lock()
+_explainable_statement = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|CREATE\s+(UNLOGGED\s+)?TABLE\s+\S+\s+AS)\b', re.IGNORECASE)
+
+
+def enable_profiling(explain: bool = False, output_path: str = None) -> None:
+    """
+    Record the wall time of profiled blocks and SQL statements run through execute_sql
+
+    Parameters:
+    - explain: also capture EXPLAIN (ANALYZE, BUFFERS) plans of the statements that support it
+    - output_path: JSON lines file the records are appended to (shared by worker processes)
+    """
+    get_profiling_config()
+    profiling_config['enabled'] = True
+    profiling_config['explain'] = explain
+    if output_path is not None:
+        profiling_config['output_path'] = output_path
+
+
+def disable_profiling() -> None:
+    get_profiling_config()['enabled'] = False
+
+
+def get_profiling_config() -> dict:
+    if not profiling_config:
+        load_env_file()
+        profiling_config.update({
+            "enabled": os.getenv('IPUMS_API_PROFILE', '0') != '0',
+            "explain": os.getenv('IPUMS_API_PROFILE_EXPLAIN', '0') != '0',
+            "output_path": os.getenv('IPUMS_API_PROFILE_PATH')
+        })
+    return profiling_config
+
+
+def get_profile_records(path: str = None) -> List[Dict]:
+    """
+    Get the records of this process, or all records written to the JSON lines file at path
+    """
+    if path is None:
+        with _records_lock:
+            return list(_records)
+
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def clear_profile_records() -> None:
+    with _records_lock:
+        _records.clear()
+
+
+def get_profile_summary(records: List[Dict] = None) -> 'pd.DataFrame':
+    """
+    Aggregate profile records by kind and name, slowest first
+
+    Returns:
+    - A DataFrame indexed by (kind, name) with the number of calls, total and maximum wall
+      time in seconds, total rows and the peak RSS in bytes
+    """
+    import pandas as pd
+
+    records_ = get_profile_records() if records is None else records
+    columns = ['kind', 'name', 'seconds', 'rows', 'peak_rss_bytes']
+    profile = pd.DataFrame([{c: record.get(c) for c in columns} for record in records_], columns=columns)
+    summary = profile.groupby(['kind', 'name']).agg(calls=('seconds', 'size'), seconds=('seconds', 'sum'), max_seconds=('seconds', 'max'),
+                                                    rows=('rows', 'sum'), peak_rss_bytes=('peak_rss_bytes', 'max'))
+    return summary.sort_values('seconds', ascending=False)
+
+
+@contextmanager
+def profile(kind: str, name: str, **fields):
+    """
+    Record the wall time and peak RSS of a block as one profile record
+
+    Records of nested blocks and SQL statements carry the names of the enclosing blocks in
+    their context field. Peak RSS is a per process measure, so it is None for blocks that
+    overlapped a profiled block of another thread. Does nothing while profiling is disabled.
+    """
+    if not get_profiling_config()['enabled']:
+        yield
+        return
+
+    frames = _frames.get()
+    frame = {'name': name, 'peak_rss_bytes': 0, 'thread': threading.get_ident(), 'overlapped': False}
+    with _active_frames_lock:
+        other_frames = [f for f in _active_frames if f['thread'] != frame['thread']]
+        for other_frame in other_frames:
+            other_frame['overlapped'] = True
+        frame['overlapped'] = bool(other_frames)
+        if frames:
+            frames[-1]['peak_rss_bytes'] = max(frames[-1]['peak_rss_bytes'], _get_peak_rss())
+        # Resetting the high water mark while another thread is profiled would wipe its reading
+        if not other_frames:
+            _reset_peak_rss()
+        _active_frames.append(frame)
+    token = _frames.set(frames + (frame,))
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        _frames.reset(token)
+        with _active_frames_lock:
+            _active_frames[:] = [f for f in _active_frames if f is not frame]
+            frame['peak_rss_bytes'] = max(frame['peak_rss_bytes'], _get_peak_rss())
+            if frames:
+                frames[-1]['peak_rss_bytes'] = max(frames[-1]['peak_rss_bytes'], frame['peak_rss_bytes'])
+        record(kind=kind, name=name, seconds=seconds, peak_rss_bytes=None if frame['overlapped'] else frame['peak_rss_bytes'], **fields)
+
+
+def record(kind: str, name: str, seconds: float, **fields) -> Dict:
+    profile_record = {'kind': kind, 'name': name, 'seconds': seconds, 'context': ' / '.join(frame['name'] for frame in _frames.get()),
+                      'pid': os.getpid(), 'timestamp': time.time(), **fields}
+    with _records_lock:
+        _records.append(profile_record)
+        if get_profiling_config()['output_path'] is not None:
+            with open(profiling_config['output_path'], 'a') as f:
+                f.write(json.dumps(profile_record, default=str) + '\n')
+
+    logger.debug(json.dumps({k: v for k, v in profile_record.items() if k != 'plan'}, default=str))
+    return profile_record
+
+
+def execute_profiled(cursor, query: str) -> None:
+    """
+    Execute the statements of query one by one on cursor, recording wall time and rows of each
+
+    With profiling_config['explain'], statements supported by EXPLAIN are run through
+    EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) instead, which executes them as well, and the plan
+    is added to their record.
+    """
+    for statement in split_sql_statements(query=query):
+        name = ' '.join(statement.split())[:120]
+        start_time = time.perf_counter()
+        if get_profiling_config()['explain'] and _explainable_statement.match(statement):
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}")
+            plan = cursor.fetchone()[0][0]
+            record(kind='sql', name=name, seconds=time.perf_counter() - start_time, rows=plan['Plan'].get('Actual Rows'), plan=plan)
+        else:
+            cursor.execute(statement)
+            record(kind='sql', name=name, seconds=time.perf_counter() - start_time, rows=cursor.rowcount if cursor.rowcount >= 0 else None)
+
+
+def split_sql_statements(query: str) -> List[str]:
+    """
+    Split a string of SQL statements on the semicolons outside quotes, comments and dollar-quoted bodies
+    """
+    statements, start, i, n = [], 0, 0, len(query)
+    while i < n:
+        char = query[i]
+        if char in ("'", '"'):
+            i = query.find(char, i + 1)
+            # Doubled quotes inside a quoted string are found as two consecutive quoted strings
+            i = n if i == -1 else i + 1
+        elif query.startswith('--', i):
+            i = n if query.find('\n', i) == -1 else query.find('\n', i) + 1
+        elif query.startswith('/*', i):
+            i = n if query.find('*/', i) == -1 else query.find('*/', i) + 2
+        elif char == '$' and re.match(r'\$[A-Za-z_]*\$', query[i:]):
+            tag = re.match(r'\$[A-Za-z_]*\$', query[i:]).group(0)
+            i = query.find(tag, i + len(tag))
+            i = n if i == -1 else i + len(tag)
+        elif char == ';':
+            statements.append(query[start:i])
+            start, i = i + 1, i + 1
+        else:
+            i += 1
+    statements.append(query[start:])
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def _get_peak_rss() -> int:
+    # VmHWM can be reset through /proc/self/clear_refs, ru_maxrss (kilobytes on Linux) is the peak since the process started
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _reset_peak_rss() -> None:
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
@@ -0,0 +1,338 @@
+import struct
+from typing import Dict, Tuple, Iterator
+
+import numpy as np
+import psycopg2
+import rioxarray  # noqa: F401, registers the .rio accessor
+import xarray as xr
+from affine import Affine
+from rasterio.windows import Window
+
+# PostGIS raster WKB pixel types (see raster/doc/RFC2-WellKnownBinaryFormat in the PostGIS sources)
+_pixel_type_to_dtype = {0: np.uint8, 1: np.uint8, 2: np.uint8, 3: np.int8, 4: np.uint8, 5: np.int16, 6: np.uint16, 7: np.int32, 8: np.uint32, 10: np.float32, 11: np.float64}
+_dtype_to_pixel_type = {np.dtype(np.int8): 3, np.dtype(np.uint8): 4, np.dtype(np.int16): 5, np.dtype(np.uint16): 6, np.dtype(np.int32): 7, np.dtype(np.uint32): 8, np.dtype(np.float32): 10, np.dtype(np.float64): 11}
+_header_format = 'BHHddddddiHH'
+_band_has_nodata_flag = 0x40
+_band_is_offline_flag = 0x80
+
+
+def load_raster(con, raster_table: str, raster_column: str = 'rast', bbox: Tuple[float, float, float, float] = None, bbox_srid: int = 5070, downsample: int = None, resampling_algorithm: str = 'NearestNeighbour') -> xr.DataArray:
+    """
+    Load a specific a PostGIS raster into a rioxarray DataArray
+
+    Parameters:
+    - conn: psycopg2 connection object to the database
+    - raster_table: Name of the table containing the raster
+    - raster_column: Name of the column containing the raster
+    - bbox: optional (xmin, ymin, xmax, ymax) window, clipped server-side with ST_Clip
+    - bbox_srid: SRID of the bbox coordinates
+    - downsample: optional integer factor by which the pixel size is increased server-side with ST_Rescale,
+      starting from the coarsest overview of the table whose factor divides it (see create_raster_overviews)
+    - resampling_algorithm: ST_Rescale algorithm used when downsampling
+
+    Returns:
+    - A rioxarray DataArray object representing the raster (tiled tables are merged into one raster)
+    """
+    if downsample is not None and downsample > 1:
+        raster_table, raster_column, overview_factor = _get_raster_overview(con=con, raster_table=raster_table, raster_column=raster_column, downsample=downsample)
+        downsample //= overview_factor
+
+    if bbox is None and (downsample is None or downsample <= 1):
+        return load_raster_mosaic(con=con, raster_table=raster_table, raster_column=raster_column)
+
+    raster_expression, where_clause, params = raster_column, "", []
+    if bbox is not None:
+        envelope = f"ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, %s), ST_SRID({raster_column}))"
+        raster_expression = f"ST_Clip({raster_column}, {envelope}, TRUE)"
+        where_clause = f" WHERE ST_Intersects({raster_column}, {envelope})"
+        params = [*bbox, bbox_srid] * 2
+
+    query = f"SELECT ST_Union({raster_expression}) AS rast FROM {raster_table}{where_clause}"
+    if downsample is not None and downsample > 1:
+        query = (f"SELECT ST_Rescale(rast, ST_ScaleX(rast) * %s, ST_ScaleY(rast) * %s, %s) AS rast "
+                 f"FROM ({query}) AS unioned_raster")
+        params = [downsample, downsample, resampling_algorithm] + params
+
+    with con.cursor() as cursor:
+        cursor.execute(f"SELECT ST_AsBinary(rast) FROM ({query}) AS raster", params)
+        raster = cursor.fetchone()
+
+    if raster is None or raster[0] is None:
+        raise ValueError(f"No raster found in {raster_table} for bbox {bbox}")
+
+    return wkb_to_raster(wkb=raster[0])
+
+
+def _get_raster_overview(con, raster_table: str, raster_column: str, downsample: int) -> Tuple[str, str, int]:
+    # Coarsest overview whose factor divides downsample, or the raster itself (factor 1)
+    with con.cursor() as cursor:
+        cursor.execute("SELECT o_table_name, o_raster_column, overview_factor FROM raster_overviews "
+                       "WHERE r_table_name = %s AND r_raster_column = %s AND %s %% overview_factor = 0 "
+                       "ORDER BY overview_factor DESC LIMIT 1", (raster_table, raster_column, downsample))
+        overview = cursor.fetchone()
+    return (raster_table, raster_column, 1) if overview is None else tuple(overview)
+
+
+def load_raster_mosaic(con, raster_table: str, raster_column: str = 'rast') -> xr.DataArray:
+    """
+    Load all tiles of a PostGIS raster table into one preallocated rioxarray DataArray
+
+    The tile headers are read first to size the output, then the tiles are streamed one at a
+    time through a server-side cursor and decoded from their WKB directly into the output,
+    so peak memory is the output plus one tile.
+    """
+    with con.cursor() as cursor:
+        cursor.execute(f"SELECT ST_UpperLeftX({raster_column}), ST_UpperLeftY({raster_column}), ST_Width({raster_column}), ST_Height({raster_column}), "
+                       f"ST_ScaleX({raster_column}), ST_ScaleY({raster_column}), ST_SkewX({raster_column}), ST_SkewY({raster_column}), ST_SRID({raster_column}) "
+                       f"FROM {raster_table}")
+        tiles = cursor.fetchall()
+
+    if not tiles:
+        raise ValueError(f"No raster found in {raster_table}")
+
+    upper_left_x = min(tile[0] for tile in tiles) if tiles[0][4] > 0 else max(tile[0] for tile in tiles)
+    upper_left_y = max(tile[1] for tile in tiles) if tiles[0][5] < 0 else min(tile[1] for tile in tiles)
+    scale_x, scale_y, skew_x, skew_y, srid = tiles[0][4:]
+    assert skew_x == 0 and skew_y == 0, "Mosaicking is only supported for rasters without skew"
+    width = max(round((tile[0] - upper_left_x) / scale_x) + tile[2] for tile in tiles)
+    height = max(round((tile[1] - upper_left_y) / scale_y) + tile[3] for tile in tiles)
+
+    mosaic = None
+    for tile in iter_raster_tiles(con=con, raster_table=raster_table, raster_column=raster_column):
+        tile_transform = tile.rio.transform()
+        col_off, row_off = round((tile_transform.c - upper_left_x) / scale_x), round((tile_transform.f - upper_left_y) / scale_y)
+        if mosaic is None:
+            nodata = tile.rio.nodata
+            mosaic = np.full((tile.shape[0], height, width), 0 if nodata is None else nodata, dtype=tile.dtype)
+        mosaic[:, row_off:row_off + tile.shape[1], col_off:col_off + tile.shape[2]] = tile.values
+
+    return array_to_raster(values=mosaic, transform=Affine(scale_x, skew_x, upper_left_x, skew_y, scale_y, upper_left_y), srid=srid, nodata=nodata)
+
+
+def iter_raster_tiles(con, raster_table: str, raster_column: str = 'rast', itersize: int = 16) -> Iterator[xr.DataArray]:
+    """
+    Stream the rows of a PostGIS raster table as rioxarray DataArrays through a server-side cursor
+    """
+    with con.cursor(name=f'iter_raster_tiles_{raster_table}') as cursor:
+        cursor.itersize = itersize
+        cursor.execute(f"SELECT ST_AsBinary({raster_column}) FROM {raster_table}")
+        for (wkb,) in cursor:
+            yield wkb_to_raster(wkb=wkb)
+
+
+def get_raster_metadata(con, raster_table: str, raster_column: str = 'rast') -> Dict:
+    """
+    Get the georeference and size of a PostGIS raster, over all its tiles for tiled tables
+
+    Parameters:
+    - conn: psycopg2 connection object to the database
+    - raster_table: Name of the table containing the raster
+    - raster_column: Name of the column containing the raster
+
+    Returns:
+    - A dict with the fields of ST_MetaData (upperleftx, upperlefty, width, height, scalex, scaley, skewx, skewy, srid, numbands)
+    """
+
+    with con.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(ST_UpperLeftX({raster_column})) AS upperleftx, MAX(ST_UpperLeftY({raster_column})) AS upperlefty, "
+                       f"MAX(ST_UpperLeftX({raster_column}) + ST_Width({raster_column}) * ST_ScaleX({raster_column})) AS lowerrightx, "
+                       f"MIN(ST_UpperLeftY({raster_column}) + ST_Height({raster_column}) * ST_ScaleY({raster_column})) AS lowerrighty, "
+                       f"MIN(ST_ScaleX({raster_column})) AS scalex, MIN(ST_ScaleY({raster_column})) AS scaley, MAX(ABS(ST_SkewX({raster_column}))) AS skewx, MAX(ABS(ST_SkewY({raster_column}))) AS skewy, "
+                       f"MIN(ST_SRID({raster_column})) AS srid, MIN(ST_NumBands({raster_column})) AS numbands "
+                       f"FROM {raster_table}")
+        metadata = dict(zip([c.name for c in cursor.description], cursor.fetchone()))
+
+    # The extent is computed for north-up rasters (positive scalex, negative scaley), like the pipeline rasters
+    assert metadata['scalex'] > 0 > metadata['scaley'], f"Unsupported orientation of {raster_table}"
+    metadata['width'] = round((metadata.pop('lowerrightx') - metadata['upperleftx']) / metadata['scalex'])
+    metadata['height'] = round((metadata.pop('lowerrighty') - metadata['upperlefty']) / metadata['scaley'])
+    return metadata
+
+
+def load_raster_window(con, raster_table: str, window: Tuple[int, int, int, int], metadata: Dict, raster_column: str = 'rast') -> xr.DataArray:
+    """
+    Load a rectangular window of pixels of a PostGIS raster into a rioxarray DataArray
+
+    Only the tiles intersecting the window are read (through the spatial index of tiled tables).
+
+    Parameters:
+    - conn: psycopg2 connection object to the database
+    - raster_table: Name of the table containing the raster
+    - window: (row_offset, col_offset, height, width) of the window in pixels
+    - metadata: metadata of the raster as returned by get_raster_metadata
+    - raster_column: Name of the column containing the raster
+
+    Returns:
+    - A rioxarray DataArray object holding only the pixels in the window
+    """
+    row_off, col_off, height, width = window
+    assert metadata['skewx'] == 0 and metadata['skewy'] == 0, "Windowed reads are only supported for rasters without skew"
+
+    # The envelope stops a quarter pixel inside the window so ST_Clip keeps exactly the window's pixels
+    x_bounds = [metadata['upperleftx'] + (col + 0.25) * metadata['scalex'] for col in (col_off, col_off + width - 0.5)]
+    y_bounds = [metadata['upperlefty'] + (row + 0.25) * metadata['scaley'] for row in (row_off, row_off + height - 0.5)]
+
+    envelope = (min(x_bounds), min(y_bounds), max(x_bounds), max(y_bounds), metadata['srid'])
+    with con.cursor() as cursor:
+        cursor.execute(f"SELECT ST_AsBinary(ST_Union(ST_Clip({raster_column}, ST_MakeEnvelope(%s, %s, %s, %s, %s), TRUE))) FROM {raster_table} "
+                       f"WHERE ST_Intersects({raster_column}, ST_MakeEnvelope(%s, %s, %s, %s, %s))", envelope * 2)
+        raster = cursor.fetchone()
+
+    raster_dataset = wkb_to_raster(wkb=raster[0])
+    assert raster_dataset.shape[1:] == (height, width), f"Expected a {height}x{width} window, but got {raster_dataset.shape[1:]}"
+    return raster_dataset
+
+
+def dump_raster(con, data: xr.DataArray, table_name:str, tile_size: int = None):
+    """
+    Dump a rioxarray DataArray into a PostGIS raster table
+
+    :param con: psycopg2 connection object to the database
+    :param data: a rioxarray DataArray object representing the raster
+    :param table_name: Name of the table to store the raster (it must not exist)
+    :param tile_size: optional size in pixels of the square tiles the raster is split into, stored one
+        tile per row with a spatial index on the tile envelopes (edge tiles are smaller)
+    :return: None
+
+    """
+    if tile_size is None:
+        wkb = raster_to_wkb(data=data)
+
+        with con.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {table_name} (rast raster);")
+            cursor.execute(f"INSERT INTO {table_name} (rast) VALUES (ST_RastFromWKB(%s))", (psycopg2.Binary(wkb),))
+            cursor.execute(f"SELECT AddRasterConstraints('{table_name}'::name, 'rast'::name);")
+            con.commit()
+        return
+
+    with con.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {table_name} (rid SERIAL PRIMARY KEY, rast raster);")
+        for row_off in range(0, data.rio.height, tile_size):
+            for col_off in range(0, data.rio.width, tile_size):
+                tile = data.rio.isel_window(Window(col_off=col_off, row_off=row_off, width=min(tile_size, data.rio.width - col_off), height=min(tile_size, data.rio.height - row_off)))
+                cursor.execute(f"INSERT INTO {table_name} (rast) VALUES (ST_RastFromWKB(%s))", (psycopg2.Binary(raster_to_wkb(data=tile)),))
+        cursor.execute(f"CREATE INDEX ON {table_name} USING GIST (ST_ConvexHull(rast));")
+        cursor.execute(f"SELECT AddRasterConstraints('{table_name}'::name, 'rast'::name);")
+        con.commit()
+
+
+def create_raster_overviews(con, raster_table: str, factors: Tuple[int, ...], raster_column: str = 'rast', resampling_algorithm: str = 'NearestNeighbour'):
+    """
+    Create overview tables o_{factor}_{raster_table} of a PostGIS raster table with ST_CreateOverview
+
+    The overviews are registered in raster_overviews, where load_raster looks them up when
+    downsampling. Existing overviews of the table are replaced.
+
+    :param con: psycopg2 connection object to the database
+    :param raster_table: Name of the table containing the raster
+    :param factors: integer downsampling factors of the overviews
+    :param raster_column: Name of the column containing the raster
+    :param resampling_algorithm: ST_CreateOverview resampling algorithm
+    :return: None
+
+    """
+    with con.cursor() as cursor:
+        for factor in factors:
+            assert factor > 1, "Overview factors must be greater than 1"
+            cursor.execute(f"DROP TABLE IF EXISTS o_{factor}_{raster_table};")
+            cursor.execute(f"SELECT ST_CreateOverview('{raster_table}'::regclass, '{raster_column}'::name, %s, %s);", (factor, resampling_algorithm))
+            cursor.execute(f"CREATE INDEX ON o_{factor}_{raster_table} USING GIST (ST_ConvexHull({raster_column}));")
+        con.commit()
+
+
+def append_raster_tile(con, data: xr.DataArray, table_name: str):
+    """
+    Append a rioxarray DataArray as one tile (row) of an existing PostGIS raster table
+
+    :param con: psycopg2 connection object to the database
+    :param data: a rioxarray DataArray object representing the tile
+    :param table_name: Name of the table to store the tile (it must exist and have a rast column)
+    :return: None
+
+    """
+    wkb = raster_to_wkb(data=data)
+
+    with con.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {table_name} (rast) VALUES (ST_RastFromWKB(%s))", (psycopg2.Binary(wkb),))
+        con.commit()
+
+
+def wkb_to_raster(wkb) -> xr.DataArray:
+    """
+    Decode a PostGIS WKB raster into a rioxarray DataArray
+
+    The pixel values are numpy views into the WKB buffer, so no copy is made beyond the
+    buffer returned by the database driver.
+
+    Parameters:
+    - wkb: bytes-like object holding the output of ST_AsBinary(rast)
+
+    Returns:
+    - A rioxarray DataArray with dims (band, y, x)
+    """
+    buffer = memoryview(wkb)
+    byte_order = '<' if buffer[0] == 1 else '>'
+    header_format = byte_order + _header_format
+    _, _, n_bands, scale_x, scale_y, upper_left_x, upper_left_y, skew_x, skew_y, srid, width, height = struct.unpack_from(header_format, buffer, 0)
+    offset = struct.calcsize(header_format)
+
+    bands, nodata = [], None
+    for _ in range(n_bands):
+        band_flags = buffer[offset]
+        offset += 1
+        assert not band_flags & _band_is_offline_flag, "Out-of-db raster bands are not supported"
+        dtype = np.dtype(_pixel_type_to_dtype[band_flags & 0x0F]).newbyteorder(byte_order)
+        band_nodata = np.frombuffer(buffer, dtype=dtype, count=1, offset=offset)[0]
+        offset += dtype.itemsize
+        if band_flags & _band_has_nodata_flag and nodata is None:
+            nodata = band_nodata.item()
+        bands.append(np.frombuffer(buffer, dtype=dtype, count=width * height, offset=offset).reshape(height, width))
+        offset += dtype.itemsize * width * height
+
+    values = bands[0][np.newaxis] if n_bands == 1 else np.stack(bands)
+    return array_to_raster(values=values, transform=Affine(scale_x, skew_x, upper_left_x, skew_y, scale_y, upper_left_y), srid=srid, nodata=nodata)
+
+
+def raster_to_wkb(data: xr.DataArray) -> bytearray:
+    """
+    Encode a rioxarray DataArray as a little-endian PostGIS WKB raster
+
+    The WKB buffer is allocated once and the pixel values are copied into it band by band.
+    """
+    assert data.rio is not None, "The input data must be a rioxarray DataArray"
+    assert data.rio.crs is not None, "The input data must have a CRS"
+    assert data.rio.transform() is not None, "The input data must have a transform"
+
+    raster_array = data.rio
+    width, height, n_bands = raster_array.width, raster_array.height, raster_array.count
+    assert width <= 65535 and height <= 65535, "PostGIS rasters are limited to 65535 pixels per side, store larger rasters as tiles"
+    dtype = np.dtype(data.dtype).newbyteorder('<')
+    pixel_type = _dtype_to_pixel_type[np.dtype(data.dtype)]
+    nodata = raster_array.nodata
+    transform = raster_array.transform()
+
+    header_format = '<' + _header_format
+    header_size = struct.calcsize(header_format)
+    band_size = 1 + dtype.itemsize + dtype.itemsize * width * height
+    wkb = bytearray(header_size + n_bands * band_size)
+    struct.pack_into(header_format, wkb, 0, 1, 0, n_bands, transform.a, transform.e, transform.c, transform.f, transform.b, transform.d, raster_array.crs.to_epsg(), width, height)
+
+    values = data.values.reshape(n_bands, height, width)
+    for band in range(n_bands):
+        offset = header_size + band * band_size
+        wkb[offset] = pixel_type | (_band_has_nodata_flag if nodata is not None else 0)
+        np.frombuffer(wkb, dtype=dtype, count=1, offset=offset + 1)[0] = 0 if nodata is None else nodata
+        np.frombuffer(wkb, dtype=dtype, count=width * height, offset=offset + 1 + dtype.itemsize).reshape(height, width)[...] = values[band]
+
+    return wkb
+
+
+def array_to_raster(values: np.ndarray, transform: Affine, srid: int, nodata) -> xr.DataArray:
+    n_bands, height, width = values.shape
+    x = transform.c + (np.arange(width) + 0.5) * transform.a
+    y = transform.f + (np.arange(height) + 0.5) * transform.e
+    raster = xr.DataArray(values, dims=('band', 'y', 'x'), coords={'band': np.arange(1, n_bands + 1), 'y': y, 'x': x})
+    raster = raster.rio.write_crs(f'EPSG:{srid}').rio.write_transform(transform)
+    if nodata is not None:
+        raster = raster.rio.write_nodata(nodata)
+    return raster
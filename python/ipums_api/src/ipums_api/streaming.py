@@ -0,0 +1,131 @@
+import json
+import uuid
+from typing import Iterable, Iterator, List, Union
+
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .utils import db_connection
+from .db_api import cluster_table_name, cluster_industry_table_name, cluster_census_place_table_name, IndustryClassification
+
+default_itersize = 100_000
+
+
+def iter_query(query: str, params=None, itersize: int = default_itersize, geom_col: str = None, crs: str = None, con=None) -> Iterator[pd.DataFrame]:
+    """
+    Stream the result of a query in DataFrame chunks through a server-side (named) cursor
+
+    Only one chunk of rows is held in client memory at a time. The connection stays checked
+    out until the iterator is exhausted or closed.
+
+    Parameters:
+    - query: SQL query, with %s placeholders for params
+    - params: query parameters
+    - itersize: number of rows fetched from the server and yielded per chunk
+    - geom_col: column holding WKB geometries (e.g. selected with ST_AsBinary), chunks are then GeoDataFrames
+    - crs: CRS of geom_col
+
+    Returns:
+    - An iterator of DataFrames (GeoDataFrames if geom_col is given) of at most itersize rows
+    """
+    with db_connection(con=con) as con_:
+        with con_.cursor(name=f'ipums_api_{uuid.uuid4().hex}') as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    break
+                chunk = pd.DataFrame(rows, columns=[c.name for c in cursor.description])
+                if geom_col is not None:
+                    chunk[geom_col] = gpd.GeoSeries.from_wkb([bytes(wkb) if wkb is not None else None for wkb in chunk[geom_col]], crs=crs)
+                    chunk = gpd.GeoDataFrame(chunk, geometry=geom_col, crs=crs)
+                yield chunk
+
+
+def iter_census_places(itersize: int = default_itersize, con=None) -> Iterator[gpd.GeoDataFrame]:
+    query = "SELECT id, potential_match, ST_AsBinary(geom::geometry) AS geom FROM census_place"
+    return iter_query(query=query, itersize=itersize, geom_col='geom', crs='EPSG:4326', con=con)
+
+
+def iter_cluster_geometry(year: int, cluster_ids: List[int] = None, itersize: int = default_itersize, con=None) -> Iterator[gpd.GeoDataFrame]:
+    cluster_filter, params = _get_cluster_filter(cluster_ids=cluster_ids)
+    query = f"SELECT cluster_id, ST_AsBinary(geom) AS geom, ST_SRID(geom) AS srid FROM {cluster_table_name}{year} {cluster_filter}"
+    for chunk in iter_query(query=query, params=params, itersize=itersize, geom_col='geom', con=con):
+        yield chunk.set_crs(f"EPSG:{chunk['srid'].iloc[0]}").drop(columns='srid').set_index('cluster_id')
+
+
+def iter_cluster_industry_n_workers(year: int, cluster_ids: List[int] = None, industry_classification: IndustryClassification = IndustryClassification.BASE_CODES, itersize: int = default_itersize, con=None) -> Iterator[pd.DataFrame]:
+    cluster_filter, params = _get_cluster_filter(cluster_ids=cluster_ids)
+    query = (f"SELECT cluster_id, {industry_classification.value}::TEXT AS industry_code, SUM(n_workers) AS n_workers "
+             f"FROM {cluster_industry_table_name}{year} JOIN industry_1950 "
+             f"ON {cluster_industry_table_name}{year}.ind1950 = industry_1950.code "
+             f"{cluster_filter} "
+             f"GROUP BY cluster_id, industry_code")
+    for chunk in iter_query(query=query, params=params, itersize=itersize, con=con):
+        yield chunk.astype({'cluster_id': int, 'industry_code': str, 'n_workers': float})
+
+
+def iter_census_persons(year: int, with_cluster_id: bool = False, itersize: int = default_itersize, con=None) -> Iterator[pd.DataFrame]:
+    """
+    Stream the persons of census_{year}, optionally with the cluster of their census place (NULL outside clusters)
+    """
+    if with_cluster_id:
+        query = (f"SELECT census.histid, census.hik, census.ind1950, census.occ1950, census.census_place_id, crosswalk.cluster_id "
+                 f"FROM census_{year} AS census LEFT JOIN {cluster_census_place_table_name}{year} AS crosswalk "
+                 f"ON census.census_place_id = crosswalk.census_place_id")
+    else:
+        query = f"SELECT histid, hik, ind1950, occ1950, census_place_id FROM census_{year}"
+
+    dtypes = {'ind1950': 'Int32', 'occ1950': 'Int32', 'census_place_id': 'Int32', 'cluster_id': 'Int32'}
+    for chunk in iter_query(query=query, itersize=itersize, con=con):
+        yield chunk.astype({column: dtype for column, dtype in dtypes.items() if column in chunk.columns})
+
+
+def export_to_parquet(chunks: Iterable[pd.DataFrame], path: str, schema: pa.Schema = None) -> int:
+    """
+    Write DataFrame chunks to one Parquet file as they arrive, without concatenating them
+
+    GeoDataFrame chunks are written as GeoParquet (WKB geometries), readable with gpd.read_parquet.
+
+    Parameters:
+    - chunks: DataFrames with the same columns, e.g. from one of the iter_ functions
+    - path: Parquet file to write
+    - schema: Arrow schema of the file (defaults to the schema of the first chunk)
+
+    Returns:
+    - The number of rows written
+    """
+    writer, n_rows = None, 0
+    try:
+        for chunk in chunks:
+            table = _chunk_to_arrow(chunk=chunk, schema=schema if writer is None else writer.schema)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def _chunk_to_arrow(chunk: pd.DataFrame, schema: Union[pa.Schema, None]) -> pa.Table:
+    if not isinstance(chunk, gpd.GeoDataFrame):
+        return pa.Table.from_pandas(chunk, schema=schema)
+
+    geom_col = chunk.geometry.name
+    table = pa.Table.from_pandas(chunk.to_wkb(), schema=schema)
+    if schema is not None:
+        return table
+    geo_metadata = {'version': '1.0.0', 'primary_column': geom_col,
+                    'columns': {geom_col: {'encoding': 'WKB', 'geometry_types': [], 'crs': None if chunk.crs is None else chunk.crs.to_json_dict()}}}
+    return table.replace_schema_metadata({**table.schema.metadata, b'geo': json.dumps(geo_metadata).encode()})
+
+
+def _get_cluster_filter(cluster_ids: Union[List[int], None]):
+    if cluster_ids is None:
+        return "", None
+    return "WHERE cluster_id = ANY(%s)", ([int(cid) for cid in cluster_ids],)
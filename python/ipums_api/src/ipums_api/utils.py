@@ -1,10 +1,12 @@
 import logging
+import threading
+from contextlib import contextmanager
 
-import psycopg2
-import pandas as pd
+from ipums_api.config import get_db_config, get_db_pool_config
 
-
-from ipums_api.config import db_config
+_pool = None
+_pool_semaphore = None
+_pool_lock = threading.Lock()
 
 
 # Create a logger
@@ -19,25 +21,118 @@ def get_logger(name):
 
 
 def execute_sql(query: str, con=None):
-    con = get_db_connection() if con is None else con
-    with con.cursor() as cursor:
-        cursor.execute(query)
-        con.commit()
-    con.close()
+    # Imported here as profiling imports get_logger from this module
+    from .profiling import get_profiling_config, execute_profiled
+
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            if get_profiling_config()['enabled']:
+                execute_profiled(cursor=cursor, query=query)
+            else:
+                cursor.execute(query)
+            con_.commit()
 
 
 def sql_to_pandas(query: str, con=None):
-    con = get_db_connection() if con is None else con
-    df = pd.read_sql(query, con=con)
-    con.close()
+    import pandas as pd
+
+    with db_connection(con=con) as con_:
+        df = pd.read_sql(query, con=con_)
     return df
 
 
+def table_exists(table_name: str, con=None) -> bool:
+    with db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table_name,))
+            exists = cursor.fetchone()[0]
+    return exists
+
+
 def get_db_connection():
-    con = psycopg2.connect(**db_config)
+    # psycopg2 is imported on the first connection, so importing ipums_api stays cheap
+    import psycopg2
+
+    con = psycopg2.connect(**get_db_config())
     return con
 
 
+def init_db_pool(minconn: int = None, maxconn: int = None) -> None:
+    """
+    Create the shared connection pool, replacing any existing one
+
+    Parameters:
+    - minconn: number of connections opened eagerly (defaults to POSTGRES_POOL_MINCONN)
+    - maxconn: maximum number of connections checked out at once (defaults to POSTGRES_POOL_MAXCONN)
+    """
+    pool_config = get_db_pool_config()
+    minconn_ = pool_config['minconn'] if minconn is None else minconn
+    maxconn_ = pool_config['maxconn'] if maxconn is None else maxconn
+    assert 0 <= minconn_ <= maxconn_, f"Pool size must satisfy 0 <= minconn <= maxconn, but got {minconn_} and {maxconn_}"
+
+    with _pool_lock:
+        _close_db_pool()
+        _create_db_pool(minconn=minconn_, maxconn=maxconn_)
+
+
+def close_db_pool() -> None:
+    with _pool_lock:
+        _close_db_pool()
+
+
+def _create_db_pool(minconn: int, maxconn: int) -> None:
+    import psycopg2.pool
+
+    global _pool, _pool_semaphore
+    _pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **get_db_config())
+    _pool_semaphore = threading.BoundedSemaphore(maxconn)
+
+
+def _close_db_pool() -> None:
+    global _pool, _pool_semaphore
+    if _pool is not None:
+        _pool.closeall()
+    _pool = None
+    _pool_semaphore = None
+
+
+def _get_db_pool():
+    with _pool_lock:
+        if _pool is None:
+            pool_config = get_db_pool_config()
+            _create_db_pool(minconn=pool_config['minconn'], maxconn=pool_config['maxconn'])
+        return _pool, _pool_semaphore
+
+
+@contextmanager
+def db_connection(con=None):
+    """
+    Check out a connection from the shared pool for the duration of a with block
+
+    If an explicit connection is passed it is used as is and left open, so callers can
+    thread one session through several api calls. Pooled connections are rolled back on
+    error and returned to the pool; checkout blocks while all maxconn connections are in use.
+    """
+    if con is not None:
+        yield con
+        return
+
+    pool, semaphore = _get_db_pool()
+    semaphore.acquire()
+    try:
+        con_ = pool.getconn()
+        try:
+            yield con_
+        except Exception:
+            if not con_.closed:
+                con_.rollback()
+            raise
+        finally:
+            pool.putconn(con_, close=bool(con_.closed))
+    finally:
+        semaphore.release()
+
+
 def next_census_year(year: int) -> int:
     assert 1850 <= year <= 1930, f"Year must be between 1850 and 1940, but got {year}"
     if year == 1880:
@@ -51,4 +146,4 @@ def previous_census_year(year: int) -> int:
     if year == 1900:
         return 1880
     else:
-        return year - 10
\ No newline at end of file
+        return year - 10
@@ -0,0 +1,139 @@
+import argparse
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List
+
+from .config import load_env_file
+from .utils import db_connection, get_logger
+from .cache import get_table_versions
+from .db_api import cluster_geometry_table_name, _get_cluster_geometry_zoom_level_sql
+
+logger = get_logger('vector_tiles')
+
+# Filled by get_tile_cache_config on first use, so importing this module does not read config.env
+tile_cache_config = {}
+_tile_cache = OrderedDict()
+_tile_cache_lock = threading.Lock()
+_tile_path_pattern = re.compile(r'^/tiles/(?P<years>\d{4}(,\d{4})*)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$')
+
+
+def get_cluster_tile(years: List[int], z: int, x: int, y: int, extent: int = 4096, buffer: int = 64, con=None) -> bytes:
+    """
+    Get the clusters of several years intersecting a web map tile as a Mapbox Vector Tile
+
+    Each year is a layer clusters_{year} with the cluster_id and population of its clusters,
+    encoded with ST_AsMVT from the simplified geometry of cluster_geometry_{year} for the zoom.
+    Tiles are kept in an in-memory LRU cache of tile_cache_config['max_tiles'] tiles, keyed by
+    the versions of the tables they were built from.
+
+    Parameters:
+    - years: census years, one layer each
+    - z, x, y: tile coordinates (XYZ scheme)
+    - extent: tile extent in MVT coordinates
+    - buffer: buffer around the tile in MVT coordinates, so polygons are not cut visibly at tile edges
+
+    Returns:
+    - The protobuf bytes of the tile (empty if no cluster intersects it)
+    """
+    assert len(years) > 0, "At least one year must be given"
+    assert 0 <= x < 2 ** z and 0 <= y < 2 ** z, f"Tile {z}/{x}/{y} is out of range"
+    with db_connection(con=con) as con_:
+        table_names = [f"{cluster_geometry_table_name}{year}" for year in years]
+        key = (tuple(years), z, x, y, extent, buffer, repr(sorted(get_table_versions(table_names=table_names, con=con_).items())))
+        with _tile_cache_lock:
+            if key in _tile_cache:
+                _tile_cache.move_to_end(key)
+                return _tile_cache[key]
+
+        # Layers of an MVT are independent messages, so the tile of several years is the concatenation of their layers
+        layers = []
+        with con_.cursor() as cursor:
+            for year in years:
+                cursor.execute(f"WITH mvt_geom AS ("
+                               f"SELECT cluster_id, population, ST_AsMVTGeom(geom, ST_TileEnvelope(%s, %s, %s), extent => %s, buffer => %s) AS geom "
+                               f"FROM {cluster_geometry_table_name}{year} "
+                               f"WHERE zoom = {_get_cluster_geometry_zoom_level_sql(year=year)} AND geom && ST_TileEnvelope(%s, %s, %s, margin => %s)) "
+                               f"SELECT ST_AsMVT(mvt_geom.*, %s, %s, 'geom') FROM mvt_geom",
+                               (z, x, y, extent, buffer, z, z, x, y, buffer / extent, f'clusters_{year}', extent))
+                layer = cursor.fetchone()[0]
+                layers.append(b'' if layer is None else bytes(layer))
+    tile = b''.join(layers)
+
+    with _tile_cache_lock:
+        _tile_cache[key] = tile
+        while len(_tile_cache) > get_tile_cache_config()['max_tiles']:
+            _tile_cache.popitem(last=False)
+    return tile
+
+
+def get_tile_cache_config() -> dict:
+    if not tile_cache_config:
+        load_env_file()
+        tile_cache_config.update({
+            "max_tiles": int(os.getenv('IPUMS_API_TILE_CACHE_MAX_TILES', 10000))
+        })
+    return tile_cache_config
+
+
+def clear_tile_cache() -> None:
+    with _tile_cache_lock:
+        _tile_cache.clear()
+
+
+def serve_cluster_tiles(host: str = '127.0.0.1', port: int = 8080) -> None:
+    """
+    Serve get_cluster_tile over HTTP at /tiles/{years}/{z}/{x}/{y}.mvt until interrupted
+
+    years is a comma separated list, e.g. /tiles/1850,1860/4/3/5.mvt, which can be used as the
+    tile URL of a MapLibre / Mapbox vector source. Only meant to be run locally.
+    """
+    server = ThreadingHTTPServer((host, port), _ClusterTileHandler)
+    logger.info(f"Serving cluster tiles at http://{host}:{port}/tiles/{{years}}/{{z}}/{{x}}/{{y}}.mvt")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class _ClusterTileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = _tile_path_pattern.match(self.path.split('?')[0])
+        if match is None:
+            self.send_error(404, "Expected /tiles/{years}/{z}/{x}/{y}.mvt")
+            return
+        years = [int(year) for year in match['years'].split(',')]
+        z, x, y = int(match['z']), int(match['x']), int(match['y'])
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            self.send_error(404, f"Tile {z}/{x}/{y} is out of range")
+            return
+        try:
+            tile = get_cluster_tile(years=years, z=z, x=x, y=y)
+        except Exception:
+            logger.exception(f"Failed to build tile {z}/{x}/{y} of {years}")
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.mapbox-vector-tile')
+        self.send_header('Content-Length', str(len(tile)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the clusters as Mapbox Vector Tiles')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    serve_cluster_tiles(host=args.host, port=args.port)
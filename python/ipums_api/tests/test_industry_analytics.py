@@ -0,0 +1,69 @@
+import contextlib
+
+import numpy as np
+import pytest
+
+import ipums_api.industry_analytics as industry_analytics
+from ipums_api.db_api import IndustryClassification
+
+# (year, census_place_id, ind1950, n_workers) and (year, cluster_id, census_place_id) rows of two years
+counts = [(1850, 1, 0, 10), (1850, 2, 5, 4), (1850, 5, 10, 7), (1860, 1, 0, 3), (1860, 5, 20, 8), (1860, 9, 10, 2)]
+crosswalk = [(1850, 0, 1), (1850, 0, 2), (1850, 1, 5), (1860, 3, 1), (1860, 3, 5), (1860, 4, 9)]
+industry_codes = [0, 5, 10, 20]
+
+
+class _Cursor:
+    # Answers the three queries of load_industry_matrices from the rows above
+    def __init__(self, years):
+        self.years = years
+        self.query = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.query = query
+
+    def fetchall(self):
+        if 'COUNT(*)' in self.query:
+            return [row for row in counts if row[0] in self.years]
+        if 'cluster_census_place' in self.query:
+            return [row for row in crosswalk if row[0] in self.years]
+        return [tuple(str(code) for _ in IndustryClassification) for code in industry_codes]
+
+
+def _load_matrices(monkeypatch, years, components):
+    connection = type('Connection', (), {'cursor': lambda self: _Cursor(years=years)})()
+    monkeypatch.setattr(industry_analytics, 'db_connection', lambda con=None: contextlib.nullcontext(connection))
+    monkeypatch.setattr(industry_analytics, 'get_cluster_multiyear_matching', lambda year_start, year_end, con=None: components)
+    return industry_analytics.load_industry_matrices(years=years)
+
+
+def test_matched_cluster_industry_changes(monkeypatch):
+    components = [{'component_id': 0, 'years': [1850, 1860], 1850: [0, 1], 1860: [3]}, {'component_id': 1, 'years': [1860], 1860: [4]}]
+    matrices = _load_matrices(monkeypatch, years=[1860, 1850], components=components)
+    changes = industry_analytics.get_matched_cluster_industry_changes(matrices=matrices, classifications=[IndustryClassification.BASE_CODES])
+
+    assert matrices['years'] == [1850, 1860]
+    assert changes.index.get_level_values('component_id').unique().tolist() == [0]
+    n_workers = changes.droplevel(['component_id', 'year', 'next_year', 'classification'])[['n_workers', 'next_n_workers']]
+    assert n_workers.loc['0'].tolist() == [10, 3]
+    assert n_workers.loc['20'].tolist() == [0, 8]
+    assert np.isclose(changes['share'].sum(), 1) and np.isclose(changes['next_share'].sum(), 1)
+
+
+@pytest.mark.parametrize('years, components', [
+    ([1850], [{'component_id': 0, 'years': [1850], 1850: [0, 1]}]),
+    ([1850, 1860], [{'component_id': 0, 'years': [1850], 1850: [0]}, {'component_id': 1, 'years': [1860], 1860: [3, 4]}]),
+])
+def test_matched_cluster_industry_changes_without_consecutive_years(monkeypatch, years, components):
+    matrices = _load_matrices(monkeypatch, years=years, components=components)
+    changes = industry_analytics.get_matched_cluster_industry_changes(matrices=matrices)
+
+    assert changes.empty
+    assert changes.index.names == ['component_id', 'year', 'next_year', 'classification', 'industry_code']
+    assert changes.dtypes.to_dict() == {'n_workers': np.int32, 'next_n_workers': np.int32, 'share': np.float64, 'next_share': np.float64,
+                                        'n_workers_change': np.int32, 'share_change': np.float64}
@@ -0,0 +1,124 @@
+from enum import Enum
+from typing import Dict
+
+import numpy as np
+import scipy.ndimage as ndimage
+from scipy import sparse
+from scipy.sparse import csgraph
+from affine import Affine
+from rasterio import features
+from shapely.geometry import shape
+from shapely.ops import unary_union
+from shapely.geometry.base import BaseGeometry
+
+
+class ClusteringMethod(Enum):
+    SQL = 'sql'
+    GRID = 'grid'
+
+
+def get_dbscan_footprint(eps: float, pixel_size: float) -> np.ndarray:
+    """
+    Get the pixel offsets whose squares lie within eps of each other
+
+    Two pixel squares offset by (dr, dc) are at distance
+    pixel_size * sqrt(max(|dr| - 1, 0) ** 2 + max(|dc| - 1, 0) ** 2), which is the distance
+    ST_ClusterDBSCAN measures between the polygons of ST_PixelAsPolygons.
+
+    Parameters:
+    - eps: maximum distance between neighbouring pixels, in CRS units
+    - pixel_size: side of a pixel, in CRS units
+
+    Returns:
+    - A square boolean numpy array centred on the pixel itself
+    """
+    radius = int(np.floor(eps / pixel_size)) + 1
+    offsets = np.arange(-radius, radius + 1)
+    gaps = np.maximum(np.abs(offsets) - 1, 0) * pixel_size
+    distance_grid = np.sqrt(gaps[:, None] ** 2 + gaps[None, :] ** 2)
+    return distance_grid <= eps
+
+
+def label_clusters(values: np.ndarray, pixel_threshold: float, eps: float, min_points: int, pixel_size: float) -> np.ndarray:
+    """
+    Cluster the pixels above a threshold with DBSCAN on the pixel grid
+
+    Parameters:
+    - values: 2D numpy array of pixel values
+    - pixel_threshold: pixels with a value strictly greater than this are clustered
+    - eps: DBSCAN neighbourhood distance between pixel squares, in CRS units
+    - min_points: minimum number of pixels (itself included) in the neighbourhood of a core pixel
+    - pixel_size: side of a pixel, in CRS units
+
+    Returns:
+    - An int32 numpy array with the shape of values, holding cluster labels 1..n and 0 for
+      pixels below the threshold or left as DBSCAN noise
+    """
+    footprint = get_dbscan_footprint(eps=eps, pixel_size=pixel_size)
+    points = values > pixel_threshold
+    n_neighbours = ndimage.convolve(points.astype(np.int32), footprint.astype(np.int32), mode='constant', cval=0)
+    core = points & (n_neighbours >= min_points)
+
+    if footprint.shape == (3, 3):
+        core_labels, _ = ndimage.label(core, structure=footprint)
+    else:
+        core_labels = _label_with_footprint(mask=core, footprint=footprint)
+
+    # Border pixels join the cluster of a core pixel in their neighbourhood, as in DBSCAN
+    labels = core_labels.astype(np.int32)
+    border = points & ~core
+    if border.any():
+        radius = footprint.shape[0] // 2
+        padded_core_labels = np.pad(core_labels, radius)
+        height, width = values.shape
+        for dr, dc in zip(*np.nonzero(footprint)):
+            unassigned = border & (labels == 0)
+            neighbour_labels = padded_core_labels[dr:dr + height, dc:dc + width]
+            labels[unassigned] = neighbour_labels[unassigned]
+
+    return labels
+
+
+def _label_with_footprint(mask: np.ndarray, footprint: np.ndarray) -> np.ndarray:
+    height, width = mask.shape
+    pixel_index = np.full(mask.shape, -1, dtype=np.int64)
+    n_pixels = int(mask.sum())
+    pixel_index[mask] = np.arange(n_pixels)
+
+    radius = footprint.shape[0] // 2
+    sources, targets = [], []
+    for dr, dc in zip(*np.nonzero(footprint)):
+        dr, dc = dr - radius, dc - radius
+        if (dr, dc) <= (0, 0):
+            continue
+        source = pixel_index[max(-dr, 0):height - max(dr, 0), max(-dc, 0):width - max(dc, 0)]
+        target = pixel_index[max(dr, 0):height + min(dr, 0), max(dc, 0):width + min(dc, 0)]
+        linked = (source >= 0) & (target >= 0)
+        sources.append(source[linked])
+        targets.append(target[linked])
+
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+    graph = sparse.coo_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)), shape=(n_pixels, n_pixels))
+    _, component_labels = csgraph.connected_components(graph, directed=False)
+
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    labels[mask] = component_labels + 1
+    return labels
+
+
+def vectorize_clusters(labels: np.ndarray, transform: Affine) -> Dict[int, BaseGeometry]:
+    """
+    Turn a label grid into one (multi)polygon per cluster
+
+    Parameters:
+    - labels: int32 numpy array of cluster labels, 0 meaning no cluster
+    - transform: affine transform of the grid
+
+    Returns:
+    - A dict mapping each label to the union of its pixel squares
+    """
+    cluster_polygons = {}
+    for polygon, label in features.shapes(labels.astype(np.int32), mask=labels > 0, transform=transform):
+        cluster_polygons.setdefault(int(label), []).append(shape(polygon))
+
+    return {label: unary_union(polygons) for label, polygons in cluster_polygons.items()}
@@ -0,0 +1,111 @@
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Iterable
+
+import pandas as pd
+import ipums_api
+
+logger = ipums_api.get_logger('ingest')
+
+# Column order of the raw IPUMS extracts, as loaded by bash/load_census_data.sh and bash/load_geo_data.sh
+dem_csv_columns = ['year', 'occ1950', 'ind1950', 'histid', 'hik']
+geo_csv_columns = ['potential_match', 'match_type', 'lat', 'lon', 'state_fips_geomatch', 'county_fips_geomatch', 'cluster_k5', 'cpp_placeid', 'histid']
+industry_csv_columns = ['code', 'description', 'refined_categories', 'broad_categories', 'agri_non_agri', 'detailed', 'no_agriculture', 'all_group_by']
+max_census_place_id = 69491
+
+
+def ingest_census_year(year: int, census_data_path: str, chunksize: int = 10 ** 6) -> None:
+    """
+    Stream usa_{year}.csv into an unlogged dem_{year} table with only the columns step 1 uses
+
+    Blank hik values are stored as NULL, so the table is ready to be merged without a rewrite.
+    """
+    dem_table_name = f'dem_{year}'
+    chunks = pd.read_csv(f'{census_data_path}/usa_{year}.csv', header=0, names=dem_csv_columns, usecols=['occ1950', 'ind1950', 'histid', 'hik'],
+                         dtype={'occ1950': 'Int32', 'ind1950': 'Int32', 'histid': str, 'hik': str}, keep_default_na=False, na_values={'occ1950': [''], 'ind1950': ['']}, chunksize=chunksize)
+
+    def transform(chunk: pd.DataFrame) -> pd.DataFrame:
+        chunk['hik'] = chunk['hik'].where(chunk['hik'].str.strip() != '')
+        return chunk[['histid', 'hik', 'ind1950', 'occ1950']]
+
+    query = f"CREATE UNLOGGED TABLE {dem_table_name} (histid VARCHAR(36), hik VARCHAR(21), ind1950 INTEGER, occ1950 INTEGER);"
+    _create_table_and_copy_chunks(table_name=dem_table_name, create_table_query=query, chunks=(transform(chunk) for chunk in chunks))
+
+
+def ingest_geo_year(year: int, geo_data_path: str, chunksize: int = 10 ** 6) -> None:
+    """
+    Stream histid_place_crosswalk_{year}.csv into an unlogged geo_{year} (census_place_id, histid) table
+
+    histid is uppercased and census place ids above max_census_place_id are set to NULL while
+    streaming, which replaces the rewrite done by _transform_histid_geo_table_to_uppercase.
+    """
+    geo_table_name = f'geo_{year}'
+    chunks = pd.read_csv(f'{geo_data_path}/histid_place_crosswalk_{year}.csv', header=0, names=geo_csv_columns, usecols=['cpp_placeid', 'histid'],
+                         dtype={'cpp_placeid': 'Int32', 'histid': str}, keep_default_na=False, na_values={'cpp_placeid': ['']}, chunksize=chunksize)
+
+    def transform(chunk: pd.DataFrame) -> pd.DataFrame:
+        census_place_id = chunk['cpp_placeid'].mask(chunk['cpp_placeid'] > max_census_place_id)
+        return pd.DataFrame({'census_place_id': census_place_id, 'histid': chunk['histid'].str.upper()})
+
+    query = f"CREATE UNLOGGED TABLE {geo_table_name} (census_place_id INTEGER, histid VARCHAR(36));"
+    _create_table_and_copy_chunks(table_name=geo_table_name, create_table_query=query, chunks=(transform(chunk) for chunk in chunks))
+
+
+def ingest_industry_table(census_data_path: str) -> None:
+    industry_table_name = 'industry_1950'
+    industry = pd.read_csv(f'{census_data_path}/industry1950_codes_and_desc.csv', header=0, names=industry_csv_columns, dtype={'code': 'Int32'})
+    query = (f"CREATE TABLE {industry_table_name} (code INTEGER, description VARCHAR(70), refined_categories VARCHAR(70), broad_categories VARCHAR(70), "
+             f"agri_non_agri VARCHAR(70), detailed VARCHAR(70), no_agriculture VARCHAR(70), all_group_by VARCHAR (70));")
+    _create_table_and_copy_chunks(table_name=industry_table_name, create_table_query=query, chunks=[industry])
+
+
+def ingest_all(years: List[int], n_workers: int, base_data_path: str = None, chunksize: int = 10 ** 6) -> None:
+    """
+    Load the census, geo and industry extracts, one worker process per (table, year)
+
+    Parameters:
+    - years: census years to load
+    - n_workers: number of parallel COPY streams
+    - base_data_path: directory containing the CENSUS_DATA and GEO_DATA folders (defaults to BASE_DATA_PATH)
+    - chunksize: number of CSV rows parsed and copied at a time
+    """
+    # BASE_DATA_PATH is usually set in config.env, loaded with the database settings
+    ipums_api.load_config()
+    base_data_path_ = os.getenv('BASE_DATA_PATH') if base_data_path is None else base_data_path
+    assert base_data_path_ is not None, "base_data_path must be given or BASE_DATA_PATH set"
+    census_data_path = f"{base_data_path_}/{os.getenv('CENSUS_DATA', 'census')}"
+    geo_data_path = f"{base_data_path_}/{os.getenv('GEO_DATA', 'geo')}"
+
+    ingest_industry_table(census_data_path=census_data_path)
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {}
+        for year in years:
+            futures[executor.submit(ingest_census_year, year=year, census_data_path=census_data_path, chunksize=chunksize)] = f'dem_{year}'
+            futures[executor.submit(ingest_geo_year, year=year, geo_data_path=geo_data_path, chunksize=chunksize)] = f'geo_{year}'
+
+        for future, table_name in futures.items():
+            future.result()
+            logger.info(f"Loaded {table_name}")
+
+
+def _create_table_and_copy_chunks(table_name: str, create_table_query: str, chunks: Iterable[pd.DataFrame]) -> None:
+    # The table is created and filled in a single transaction, so a failed load leaves nothing behind
+    with ipums_api.db_connection() as con:
+        with con.cursor() as cursor:
+            cursor.execute(create_table_query)
+            n_rows = 0
+            for chunk in chunks:
+                buffer = io.StringIO()
+                chunk.to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {table_name} ({', '.join(chunk.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+                n_rows += len(chunk)
+                logger.debug(f"Copied {n_rows} rows into {table_name}")
+        con.commit()
+
+
+if __name__ == '__main__':
+    ingest_all(years=[1850, 1860, 1870, 1880, 1900, 1910, 1920, 1930, 1940], n_workers=4)
@@ -0,0 +1,136 @@
+from typing import Callable, Dict, List, Union
+
+import psycopg2.extras
+import ipums_api
+
+logger = ipums_api.get_logger('manifest')
+
+manifest_table_name = 'pipeline_manifest'
+
+
+def create_manifest_table(con=None) -> None:
+    query = (f"CREATE TABLE IF NOT EXISTS {manifest_table_name} ("
+             f"year INTEGER, step INTEGER, status VARCHAR(16), parameters JSONB, completed_sub_steps JSONB, "
+             f"input_fingerprints JSONB, output_fingerprints JSONB, started_at TIMESTAMPTZ, finished_at TIMESTAMPTZ, "
+             f"PRIMARY KEY (year, step));")
+    ipums_api.execute_sql(query=query, con=con)
+
+
+def get_table_fingerprints(table_names: List[str], con=None) -> Dict[str, Union[List[int], None]]:
+    """
+    Get a fingerprint of each table from the catalog
+
+    The pipeline never updates its artifacts in place, it drops and recreates or rewrites them,
+    which gives them a new oid or relfilenode. The fingerprint is therefore (oid, relfilenode),
+    and None for missing tables.
+    """
+    query = "SELECT oid::BIGINT, relfilenode::BIGINT FROM pg_class WHERE oid = to_regclass(%s)"
+    fingerprints = {}
+    with ipums_api.db_connection(con=con) as con_:
+        with con_.cursor() as cursor:
+            for table_name in table_names:
+                cursor.execute(query, (table_name,))
+                fingerprint = cursor.fetchone()
+                fingerprints[table_name] = None if fingerprint is None else [int(f) for f in fingerprint]
+    return fingerprints
+
+
+def get_step_record(year: int, step: int, con=None) -> Union[Dict, None]:
+    with ipums_api.db_connection(con=con) as con_:
+        with con_.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            cursor.execute(f"SELECT * FROM {manifest_table_name} WHERE year = %s AND step = %s", (year, step))
+            record = cursor.fetchone()
+    return None if record is None else dict(record)
+
+
+def run_step(year: int, step: int, parameters: Dict, input_tables: List[str], output_tables: List[str], func: Callable, force: bool = False, **kwargs) -> bool:
+    """
+    Run a pipeline step unless the manifest shows it is up to date, resuming after its last completed sub-step
+
+    The step is skipped when it completed with the same parameters, its input tables still
+    have the fingerprints recorded when it completed and its output tables exist. A step that
+    failed is resumed after its last completed sub-step if its parameters and inputs are
+    unchanged since that sub-step, and otherwise rerun from the start. Each sub-step runs in
+    its own transaction (see run_sub_step), so a failure never leaves it half applied.
+
+    Parameters:
+    - year: census year of the step (0 for the shared step 0)
+    - step: pipeline step number
+    - parameters: JSON serializable parameters that change the outputs of the step
+    - input_tables: tables read by the step
+    - output_tables: tables created by the step
+    - func: step function, called with step_run and kwargs
+    - force: rerun the step from the start even if it is up to date
+
+    Returns:
+    - True if the step ran, False if it was skipped
+    """
+    record = get_step_record(year=year, step=step)
+    input_fingerprints = get_table_fingerprints(table_names=input_tables)
+    unchanged = not force and record is not None and record['parameters'] == parameters and record['input_fingerprints'] == input_fingerprints
+
+    if unchanged and record['status'] == 'done' and all(ipums_api.table_exists(table_name=t) for t in output_tables):
+        logger.info(f"Skipping step {step} for year {year}, its inputs and parameters are unchanged")
+        return False
+
+    completed_sub_steps = record['completed_sub_steps'] if unchanged else []
+    if completed_sub_steps:
+        logger.info(f"Resuming step {step} for year {year} after sub-step {completed_sub_steps[-1]}")
+
+    _write_step_record(year=year, step=step, status='running', parameters=parameters, completed_sub_steps=completed_sub_steps, input_fingerprints=input_fingerprints)
+    step_run = {'year': year, 'step': step, 'parameters': parameters, 'input_tables': input_tables, 'completed_sub_steps': completed_sub_steps}
+    try:
+        with ipums_api.profile(kind='step', name=f'step {step}', year=year):
+            func(step_run=step_run, **kwargs)
+    except Exception:
+        _write_step_record(year=year, step=step, status='failed', parameters=parameters, completed_sub_steps=step_run['completed_sub_steps'],
+                           input_fingerprints=get_table_fingerprints(table_names=input_tables))
+        raise
+
+    _write_step_record(year=year, step=step, status='done', parameters=parameters, completed_sub_steps=step_run['completed_sub_steps'],
+                       input_fingerprints=get_table_fingerprints(table_names=input_tables), output_fingerprints=get_table_fingerprints(table_names=output_tables))
+    return True
+
+
+def run_sub_step(step_run: Union[Dict, None], sub_step: str, func: Callable, creates: List[str] = (), **kwargs):
+    """
+    Run a sub-step of a step started by run_step, unless it already completed in an earlier run
+
+    Tables in creates are dropped first, so leftovers of an interrupted earlier attempt never
+    make the sub-step fail. Without a step_run the sub-step just runs.
+
+    Returns:
+    - The return value of func, or None if the sub-step was skipped
+    """
+    if step_run is None:
+        with ipums_api.profile(kind='sub_step', name=sub_step):
+            return func(**kwargs)
+
+    if sub_step in step_run['completed_sub_steps']:
+        logger.debug(f"Skipping completed sub-step {sub_step} of step {step_run['step']} for year {step_run['year']}")
+        return None
+
+    if creates:
+        ipums_api.execute_sql(query=f"DROP TABLE IF EXISTS {', '.join(creates)} CASCADE;")
+    with ipums_api.profile(kind='sub_step', name=sub_step, year=step_run['year'], step=step_run['step']):
+        result = func(**kwargs)
+
+    # Inputs are fingerprinted after each sub-step, as sub-steps may rewrite them (e.g. dedup)
+    step_run['completed_sub_steps'] = step_run['completed_sub_steps'] + [sub_step]
+    _write_step_record(year=step_run['year'], step=step_run['step'], status='running', parameters=step_run['parameters'], completed_sub_steps=step_run['completed_sub_steps'],
+                       input_fingerprints=get_table_fingerprints(table_names=step_run['input_tables']))
+    return result
+
+
+def _write_step_record(year: int, step: int, status: str, parameters: Dict, completed_sub_steps: List[str], input_fingerprints: Dict, output_fingerprints: Dict = None) -> None:
+    query = (f"INSERT INTO {manifest_table_name} (year, step, status, parameters, completed_sub_steps, input_fingerprints, output_fingerprints, started_at, finished_at) "
+             f"VALUES (%s, %s, %s, %s, %s, %s, %s, now(), NULL) "
+             f"ON CONFLICT (year, step) DO UPDATE SET status = EXCLUDED.status, parameters = EXCLUDED.parameters, completed_sub_steps = EXCLUDED.completed_sub_steps, "
+             f"input_fingerprints = EXCLUDED.input_fingerprints, output_fingerprints = EXCLUDED.output_fingerprints, "
+             f"started_at = CASE WHEN {manifest_table_name}.status = 'running' THEN {manifest_table_name}.started_at ELSE EXCLUDED.started_at END, "
+             f"finished_at = CASE WHEN EXCLUDED.status = 'running' THEN NULL ELSE now() END;")
+    with ipums_api.db_connection() as con:
+        with con.cursor() as cursor:
+            cursor.execute(query, (year, step, status, psycopg2.extras.Json(parameters), psycopg2.extras.Json(completed_sub_steps),
+                                   psycopg2.extras.Json(input_fingerprints), psycopg2.extras.Json(output_fingerprints)))
+        con.commit()
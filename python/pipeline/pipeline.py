@@ -1,43 +1,69 @@
+import hashlib
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import product
+from typing import List, Dict, Tuple, Union
+
 import numpy as np
-from typing import List
+import psycopg2.extras
+from affine import Affine
+from rasterio.windows import Window
+import xarray as xr
 import ipums_api
 
-from python.pipeline.convolution import get_2d_exponential_kernel, convolve2d
-from python.pipeline.raster_postgis import load_raster, dump_raster
+from python.pipeline.convolution import get_2d_exponential_kernel, convolve2d, get_tile_windows, convolve2d_halo_tile, ConvolutionMethod
+from python.pipeline.clustering import ClusteringMethod, label_clusters, vectorize_clusters
+from python.pipeline.rasterization import RasterizationMethod, rasterize_pixels
+from python.pipeline.manifest import create_manifest_table, run_step, run_sub_step
+from python.pipeline.ingest import max_census_place_id
+from ipums_api.profiling import get_profiling_config
+from ipums_api.raster_postgis import load_raster, dump_raster, array_to_raster, get_raster_metadata, load_raster_window, append_raster_tile, create_raster_overviews
 
 logger = ipums_api.get_logger('pipeline')
 
+default_data_table_partitions = 16
+default_raster_tile_size = 256
+default_raster_overview_factors = (4, 16)
+default_cluster_geometry_zoom_levels = (0, 3, 6, 9, 12)
+# Sweep table names such as cluster_census_place_{year}_{suffix} leave 37 of the 63 bytes of a Postgres identifier to the suffix
+max_sweep_suffix_length = 32
+
 
 # Step 0: preprocess_data
 
-def preprocess_data(census_place_table_name: str, usa_state_geom_table: str, industry_table_name: str, path_sql_functions: str) -> None:
+def preprocess_data(census_place_table_name: str, usa_state_geom_table: str, industry_table_name: str, path_sql_functions: str, census_place_pixel_table_name: str = 'census_place_pixel', step_run: Dict = None) -> None:
     logger.debug("Preprocessing data")
 
     logger.debug("Configuring database")
-    _configure_db()
+    run_sub_step(step_run, 'configure_db', _configure_db)
 
     logger.debug("Refactoring census_place table")
-    _refactor_census_place_table(census_place_table_name=census_place_table_name)
+    run_sub_step(step_run, 'refactor_census_place', _refactor_census_place_table, census_place_table_name=census_place_table_name)
 
     logger.debug("Refactoring usa_state_geom table")
-    _refactor_usa_state_geom_table(usa_state_geom_table=usa_state_geom_table)
+    run_sub_step(step_run, 'refactor_usa_state_geom', _refactor_usa_state_geom_table, usa_state_geom_table=usa_state_geom_table)
 
     logger.debug("Refactoring industry table")
-    _refactor_industry_table(industry_table_name=industry_table_name)
+    run_sub_step(step_run, 'refactor_industry', _refactor_industry_table, industry_table_name=industry_table_name)
 
     logger.debug("Inserting SQL functions")
-    _insert_sql_functions(path_sql_functions=path_sql_functions)
+    run_sub_step(step_run, 'insert_sql_functions', _insert_sql_functions, path_sql_functions=path_sql_functions)
+
+    logger.debug(f"Creating {census_place_pixel_table_name} table")
+    run_sub_step(step_run, 'create_census_place_pixel', _create_census_place_pixel_table, census_place_table_name=census_place_table_name, census_place_pixel_table_name=census_place_pixel_table_name)
 
 
 def _configure_db():
     query = (f"CREATE EXTENSION IF NOT EXISTS postgis;"
              f"CREATE EXTENSION IF NOT EXISTS postgis_raster;"
-             f"ALTER DATABASE ipums SET postgis.gdal_enabled_drivers = 'ENABLE_ALL';")
+             f"DO $$ BEGIN EXECUTE format('ALTER DATABASE %I SET postgis.gdal_enabled_drivers = ''ENABLE_ALL''', current_database()); END $$;")
     ipums_api.execute_sql(query=query)
 
 
 def _refactor_census_place_table(census_place_table_name: str) -> None:
-    query = (f"CREATE TABLE {census_place_table_name}_new (id INTEGER PRIMARY KEY, potential_match VARCHAR(50), geom GEOGRAPHY);"
+    query = (f"DROP TABLE IF EXISTS {census_place_table_name}_new;"
+             f"CREATE TABLE {census_place_table_name}_new (id INTEGER PRIMARY KEY, potential_match VARCHAR(50), geom GEOGRAPHY);"
              f"INSERT INTO {census_place_table_name}_new "
              f"SELECT id, potential_match, geom "
              f"FROM {census_place_table_name};"
@@ -49,7 +75,8 @@ def _refactor_census_place_table(census_place_table_name: str) -> None:
 
 
 def _refactor_usa_state_geom_table(usa_state_geom_table: str) -> None:
-    query = (f"CREATE TABLE {usa_state_geom_table}_new (state_code VARCHAR(2) PRIMARY KEY, state_name VARCHAR(25), geom GEOMETRY);"
+    query = (f"DROP TABLE IF EXISTS {usa_state_geom_table}_new;"
+             f"CREATE TABLE {usa_state_geom_table}_new (state_code VARCHAR(2) PRIMARY KEY, state_name VARCHAR(25), geom GEOMETRY);"
              f"INSERT INTO {usa_state_geom_table}_new "
              f"SELECT state_code, state_name, geom "
              f"FROM {usa_state_geom_table};"
@@ -73,32 +100,67 @@ def _insert_sql_functions(path_sql_functions: str):
         logger.debug(f"Inserted function from {sql_f}")
 
 
+def _create_census_place_pixel_table(census_place_table_name: str, census_place_pixel_table_name: str) -> None:
+    # Pixel indices are 0-based (numpy convention, ST_WorldToRasterCoord is 1-based) and fall
+    # outside [0, height) x [0, width) for census places outside the template grid
+    query = (f"DROP TABLE IF EXISTS {census_place_pixel_table_name} CASCADE;"
+             f"CREATE TABLE {census_place_pixel_table_name} AS "
+             f"WITH usa_raster AS ("
+             f"SELECT (ST_MetaData(get_template_usa_raster())).*), "
+             f"census_place_5070 AS ("
+             f"SELECT id, ST_Transform(geom::geometry, 5070) AS geom "
+             f"FROM {census_place_table_name}) "
+             f"SELECT cp.id AS census_place_id, cp.geom AS geom, "
+             f"FLOOR((ST_Y(cp.geom) - usa_raster.upperlefty) / usa_raster.scaley)::INTEGER AS pixel_row, "
+             f"FLOOR((ST_X(cp.geom) - usa_raster.upperleftx) / usa_raster.scalex)::INTEGER AS pixel_col "
+             f"FROM census_place_5070 AS cp CROSS JOIN usa_raster;"
+             f"ALTER TABLE {census_place_pixel_table_name} ADD PRIMARY KEY (census_place_id);"
+             f"ALTER TABLE {census_place_pixel_table_name} ADD FOREIGN KEY (census_place_id) REFERENCES {census_place_table_name}(id);"
+             f"CREATE INDEX ON {census_place_pixel_table_name} USING GIST (geom);"
+             f"CREATE INDEX ON {census_place_pixel_table_name} (pixel_row, pixel_col);")
+
+    ipums_api.execute_sql(query=query)
+
+
 # Step 1: create_data_table
 
-def create_data_table(geo_table_name: str, dem_table_name: str, data_table_name: str, census_place_table_name: str, industry_table_name: str) -> None:
+def create_data_table(geo_table_name: str, dem_table_name: str, data_table_name: str, census_place_table_name: str, industry_table_name: str, geo_table_ingested: bool = False, single_pass: bool = False,
+                      n_partitions: int = default_data_table_partitions, step_run: Dict = None) -> None:
     logger.debug(f"Creating data table {data_table_name} from {geo_table_name} and {dem_table_name}")
 
-    logger.debug(f"Transforming histid in {geo_table_name} to uppercase")
-    _transform_histid_geo_table_to_uppercase(geo_table_name=geo_table_name)
+    if single_pass:
+        logger.debug(f"Deduplicating and merging {geo_table_name} and {dem_table_name} to create {data_table_name} in a single pass")
+        run_sub_step(step_run, 'dedup_and_merge', _dedup_and_merge_geo_and_dem_tables_to_create_data_table, creates=[data_table_name],
+                     geo_table_name=geo_table_name, dem_table_name=dem_table_name, data_table_name=data_table_name, geo_table_ingested=geo_table_ingested, n_partitions=n_partitions)
+    else:
+        _dedup_and_merge_geo_and_dem_tables_in_steps(geo_table_name=geo_table_name, dem_table_name=dem_table_name, data_table_name=data_table_name, geo_table_ingested=geo_table_ingested, n_partitions=n_partitions, step_run=step_run)
+
+    logger.debug(f"Adding keys and indices to {data_table_name}")
+    run_sub_step(step_run, 'add_keys', _add_primary_and_foreign_keys_to_data_table, data_table_name=data_table_name, census_place_table_name=census_place_table_name, industry_table_name=industry_table_name, n_partitions=n_partitions)
+
+    logger.debug(f"Dropping {geo_table_name} and {dem_table_name}")
+    run_sub_step(step_run, 'drop_geo_and_dem', _drop_geo_and_dem_tables, dem_table_name=dem_table_name, geo_table_name=geo_table_name)
+
+
+def _dedup_and_merge_geo_and_dem_tables_in_steps(geo_table_name: str, dem_table_name: str, data_table_name: str, geo_table_ingested: bool = False, n_partitions: int = default_data_table_partitions, step_run: Dict = None) -> None:
+    # Tables loaded by ingest.py, or transformed by an earlier forced run, already have uppercase histids and only the needed columns
+    if not geo_table_ingested and not _is_geo_table_transformed(geo_table_name=geo_table_name):
+        logger.debug(f"Transforming histid in {geo_table_name} to uppercase")
+        run_sub_step(step_run, 'uppercase_histid', _transform_histid_geo_table_to_uppercase, geo_table_name=geo_table_name)
 
     logger.debug(f"Creating indices for {geo_table_name} and {dem_table_name}")
-    _create_indices_geo_and_dem_tables(geo_table_name=geo_table_name, dem_table_name=dem_table_name)
+    run_sub_step(step_run, 'create_indices', _create_indices_geo_and_dem_tables, geo_table_name=geo_table_name, dem_table_name=dem_table_name)
 
     logger.debug(f"Removing duplicate histids from {geo_table_name} and {dem_table_name}")
-    _remove_duplicate_hist_ids_from_geo_and_dem_tables(geo_table_name=geo_table_name, dem_table_name=dem_table_name)
+    run_sub_step(step_run, 'remove_duplicates', _remove_duplicate_hist_ids_from_geo_and_dem_tables, geo_table_name=geo_table_name, dem_table_name=dem_table_name)
 
     logger.debug(f"Merging {geo_table_name} and {dem_table_name} to create {data_table_name}")
-    _merge_geo_and_dem_tables_to_create_data_table(geo_table_name=geo_table_name, dem_table_name=dem_table_name, data_table_name=data_table_name)
-
-    logger.debug(f"Adding primary and foreign keys to {data_table_name}")
-    _add_primary_and_foreign_keys_to_data_table(data_table_name=data_table_name, census_place_table_name=census_place_table_name, industry_table_name=industry_table_name)
-
-    logger.debug(f"Dropping {geo_table_name} and {dem_table_name}")
-    _drop_geo_and_dem_tables(dem_table_name=dem_table_name, geo_table_name=geo_table_name)
+    run_sub_step(step_run, 'merge', _merge_geo_and_dem_tables_to_create_data_table, creates=[data_table_name], geo_table_name=geo_table_name, dem_table_name=dem_table_name, data_table_name=data_table_name, n_partitions=n_partitions)
 
 
 def _transform_histid_geo_table_to_uppercase(geo_table_name: str):
-    query = (f"CREATE TABLE {geo_table_name}_new (census_place_id INTEGER, histid VARCHAR(36));"
+    query = (f"DROP TABLE IF EXISTS {geo_table_name}_new;"
+             f"CREATE TABLE {geo_table_name}_new (census_place_id INTEGER, histid VARCHAR(36));"
              f"INSERT INTO {geo_table_name}_new "
              f"SELECT cpp_placeid, UPPER(histid) FROM {geo_table_name};"
              f"DROP TABLE {geo_table_name};"
@@ -107,9 +169,19 @@ def _transform_histid_geo_table_to_uppercase(geo_table_name: str):
     ipums_api.execute_sql(query=query)
 
 
+def _is_geo_table_transformed(geo_table_name: str) -> bool:
+    # The raw geo table has cpp_placeid, the transformed one census_place_id
+    with ipums_api.db_connection() as con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'census_place_id' AND NOT attisdropped)", (geo_table_name,))
+            transformed = cursor.fetchone()[0]
+    return transformed
+
+
 def _create_indices_geo_and_dem_tables(geo_table_name: str, dem_table_name: str):
-    query = (f"CREATE INDEX ON {geo_table_name} (histid);"
-             f"CREATE INDEX ON {dem_table_name} (histid);")
+    # Named, so that a forced rerun does not add a second index
+    query = (f"CREATE INDEX IF NOT EXISTS {geo_table_name}_histid_idx ON {geo_table_name} (histid);"
+             f"CREATE INDEX IF NOT EXISTS {dem_table_name}_histid_idx ON {dem_table_name} (histid);")
     ipums_api.execute_sql(query=query)
 
 
@@ -129,20 +201,72 @@ def _remove_duplicate_histid_from_table(tab_name: str):
     ipums_api.execute_sql(query=query)
 
 
-def _merge_geo_and_dem_tables_to_create_data_table(geo_table_name: str, dem_table_name: str, data_table_name: str):
-    query = (f"CREATE TABLE {data_table_name} (histid VARCHAR(36), hik VARCHAR(21), ind1950 INTEGER, occ1950 INTEGER, census_place_id INTEGER);"
+def _merge_geo_and_dem_tables_to_create_data_table(geo_table_name: str, dem_table_name: str, data_table_name: str, n_partitions: int = default_data_table_partitions):
+    query = (f"{_get_partitioned_data_table_query(data_table_name=data_table_name, n_partitions=n_partitions)}"
              f"INSERT INTO {data_table_name} "
-             f"SELECT {dem_table_name}.histid, NULLIF(hik, '                     '), ind1950, occ1950, CASE WHEN census_place_id > 69491 THEN NULL ELSE census_place_id END AS census_place_id "
+             f"SELECT {dem_table_name}.histid, NULLIF(hik, '                     '), ind1950, occ1950, CASE WHEN census_place_id > {max_census_place_id} THEN NULL ELSE census_place_id END AS census_place_id "
              f"FROM {dem_table_name} LEFT JOIN {geo_table_name} "
-             f"ON {dem_table_name}.histid = {geo_table_name}.histid;")
+             f"ON {dem_table_name}.histid = {geo_table_name}.histid "
+             f"ORDER BY census_place_id;")
+
+    ipums_api.execute_sql(query=query)
+
+
+def _dedup_and_merge_geo_and_dem_tables_to_create_data_table(geo_table_name: str, dem_table_name: str, data_table_name: str, geo_table_ingested: bool = False, n_partitions: int = default_data_table_partitions) -> None:
+    # Same row set as the step-by-step path: histids that occur more than once are dropped
+    # entirely from each table, but here with one hash aggregation per table while joining
+    geo_table_transformed = geo_table_ingested or _is_geo_table_transformed(geo_table_name=geo_table_name)
+    census_place_column, histid_column = ('census_place_id', 'histid') if geo_table_transformed else ('cpp_placeid', 'UPPER(histid)')
+    query = (f"{_get_partitioned_data_table_query(data_table_name=data_table_name, n_partitions=n_partitions)}"
+             f"INSERT INTO {data_table_name} "
+             f"WITH unique_dem AS ("
+             f"SELECT histid, MIN(hik) AS hik, MIN(ind1950) AS ind1950, MIN(occ1950) AS occ1950 "
+             f"FROM {dem_table_name} "
+             f"GROUP BY histid "
+             f"HAVING COUNT(*) = 1), "
+             f"unique_geo AS ("
+             f"SELECT {histid_column} AS histid, MIN({census_place_column}) AS census_place_id "
+             f"FROM {geo_table_name} "
+             f"GROUP BY {histid_column} "
+             f"HAVING COUNT(*) = 1) "
+             f"SELECT unique_dem.histid, NULLIF(hik, '                     '), ind1950, occ1950, "
+             f"CASE WHEN census_place_id > {max_census_place_id} THEN NULL ELSE census_place_id END AS census_place_id "
+             f"FROM unique_dem LEFT JOIN unique_geo "
+             f"ON unique_dem.histid = unique_geo.histid "
+             f"ORDER BY census_place_id;")
 
     ipums_api.execute_sql(query=query)
 
 
-def _add_primary_and_foreign_keys_to_data_table(data_table_name: str, census_place_table_name: str, industry_table_name: str):
-    query = (f"ALTER TABLE {data_table_name} ADD PRIMARY KEY (histid);"
-             f"ALTER TABLE {data_table_name} ADD FOREIGN KEY (census_place_id) REFERENCES {census_place_table_name}(id);"
-             f"ALTER TABLE {data_table_name} ADD FOREIGN KEY (ind1950) REFERENCES {industry_table_name}(code);")
+def _get_partitioned_data_table_query(data_table_name: str, n_partitions: int) -> str:
+    # Range partitions of census place ids, so that queries filtering or grouping by census place
+    # only scan the partitions they need. Persons without a census place go to the default partition.
+    assert n_partitions >= 1, "The data table needs at least one census place partition"
+    bounds = ['MINVALUE'] + [str(int(bound)) for bound in np.linspace(1, max_census_place_id + 1, n_partitions + 1)[1:-1].round()] + ['MAXVALUE']
+    query = (f"CREATE TABLE {data_table_name} (histid VARCHAR(36) NOT NULL, hik VARCHAR(21), ind1950 INTEGER, occ1950 INTEGER, census_place_id INTEGER) "
+             f"PARTITION BY RANGE (census_place_id);")
+    for partition_name, lower_bound, upper_bound in zip(_get_data_table_partition_names(data_table_name=data_table_name, n_partitions=n_partitions), bounds[:-1], bounds[1:]):
+        query += f"CREATE TABLE {partition_name} PARTITION OF {data_table_name} FOR VALUES FROM ({lower_bound}) TO ({upper_bound});"
+    query += f"CREATE TABLE {data_table_name}_no_place PARTITION OF {data_table_name} DEFAULT;"
+    return query
+
+
+def _get_data_table_partition_names(data_table_name: str, n_partitions: int) -> List[str]:
+    return [f"{data_table_name}_p{i}" for i in range(n_partitions)] + [f"{data_table_name}_no_place"]
+
+
+def _add_primary_and_foreign_keys_to_data_table(data_table_name: str, census_place_table_name: str, industry_table_name: str, n_partitions: int = default_data_table_partitions):
+    # A primary key of a partitioned table must contain the partition key, so histid is the
+    # primary key of each partition instead (histids are unique across partitions after deduplication).
+    # Rows are inserted sorted by census place, which makes a BRIN index on census_place_id
+    # selective at a fraction of the size of a btree.
+    query = "".join(f"ALTER TABLE {partition_name} ADD PRIMARY KEY (histid);" for partition_name in _get_data_table_partition_names(data_table_name=data_table_name, n_partitions=n_partitions))
+    query += (f"ALTER TABLE {data_table_name} ADD FOREIGN KEY (census_place_id) REFERENCES {census_place_table_name}(id);"
+              f"ALTER TABLE {data_table_name} ADD FOREIGN KEY (ind1950) REFERENCES {industry_table_name}(code);"
+              f"CREATE INDEX ON {data_table_name} USING BRIN (census_place_id);"
+              f"CREATE INDEX ON {data_table_name} (occ1950);"
+              f"CREATE INDEX ON {data_table_name} (ind1950);"
+              f"ANALYZE {data_table_name};")
 
     ipums_api.execute_sql(query=query)
 
@@ -155,41 +279,122 @@ def _drop_geo_and_dem_tables(dem_table_name: str, geo_table_name: str):
 
 
 # Step 2: create_clusters
-def create_clusters(data_table_name: str, rasterized_census_place_table_name: str, cluster_table_name: str, convolved_raster_table_name: str, convolution_kernel_size: int, convolution_kernel_decay_rate: float, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int) -> None:
+def create_clusters(data_table_name: str, rasterized_census_place_table_name: str, cluster_table_name: str, convolved_raster_table_name: str, convolution_kernel_size: int, convolution_kernel_decay_rate: float, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int, convolution_tile_size: int = None, convolution_method: ConvolutionMethod = ConvolutionMethod.DIRECT, clustering_method: ClusteringMethod = ClusteringMethod.SQL, rasterization_method: RasterizationMethod = RasterizationMethod.SQL,
+                    raster_tile_size: int = default_raster_tile_size, raster_overview_factors: Tuple[int, ...] = default_raster_overview_factors, step_run: Dict = None) -> None:
     logger.debug(f"Creating clusters table {cluster_table_name} from {data_table_name}")
 
     logger.debug(f"Rasterizing {data_table_name} to {rasterized_census_place_table_name}")
-    _rasterize_census_places(data_table_name=data_table_name, rasterized_census_place_table_name=rasterized_census_place_table_name)
+    raster = run_sub_step(step_run, 'rasterize', _rasterize_census_places, creates=[rasterized_census_place_table_name], data_table_name=data_table_name, rasterized_census_place_table_name=rasterized_census_place_table_name, rasterization_method=rasterization_method,
+                          raster_tile_size=raster_tile_size, raster_overview_factors=raster_overview_factors)
 
     logger.debug(f"Convolving {rasterized_census_place_table_name} to {convolved_raster_table_name}")
-    _convolve_raster(rasterized_census_place_table_name=rasterized_census_place_table_name, convolved_raster_table_name=convolved_raster_table_name, convolution_kernel_size=convolution_kernel_size, convolution_kernel_decay_rate=convolution_kernel_decay_rate)
+    convolved_raster = run_sub_step(step_run, 'convolve', _convolve_raster, creates=[convolved_raster_table_name], rasterized_census_place_table_name=rasterized_census_place_table_name, convolved_raster_table_name=convolved_raster_table_name,
+                                    convolution_kernel_size=convolution_kernel_size, convolution_kernel_decay_rate=convolution_kernel_decay_rate, convolution_tile_size=convolution_tile_size, convolution_method=convolution_method, raster=raster,
+                                    raster_tile_size=raster_tile_size, raster_overview_factors=raster_overview_factors)
 
     logger.debug(f"Creating clusters from {convolved_raster_table_name}")
-    _create_clusters_from_raster(convolved_raster_table_name=convolved_raster_table_name, cluster_table_name=cluster_table_name, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points)
+    run_sub_step(step_run, 'cluster', _create_clusters_from_raster, creates=[cluster_table_name], convolved_raster_table_name=convolved_raster_table_name, cluster_table_name=cluster_table_name, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps,
+                 dbscan_min_points=dbscan_min_points, clustering_method=clustering_method, convolved_raster=convolved_raster)
 
 
-def _rasterize_census_places(data_table_name: str, rasterized_census_place_table_name: str) -> None:
-    query = (f"CREATE TABLE {rasterized_census_place_table_name} AS "
-             f"SELECT * FROM rasterize_census_places('{data_table_name}');"
+def _rasterize_census_places(data_table_name: str, rasterized_census_place_table_name: str, rasterization_method: RasterizationMethod = RasterizationMethod.SQL, raster_tile_size: int = default_raster_tile_size,
+                             raster_overview_factors: Tuple[int, ...] = default_raster_overview_factors) -> Union[xr.DataArray, None]:
+    if rasterization_method == RasterizationMethod.NUMPY:
+        return _rasterize_census_places_numpy(data_table_name=data_table_name, rasterized_census_place_table_name=rasterized_census_place_table_name, raster_tile_size=raster_tile_size, raster_overview_factors=raster_overview_factors)
+
+    query = (f"CREATE TABLE {rasterized_census_place_table_name} (rid SERIAL PRIMARY KEY, rast raster);"
+             f"INSERT INTO {rasterized_census_place_table_name} (rast) "
+             f"SELECT rast FROM rasterize_census_places('{data_table_name}', {raster_tile_size});"
+             f"CREATE INDEX ON {rasterized_census_place_table_name} USING GIST (ST_ConvexHull(rast));"
              f"SELECT AddRasterConstraints('{rasterized_census_place_table_name}'::name, 'rast'::name);")
 
     ipums_api.execute_sql(query=query)
+    with ipums_api.db_connection() as con:
+        create_raster_overviews(con=con, raster_table=rasterized_census_place_table_name, factors=raster_overview_factors)
+    return None
 
 
-def _convolve_raster(rasterized_census_place_table_name: str, convolved_raster_table_name: str, convolution_kernel_size: int, convolution_kernel_decay_rate: float) -> None:
-    con = ipums_api.get_db_connection()
-    raster = load_raster(con=con, raster_table=rasterized_census_place_table_name)
-    raster_vals = raster.sel(band=1).values
-
+def _rasterize_census_places_numpy(data_table_name: str, rasterized_census_place_table_name: str, raster_tile_size: int = default_raster_tile_size, raster_overview_factors: Tuple[int, ...] = default_raster_overview_factors) -> xr.DataArray:
+    # Unlike ST_SetValues, which overwrites, census places falling in the same pixel are summed
+    query = (f"WITH census_place_pop_count AS ("
+             f"SELECT census_place_id, COUNT(*) AS pop_count "
+             f"FROM {data_table_name} "
+             f"GROUP BY census_place_id) "
+             f"SELECT cp.pixel_row, cp.pixel_col, cp_pop_count.pop_count "
+             f"FROM census_place_pop_count AS cp_pop_count JOIN census_place_pixel AS cp "
+             f"ON cp_pop_count.census_place_id = cp.census_place_id;")
+
+    with ipums_api.db_connection() as con:
+        with con.cursor() as cursor:
+            cursor.execute(query)
+            census_place_pop = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+            cursor.execute("SELECT (ST_MetaData(get_template_usa_raster())).*")
+            metadata = dict(zip([c.name for c in cursor.description], cursor.fetchone()))
+
+        pixel_values = rasterize_pixels(rows=census_place_pop[:, 0], cols=census_place_pop[:, 1], values=census_place_pop[:, 2], height=metadata['height'], width=metadata['width'])
+        transform = Affine(metadata['scalex'], metadata['skewx'], metadata['upperleftx'], metadata['skewy'], metadata['scaley'], metadata['upperlefty'])
+        raster = array_to_raster(values=pixel_values[np.newaxis], transform=transform, srid=metadata['srid'], nodata=0.0)
+        dump_raster(con=con, data=raster, table_name=rasterized_census_place_table_name, tile_size=raster_tile_size)
+        create_raster_overviews(con=con, raster_table=rasterized_census_place_table_name, factors=raster_overview_factors)
+
+    return raster
+
+
+def _convolve_raster(rasterized_census_place_table_name: str, convolved_raster_table_name: str, convolution_kernel_size: int, convolution_kernel_decay_rate: float, convolution_tile_size: int = None, convolution_method: ConvolutionMethod = ConvolutionMethod.DIRECT, raster: xr.DataArray = None,
+                     raster_tile_size: int = default_raster_tile_size, raster_overview_factors: Tuple[int, ...] = default_raster_overview_factors) -> Union[xr.DataArray, None]:
+    if convolution_tile_size is not None:
+        # The output is stored in tiles of convolution_tile_size
+        _convolve_raster_tiled(rasterized_census_place_table_name=rasterized_census_place_table_name, convolved_raster_table_name=convolved_raster_table_name, convolution_kernel_size=convolution_kernel_size,
+                               convolution_kernel_decay_rate=convolution_kernel_decay_rate, convolution_tile_size=convolution_tile_size, convolution_method=convolution_method)
+        with ipums_api.db_connection() as con:
+            create_raster_overviews(con=con, raster_table=convolved_raster_table_name, factors=raster_overview_factors)
+        return None
+
+    with ipums_api.db_connection() as con:
+        # A raster already loaded by the caller (e.g. a parameter sweep) is reused instead of refetched
+        raster = load_raster(con=con, raster_table=rasterized_census_place_table_name) if raster is None else raster
+        raster_vals = raster.sel(band=1).values
+
+        kernel = get_2d_exponential_kernel(size=convolution_kernel_size, decay_rate=convolution_kernel_decay_rate)
+        convolved_raster_vals = convolve2d(image=raster_vals, kernel=kernel, method=convolution_method)
+        logger.debug(f"Convolved {rasterized_census_place_table_name} with the {convolution_method.value} backend")
+
+        convolved_raster = raster.copy(data=np.expand_dims(convolved_raster_vals, axis=0))
+        dump_raster(con=con, data=convolved_raster, table_name=convolved_raster_table_name, tile_size=raster_tile_size)
+        create_raster_overviews(con=con, raster_table=convolved_raster_table_name, factors=raster_overview_factors)
+
+    return convolved_raster
+
+
+def _convolve_raster_tiled(rasterized_census_place_table_name: str, convolved_raster_table_name: str, convolution_kernel_size: int, convolution_kernel_decay_rate: float, convolution_tile_size: int, convolution_method: ConvolutionMethod = ConvolutionMethod.DIRECT) -> None:
+    # Only one tile and its halo are held in memory at a time; the output is stored one tile per row
     kernel = get_2d_exponential_kernel(size=convolution_kernel_size, decay_rate=convolution_kernel_decay_rate)
-    convolved_raster_vals = convolve2d(image=raster_vals, kernel=kernel)
+    halo = (convolution_kernel_size - 1) // 2
+
+    with ipums_api.db_connection() as con:
+        metadata = get_raster_metadata(con=con, raster_table=rasterized_census_place_table_name)
+        windows = get_tile_windows(height=metadata['height'], width=metadata['width'], tile_size=convolution_tile_size, halo=halo)
+        ipums_api.execute_sql(query=f"CREATE TABLE {convolved_raster_table_name} (rid SERIAL PRIMARY KEY, rast raster);", con=con)
+
+        for i, (tile_window, halo_window) in enumerate(windows):
+            halo_raster = load_raster_window(con=con, raster_table=rasterized_census_place_table_name, window=halo_window, metadata=metadata)
+            convolved_tile_vals = convolve2d_halo_tile(halo_tile=halo_raster.sel(band=1).values, kernel=kernel, tile_window=tile_window, halo_window=halo_window, method=convolution_method)
+
+            top, left = tile_window[0] - halo_window[0], tile_window[1] - halo_window[1]
+            tile_raster = halo_raster.rio.isel_window(Window(col_off=left, row_off=top, width=tile_window[3], height=tile_window[2]))
+            convolved_tile = tile_raster.copy(data=np.expand_dims(convolved_tile_vals, axis=0))
+            append_raster_tile(con=con, data=convolved_tile, table_name=convolved_raster_table_name)
+            logger.debug(f"Convolved tile {i + 1}/{len(windows)} of {rasterized_census_place_table_name}")
+
+        ipums_api.execute_sql(query=f"CREATE INDEX ON {convolved_raster_table_name} USING GIST (ST_ConvexHull(rast));"
+                                    f"SELECT AddRasterConstraints('{convolved_raster_table_name}'::name, 'rast'::name);", con=con)
 
-    convolved_raster = raster.copy(data=np.expand_dims(convolved_raster_vals, axis=0))
-    dump_raster(con=con, data=convolved_raster, table_name=convolved_raster_table_name)
-    con.close()
 
+def _create_clusters_from_raster(convolved_raster_table_name: str, cluster_table_name: str, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int, clustering_method: ClusteringMethod = ClusteringMethod.SQL, convolved_raster: xr.DataArray = None) -> None:
+    if clustering_method == ClusteringMethod.GRID:
+        _create_clusters_from_raster_grid(convolved_raster_table_name=convolved_raster_table_name, cluster_table_name=cluster_table_name, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points, convolved_raster=convolved_raster)
+        return
 
-def _create_clusters_from_raster(convolved_raster_table_name: str, cluster_table_name: str, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int) -> None:
     query = (f"CREATE TABLE {cluster_table_name} AS "
              f"SELECT cid AS cluster_id, geom FROM convolved_raster_to_cluster('{convolved_raster_table_name}', {pixel_threshold}, {dbscan_eps}, {dbscan_min_points});"
              f"CREATE INDEX ON {cluster_table_name} USING GIST (geom);")
@@ -197,35 +402,73 @@ def _create_clusters_from_raster(convolved_raster_table_name: str, cluster_table
     ipums_api.execute_sql(query=query)
 
 
+def _create_clusters_from_raster_grid(convolved_raster_table_name: str, cluster_table_name: str, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int, convolved_raster: xr.DataArray = None) -> None:
+    # Labels the thresholded pixels on the grid and writes one polygon per cluster, instead of one polygon per pixel
+    with ipums_api.db_connection() as con:
+        convolved_raster = load_raster(con=con, raster_table=convolved_raster_table_name) if convolved_raster is None else convolved_raster
+        transform = convolved_raster.rio.transform()
+        labels = label_clusters(values=convolved_raster.sel(band=1).values, pixel_threshold=pixel_threshold, eps=dbscan_eps, min_points=dbscan_min_points, pixel_size=abs(transform.a))
+        cluster_geoms = vectorize_clusters(labels=labels, transform=transform)
+        srid = convolved_raster.rio.crs.to_epsg()
+
+        # Cluster ids start at 0 like the ids of ST_ClusterDBSCAN; noise pixels are left out
+        with con.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {cluster_table_name} (cluster_id INTEGER, geom GEOMETRY);")
+            psycopg2.extras.execute_values(cursor, f"INSERT INTO {cluster_table_name} (cluster_id, geom) VALUES %s",
+                                           [(label - 1, psycopg2.Binary(geom.wkb), srid) for label, geom in cluster_geoms.items()], template="(%s, ST_GeomFromWKB(%s, %s))")
+            cursor.execute(f"CREATE INDEX ON {cluster_table_name} USING GIST (geom);")
+            con.commit()
+
+
 # Step 3: create_cluster_industry_table
 
 
-def create_cluster_data_tables(data_table_name: str, cluster_table_name: str, cluster_industry_table_name: str, industry_table_name: str) -> None:
+def create_cluster_data_tables(data_table_name: str, cluster_table_name: str, cluster_industry_table_name: str, industry_table_name: str, cluster_census_place_table_name: str, cluster_geometry_table_name: str,
+                               cluster_geometry_zoom_levels: Tuple[int, ...] = default_cluster_geometry_zoom_levels, step_run: Dict = None) -> None:
     logger.debug(f"Creating cluster industry table {cluster_industry_table_name} from {cluster_table_name}")
 
+    logger.debug(f"Creating cluster census place crosswalk {cluster_census_place_table_name} from {cluster_table_name}")
+    run_sub_step(step_run, 'create_crosswalk', _create_cluster_census_place_table, creates=[cluster_census_place_table_name], cluster_table_name=cluster_table_name, cluster_census_place_table_name=cluster_census_place_table_name)
+
     logger.debug(f"Creating cluster industry table from {cluster_table_name}")
-    _create_cluster_industry_table(data_table_name=data_table_name, cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name)
+    run_sub_step(step_run, 'create_cluster_industry', _create_cluster_industry_table, creates=[cluster_industry_table_name], data_table_name=data_table_name, cluster_census_place_table_name=cluster_census_place_table_name, cluster_industry_table_name=cluster_industry_table_name)
 
     logger.debug(f"Adding population to {cluster_table_name}")
-    _create_cluster_cluster_table_with_population(cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name)
+    run_sub_step(step_run, 'add_population', _create_cluster_cluster_table_with_population, cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name)
 
     logger.debug(f"Adding primary and foreign keys to {cluster_industry_table_name}")
-    _add_primary_and_foreign_keys_to_cluster_industry_table(cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name, industry_table_name=industry_table_name)
+    run_sub_step(step_run, 'add_cluster_industry_keys', _add_primary_and_foreign_keys_to_cluster_industry_table, cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name, industry_table_name=industry_table_name)
 
+    logger.debug(f"Adding foreign keys to {cluster_census_place_table_name}")
+    run_sub_step(step_run, 'add_crosswalk_keys', _add_foreign_keys_to_cluster_census_place_table, cluster_table_name=cluster_table_name, cluster_census_place_table_name=cluster_census_place_table_name)
 
-def _create_cluster_industry_table(data_table_name: str, cluster_table_name: str, cluster_industry_table_name: str) -> None:
+    logger.debug(f"Creating simplified geometry table {cluster_geometry_table_name} from {cluster_table_name}")
+    run_sub_step(step_run, 'create_cluster_geometry', _create_cluster_geometry_table, creates=[cluster_geometry_table_name], cluster_table_name=cluster_table_name, cluster_geometry_table_name=cluster_geometry_table_name,
+                 cluster_geometry_zoom_levels=cluster_geometry_zoom_levels)
+
+
+def _create_cluster_census_place_table(cluster_table_name: str, cluster_census_place_table_name: str) -> None:
+    query = (f"DROP TABLE IF EXISTS {cluster_census_place_table_name};"
+             f"CREATE TABLE {cluster_census_place_table_name} AS "
+             f"SELECT census_place_pixel.census_place_id, {cluster_table_name}.cluster_id "
+             f"FROM {cluster_table_name} JOIN census_place_pixel "
+             f"ON ST_Within(census_place_pixel.geom, {cluster_table_name}.geom);"
+             f"ALTER TABLE {cluster_census_place_table_name} ADD PRIMARY KEY (census_place_id, cluster_id);"
+             f"CREATE INDEX ON {cluster_census_place_table_name} (cluster_id);"
+             f"ANALYZE {cluster_census_place_table_name};")
+
+    ipums_api.execute_sql(query=query)
+
+
+def _create_cluster_industry_table(data_table_name: str, cluster_census_place_table_name: str, cluster_industry_table_name: str) -> None:
     query = (f"CREATE TABLE {cluster_industry_table_name} AS "
-             f"WITH cluster_census_place_crosswalk AS ("
-             f"SELECT id AS census_place_id, cluster_id "
-             f"FROM {cluster_table_name} JOIN census_place "
-             f"ON ST_Within(ST_Transform(census_place.geom::geometry, 5070), {cluster_table_name}.geom)), "
-             f"industry_counts_census_place AS ("
+             f"WITH industry_counts_census_place AS ("
              f"SELECT census_place_id, ind1950, COUNT(*) AS n_workers "
              f"FROM {data_table_name} "
              f"GROUP BY census_place_id, ind1950) "
              f"SELECT cluster_id, ind1950, SUM(n_workers) AS n_workers "
              f"FROM industry_counts_census_place AS industry "
-             f"JOIN cluster_census_place_crosswalk AS crosswalk "
+             f"JOIN {cluster_census_place_table_name} AS crosswalk "
              f"ON industry.census_place_id = crosswalk.census_place_id "
              f"GROUP BY cluster_id, ind1950 "
              f"ORDER BY cluster_id, ind1950; ")
@@ -234,12 +477,13 @@ def _create_cluster_industry_table(data_table_name: str, cluster_table_name: str
 
 
 def _create_cluster_cluster_table_with_population(cluster_table_name: str, cluster_industry_table_name: str) -> None:
-    query = (f"CREATE TABLE {cluster_table_name}_new AS "
+    query = (f"DROP TABLE IF EXISTS {cluster_table_name}_new;"
+             f"CREATE TABLE {cluster_table_name}_new AS "
              f"WITH population_counts_cluster AS ("
              f"SELECT cluster_id, SUM(n_workers) AS population "
              f"FROM {cluster_industry_table_name} "
              f"GROUP BY cluster_id) "
-             f"SELECT {cluster_table_name}.cluster_id, population, geom "
+             f"SELECT {cluster_table_name}.cluster_id, population_counts_cluster.population, geom "
              f"FROM {cluster_table_name} JOIN population_counts_cluster "
              f"ON {cluster_table_name}.cluster_id = population_counts_cluster.cluster_id; "
              f"DROP TABLE {cluster_table_name};"
@@ -258,7 +502,37 @@ def _add_primary_and_foreign_keys_to_cluster_industry_table(cluster_table_name:
     ipums_api.execute_sql(query=query)
 
 
-def run_pipeline(steps: List[int], year: int, convolution_kernel_size: int, convolution_kernel_decay_rate: float, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int):
+def _add_foreign_keys_to_cluster_census_place_table(cluster_table_name: str, cluster_census_place_table_name: str) -> None:
+    # Clusters without population are dropped when the population is added, and their census places with them
+    query = (f"DELETE FROM {cluster_census_place_table_name} WHERE cluster_id NOT IN (SELECT cluster_id FROM {cluster_table_name});"
+             f"ALTER TABLE {cluster_census_place_table_name} ADD FOREIGN KEY (cluster_id) REFERENCES {cluster_table_name}(cluster_id);"
+             f"ALTER TABLE {cluster_census_place_table_name} ADD FOREIGN KEY (census_place_id) REFERENCES census_place_pixel(census_place_id);")
+
+    ipums_api.execute_sql(query=query)
+
+
+def _create_cluster_geometry_table(cluster_table_name: str, cluster_geometry_table_name: str, cluster_geometry_zoom_levels: Tuple[int, ...]) -> None:
+    # One web mercator geometry per cluster and zoom level, simplified to the size of a 256 px tile pixel at that zoom
+    # and snapped to a grid of half of it. Clusters smaller than that collapse and are left out of their level.
+    tolerances = ", ".join(f"({zoom}, {40075016.686 / (256 * 2 ** zoom)})" for zoom in cluster_geometry_zoom_levels)
+    query = (f"CREATE TABLE {cluster_geometry_table_name} AS "
+             f"WITH simplified AS ("
+             f"SELECT {cluster_table_name}.cluster_id, levels.zoom, {cluster_table_name}.population, "
+             f"ST_ReducePrecision(ST_SimplifyPreserveTopology(ST_Transform({cluster_table_name}.geom, 3857), levels.tolerance), levels.tolerance / 2) AS geom "
+             f"FROM {cluster_table_name} CROSS JOIN (VALUES {tolerances}) AS levels(zoom, tolerance)) "
+             f"SELECT cluster_id, zoom, population, geom "
+             f"FROM simplified "
+             f"WHERE NOT ST_IsEmpty(geom);"
+             f"ALTER TABLE {cluster_geometry_table_name} ADD PRIMARY KEY (zoom, cluster_id);"
+             f"CREATE INDEX ON {cluster_geometry_table_name} USING GIST (geom);"
+             f"ANALYZE {cluster_geometry_table_name};")
+
+    ipums_api.execute_sql(query=query)
+
+
+def run_pipeline(steps: List[int], year: int, convolution_kernel_size: int, convolution_kernel_decay_rate: float, pixel_threshold: float, dbscan_eps: float, dbscan_min_points: int, convolution_tile_size: int = None, convolution_method: ConvolutionMethod = ConvolutionMethod.DIRECT, clustering_method: ClusteringMethod = ClusteringMethod.SQL, geo_table_ingested: bool = False, single_pass_data_table: bool = False, rasterization_method: RasterizationMethod = RasterizationMethod.SQL, force: bool = False,
+                 data_table_partitions: int = default_data_table_partitions, raster_tile_size: int = default_raster_tile_size, raster_overview_factors: Tuple[int, ...] = default_raster_overview_factors,
+                 cluster_geometry_zoom_levels: Tuple[int, ...] = default_cluster_geometry_zoom_levels):
     logger.info(f"Running pipeline for year {year}")
     logger.info(f"Setting up table names for year {year}")
 
@@ -266,6 +540,7 @@ def run_pipeline(steps: List[int], year: int, convolution_kernel_size: int, conv
     census_place_table_name = f'census_place'
     usa_state_geom_table = f'usa_state_geom'
     industry_table_name = f'industry_1950'
+    census_place_pixel_table_name = f'census_place_pixel'
     path_sql_functions = '/sql'
 
     # Year specific table names
@@ -278,22 +553,215 @@ def run_pipeline(steps: List[int], year: int, convolution_kernel_size: int, conv
     cluster_table_name = f'cluster_{year}'
 
     cluster_industry_table_name = f'cluster_industry_{year}'
+    cluster_census_place_table_name = f'cluster_census_place_{year}'
+    cluster_geometry_table_name = f'cluster_geometry_{year}'
+
+    # Steps are recorded in the run manifest and skipped or resumed when rerun (see manifest.run_step)
+    create_manifest_table()
 
     logger.info(f"Preparing data")
     if 0 in steps:
-        preprocess_data(census_place_table_name=census_place_table_name, usa_state_geom_table=usa_state_geom_table, industry_table_name=industry_table_name, path_sql_functions=path_sql_functions)
+        # Step 0 is shared by all years and recorded under year 0
+        run_step(year=0, step=0, parameters={}, input_tables=[census_place_table_name, usa_state_geom_table, industry_table_name], output_tables=[census_place_pixel_table_name], force=force,
+                 func=preprocess_data, census_place_table_name=census_place_table_name, usa_state_geom_table=usa_state_geom_table, industry_table_name=industry_table_name, path_sql_functions=path_sql_functions, census_place_pixel_table_name=census_place_pixel_table_name)
+    elif (2 in steps or 3 in steps) and not ipums_api.table_exists(table_name=census_place_pixel_table_name):
+        # Databases preprocessed before census_place_pixel was introduced
+        _create_census_place_pixel_table(census_place_table_name=census_place_table_name, census_place_pixel_table_name=census_place_pixel_table_name)
     logger.info(f"Creating data table for year {year}")
     if 1 in steps:
-        create_data_table(geo_table_name=geo_table_name, dem_table_name=demographic_table_name, data_table_name=data_table_name, census_place_table_name=census_place_table_name, industry_table_name=industry_table_name)
+        run_step(year=year, step=1, parameters={'data_table_partitions': data_table_partitions}, input_tables=[geo_table_name, demographic_table_name, census_place_table_name, industry_table_name], output_tables=[data_table_name], force=force,
+                 func=create_data_table, geo_table_name=geo_table_name, dem_table_name=demographic_table_name, data_table_name=data_table_name, census_place_table_name=census_place_table_name, industry_table_name=industry_table_name,
+                 geo_table_ingested=geo_table_ingested, single_pass=single_pass_data_table, n_partitions=data_table_partitions)
     logger.info(f"Creating clusters for year {year}")
     if 2 in steps:
-        create_clusters(data_table_name=data_table_name, rasterized_census_place_table_name=rasterized_census_place_table_name, cluster_table_name=cluster_table_name, convolved_raster_table_name=convolved_raster_table_name, convolution_kernel_size=convolution_kernel_size,
-                        convolution_kernel_decay_rate=convolution_kernel_decay_rate, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points)
+        # The tile size is left out of the parameters, tiled and whole-raster convolution give identical results
+        cluster_parameters = {'convolution_kernel_size': convolution_kernel_size, 'convolution_kernel_decay_rate': convolution_kernel_decay_rate, 'pixel_threshold': pixel_threshold, 'dbscan_eps': dbscan_eps, 'dbscan_min_points': dbscan_min_points,
+                              'convolution_method': convolution_method.value, 'clustering_method': clustering_method.value, 'rasterization_method': rasterization_method.value,
+                              'raster_tile_size': raster_tile_size, 'raster_overview_factors': list(raster_overview_factors)}
+        run_step(year=year, step=2, parameters=cluster_parameters, input_tables=[data_table_name, census_place_pixel_table_name], output_tables=[rasterized_census_place_table_name, convolved_raster_table_name, cluster_table_name], force=force,
+                 func=create_clusters, data_table_name=data_table_name, rasterized_census_place_table_name=rasterized_census_place_table_name, cluster_table_name=cluster_table_name, convolved_raster_table_name=convolved_raster_table_name, convolution_kernel_size=convolution_kernel_size,
+                 convolution_kernel_decay_rate=convolution_kernel_decay_rate, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points, convolution_tile_size=convolution_tile_size, convolution_method=convolution_method, clustering_method=clustering_method, rasterization_method=rasterization_method,
+                 raster_tile_size=raster_tile_size, raster_overview_factors=raster_overview_factors)
     logger.info(f"Creating cluster industry table for year {year}")
     if 3 in steps:
-        create_cluster_data_tables(data_table_name=data_table_name, cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name, industry_table_name=industry_table_name)
+        # cluster_{year} is an input here as well as rewritten with its population, so a rerun of step 2 also reruns step 3
+        run_step(year=year, step=3, parameters={'cluster_geometry_zoom_levels': list(cluster_geometry_zoom_levels)}, input_tables=[data_table_name, cluster_table_name, census_place_pixel_table_name, industry_table_name],
+                 output_tables=[cluster_industry_table_name, cluster_census_place_table_name, cluster_geometry_table_name], force=force,
+                 func=create_cluster_data_tables, data_table_name=data_table_name, cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name, industry_table_name=industry_table_name, cluster_census_place_table_name=cluster_census_place_table_name,
+                 cluster_geometry_table_name=cluster_geometry_table_name, cluster_geometry_zoom_levels=cluster_geometry_zoom_levels)
     logger.info(f"Pipeline for year {year} completed")
 
+    if get_profiling_config()['enabled']:
+        logger.info(f"Profile of year {year}:\n{ipums_api.get_profile_summary().to_string()}")
+
+
+# Parameter sweep
+
+def sweep_clusters(year: int, convolution_kernel_sizes: List[int], convolution_kernel_decay_rates: List[float], pixel_thresholds: List[float], dbscan_eps_values: List[float], dbscan_min_points_values: List[int],
+                   convolution_tile_size: int = None, convolution_method: ConvolutionMethod = ConvolutionMethod.DIRECT, clustering_method: ClusteringMethod = ClusteringMethod.SQL, rasterization_method: RasterizationMethod = RasterizationMethod.SQL, create_cluster_data: bool = False,
+                   raster_tile_size: int = default_raster_tile_size, raster_overview_factors: Tuple[int, ...] = default_raster_overview_factors) -> List[Dict]:
+    """
+    Create cluster tables for every combination of convolution and clustering parameters of a year
+
+    The census is rasterized once, each convolved raster is computed once per kernel and
+    stored in a table suffixed with the kernel parameters, and each cluster table is derived
+    from the cached convolved raster. Tables that already exist are reused, so a sweep can
+    be extended or resumed without recomputing earlier artifacts.
+
+    Returns:
+    - One record per parameter combination with the parameters and the names of its tables
+    """
+    data_table_name = f'census_{year}'
+    industry_table_name = 'industry_1950'
+    rasterized_census_place_table_name = f'rasterized_census_place_{year}'
+
+    if not ipums_api.table_exists(table_name='census_place_pixel'):
+        _create_census_place_pixel_table(census_place_table_name='census_place', census_place_pixel_table_name='census_place_pixel')
+
+    if not ipums_api.table_exists(table_name=rasterized_census_place_table_name):
+        logger.debug(f"Rasterizing {data_table_name} to {rasterized_census_place_table_name}")
+        raster = _rasterize_census_places(data_table_name=data_table_name, rasterized_census_place_table_name=rasterized_census_place_table_name, rasterization_method=rasterization_method,
+                                          raster_tile_size=raster_tile_size, raster_overview_factors=raster_overview_factors)
+    else:
+        raster = None
+
+    sweep = []
+    for convolution_kernel_size, convolution_kernel_decay_rate in product(convolution_kernel_sizes, convolution_kernel_decay_rates):
+        kernel_suffix = _parameter_suffix(k=convolution_kernel_size, d=convolution_kernel_decay_rate)
+        convolved_raster_table_name = f'convolved_raster_{year}_{kernel_suffix}'
+
+        convolved_raster = None
+        if not ipums_api.table_exists(table_name=convolved_raster_table_name):
+            if raster is None and convolution_tile_size is None:
+                with ipums_api.db_connection() as con:
+                    raster = load_raster(con=con, raster_table=rasterized_census_place_table_name)
+            logger.debug(f"Convolving {rasterized_census_place_table_name} to {convolved_raster_table_name}")
+            convolved_raster = _convolve_raster(rasterized_census_place_table_name=rasterized_census_place_table_name, convolved_raster_table_name=convolved_raster_table_name, convolution_kernel_size=convolution_kernel_size,
+                                                convolution_kernel_decay_rate=convolution_kernel_decay_rate, convolution_tile_size=convolution_tile_size, convolution_method=convolution_method, raster=raster,
+                                                raster_tile_size=raster_tile_size, raster_overview_factors=raster_overview_factors)
+
+        for pixel_threshold, dbscan_eps, dbscan_min_points in product(pixel_thresholds, dbscan_eps_values, dbscan_min_points_values):
+            cluster_suffix = _parameter_suffix(k=convolution_kernel_size, d=convolution_kernel_decay_rate, t=pixel_threshold, e=dbscan_eps, m=dbscan_min_points)
+            cluster_table_name = f'cluster_{year}_{cluster_suffix}'
+            cluster_industry_table_name = f'cluster_industry_{year}_{cluster_suffix}'
+            cluster_census_place_table_name = f'cluster_census_place_{year}_{cluster_suffix}'
+            cluster_geometry_table_name = f'cluster_geometry_{year}_{cluster_suffix}'
+
+            if not ipums_api.table_exists(table_name=cluster_table_name):
+                logger.debug(f"Creating clusters {cluster_table_name} from {convolved_raster_table_name}")
+                _create_clusters_from_raster(convolved_raster_table_name=convolved_raster_table_name, cluster_table_name=cluster_table_name, pixel_threshold=pixel_threshold, dbscan_eps=dbscan_eps, dbscan_min_points=dbscan_min_points,
+                                             clustering_method=clustering_method, convolved_raster=convolved_raster)
+            if create_cluster_data and not ipums_api.table_exists(table_name=cluster_industry_table_name):
+                create_cluster_data_tables(data_table_name=data_table_name, cluster_table_name=cluster_table_name, cluster_industry_table_name=cluster_industry_table_name, industry_table_name=industry_table_name, cluster_census_place_table_name=cluster_census_place_table_name,
+                                           cluster_geometry_table_name=cluster_geometry_table_name)
+
+            sweep.append({'year': year, 'convolution_kernel_size': convolution_kernel_size, 'convolution_kernel_decay_rate': convolution_kernel_decay_rate, 'pixel_threshold': pixel_threshold, 'dbscan_eps': dbscan_eps, 'dbscan_min_points': dbscan_min_points,
+                          'convolved_raster_table_name': convolved_raster_table_name, 'cluster_table_name': cluster_table_name, 'cluster_industry_table_name': cluster_industry_table_name if create_cluster_data else None,
+                          'cluster_census_place_table_name': cluster_census_place_table_name if create_cluster_data else None, 'cluster_geometry_table_name': cluster_geometry_table_name if create_cluster_data else None})
+
+    return sweep
+
+
+def _parameter_suffix(**params) -> str:
+    # Table names only allow [a-z0-9_], e.g. _parameter_suffix(k=11, d=0.2) == 'k11_d0p2'. Floats keep 6 significant digits,
+    # so that 0.1 + 0.2 gives d0p3, and suffixes that would not fit in a 63 byte identifier are hashed instead of truncated by Postgres
+    suffix = '_'.join(f"{name}{_format_parameter(value)}" for name, value in params.items())
+    if len(suffix) > max_sweep_suffix_length:
+        suffix = f"h{hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()[:16]}"
+    return suffix
+
+
+def _format_parameter(value) -> str:
+    value_ = float(f"{value:.6g}") if isinstance(value, float) else value
+    return str(value_).replace('.', 'p').replace('-', 'm').replace('+', '')
+
+
+# Parallel multi-year runner
+
+def run_pipeline_parallel(years: List[int], steps: List[int], n_workers: int, max_heavy_db_jobs: int, heavy_db_steps: Tuple[int, ...] = (1, 3), **pipeline_kwargs) -> Dict[int, Dict[int, str]]:
+    """
+    Run the pipeline for several years concurrently on a pool of worker processes
+
+    Step 0 is shared and runs once before any year. Steps 1 -> 2 -> 3 of a year run in
+    order, while steps of different years run in parallel. At most max_heavy_db_jobs of the
+    heavy_db_steps run at once. A failed step skips the remaining steps of its year only.
+
+    Parameters:
+    - years: census years to process
+    - steps: pipeline steps to run (as in run_pipeline)
+    - n_workers: number of worker processes
+    - max_heavy_db_jobs: maximum number of heavy_db_steps running concurrently
+    - heavy_db_steps: steps dominated by large SQL statements
+    - pipeline_kwargs: parameters forwarded to run_pipeline
+
+    Returns:
+    - A dict mapping each year to the status ('done', 'failed', 'skipped') of each of its steps
+    """
+    assert max_heavy_db_jobs >= 1, "At least one heavy database job must be allowed"
+    year_steps = sorted(step for step in steps if step != 0)
+    status = {year: {step: 'pending' for step in year_steps} for year in years}
+
+    # Shared tables are created once here so that concurrent years do not race to create them
+    create_manifest_table()
+    if 0 in steps:
+        logger.info("Running step 0 before the yearly steps")
+        try:
+            run_pipeline(steps=[0], year=years[0], **pipeline_kwargs)
+        except Exception:
+            logger.exception("Step 0 failed, skipping all years")
+            return {year: {step: 'skipped' for step in year_steps} for year in years}
+    elif (2 in steps or 3 in steps) and not ipums_api.table_exists(table_name='census_place_pixel'):
+        _create_census_place_pixel_table(census_place_table_name='census_place', census_place_pixel_table_name='census_place_pixel')
+
+    # Spawned workers start without the parent's pooled database connections, or its profiling settings
+    run_start_timestamp = time.time()
+    profiling_config = get_profiling_config()
+    initializer, initargs = (ipums_api.enable_profiling, (profiling_config['explain'], profiling_config['output_path'])) if profiling_config['enabled'] else (None, ())
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'), initializer=initializer, initargs=initargs) as executor:
+        running = {}
+        while True:
+            running_years = {year for year, _, _ in running.values()}
+            n_heavy_running = sum(step in heavy_db_steps for _, step, _ in running.values())
+            for year in years:
+                next_step = next((step for step in year_steps if status[year][step] == 'pending'), None)
+                if len(running) >= n_workers or year in running_years or next_step is None:
+                    continue
+                if next_step in heavy_db_steps:
+                    if n_heavy_running >= max_heavy_db_jobs:
+                        continue
+                    n_heavy_running += 1
+
+                logger.info(f"Starting step {next_step} for year {year}")
+                status[year][next_step] = 'running'
+                future = executor.submit(run_pipeline, steps=[next_step], year=year, **pipeline_kwargs)
+                running[future] = (year, next_step, time.perf_counter())
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                year, step, step_start_time = running.pop(future)
+                elapsed = time.perf_counter() - step_start_time
+                try:
+                    future.result()
+                    status[year][step] = 'done'
+                    logger.info(f"Finished step {step} for year {year} in {elapsed:.1f}s")
+                except Exception:
+                    status[year][step] = 'failed'
+                    logger.exception(f"Step {step} for year {year} failed after {elapsed:.1f}s, skipping its remaining steps")
+                    for later_step in year_steps:
+                        if status[year][later_step] == 'pending':
+                            status[year][later_step] = 'skipped'
+
+    for year in years:
+        logger.info(f"Year {year}: " + ", ".join(f"step {step} {step_status}" for step, step_status in status[year].items()))
+
+    if profiling_config['enabled'] and profiling_config['output_path'] is not None:
+        records = [r for r in ipums_api.get_profile_records(path=profiling_config['output_path']) if r['timestamp'] >= run_start_timestamp]
+        logger.info(f"Profile of the run:\n{ipums_api.get_profile_summary(records=records).to_string()}")
+    return status
+
 
 if __name__ == '__main__':
     years = [1850, 1870, 1880, 1900, 1910, 1920, 1940]
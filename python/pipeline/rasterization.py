@@ -0,0 +1,49 @@
+from enum import Enum
+from typing import Dict
+
+import numpy as np
+
+
+class RasterizationMethod(Enum):
+    SQL = 'sql'
+    NUMPY = 'numpy'
+
+
+def rasterize_points(x: np.ndarray, y: np.ndarray, values: np.ndarray, metadata: Dict) -> np.ndarray:
+    """
+    Sum point values into the pixels of a raster grid
+
+    Parameters:
+    - x: x coordinates of the points, in the CRS of the grid
+    - y: y coordinates of the points, in the CRS of the grid
+    - values: value of each point
+    - metadata: grid as returned by get_raster_metadata (upperleftx, upperlefty, width, height, scalex, scaley)
+
+    Returns:
+    - A float64 numpy array of shape (height, width) in which each pixel holds the sum of the
+      values of the points falling in it; points outside the grid are ignored
+    """
+    cols = np.floor((np.asarray(x) - metadata['upperleftx']) / metadata['scalex']).astype(np.int64)
+    rows = np.floor((np.asarray(y) - metadata['upperlefty']) / metadata['scaley']).astype(np.int64)
+    return rasterize_pixels(rows=rows, cols=cols, values=values, height=metadata['height'], width=metadata['width'])
+
+
+def rasterize_pixels(rows: np.ndarray, cols: np.ndarray, values: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    Sum values into the pixels of a (height, width) grid given their 0-based pixel indices
+
+    Parameters:
+    - rows: row index of each value
+    - cols: column index of each value
+    - values: values to sum
+    - height: number of rows of the grid
+    - width: number of columns of the grid
+
+    Returns:
+    - A float64 numpy array of shape (height, width); values with indices outside the grid are ignored
+    """
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+
+    pixel_values = np.bincount(rows[inside] * width + cols[inside], weights=np.asarray(values, dtype=np.float64)[inside], minlength=height * width)
+    return pixel_values.reshape(height, width)
@@ -10,9 +10,14 @@ LANGUAGE plpgsql AS
 $$
 BEGIN
 RETURN QUERY EXECUTE format($f$
-    WITH pixels AS (
-        SELECT (ST_PixelAsPolygons(rast, 1, TRUE)).*
+    WITH tiles AS (
+        SELECT rast
         FROM %I
+        WHERE (ST_SummaryStats(rast, 1, TRUE)).max > %L -- Tiles without any pixel above the threshold are skipped
+    ),
+    pixels AS (
+        SELECT (ST_PixelAsPolygons(rast, 1, TRUE)).*
+        FROM tiles
     ),
     filtered_pixel AS (
         SELECT val, geom
@@ -26,6 +31,6 @@ RETURN QUERY EXECUTE format($f$
     SELECT cid, ST_Union(geom) AS geom
     FROM dbscan
     GROUP BY cid
-$f$, convolved_raster_table_name, pixel_threshold, eps, minpoints);
+$f$, convolved_raster_table_name, pixel_threshold, pixel_threshold, eps, minpoints);
 END
 $$;
\ No newline at end of file
@@ -1,5 +1,6 @@
 DROP FUNCTION IF EXISTS rasterize_census_places(data_table TEXT);
-CREATE OR REPLACE FUNCTION rasterize_census_places(data_table TEXT)
+DROP FUNCTION IF EXISTS rasterize_census_places(data_table TEXT, tile_size INT);
+CREATE OR REPLACE FUNCTION rasterize_census_places(data_table TEXT, tile_size INT)
 RETURNS TABLE(rast raster) AS
 $$
 BEGIN
@@ -7,26 +8,45 @@ BEGIN
     WITH usa_raster AS (
         SELECT get_template_usa_raster() AS rast
     ),
+    usa_tiles AS (
+        -- Tiles of the template, in tile_size x tile_size blocks (edge tiles are smaller)
+        SELECT ST_Tile(rast, %2$s, %2$s) AS rast, ST_UpperLeftX(rast) AS upperleftx, ST_UpperLeftY(rast) AS upperlefty, ST_ScaleX(rast) AS scalex, ST_ScaleY(rast) AS scaley
+        FROM usa_raster
+    ),
+    usa_tiles_position AS (
+        SELECT
+            ROUND((ST_UpperLeftY(rast) - upperlefty) / scaley)::INT / %2$s AS tile_row,
+            ROUND((ST_UpperLeftX(rast) - upperleftx) / scalex)::INT / %2$s AS tile_col,
+            rast
+        FROM usa_tiles
+    ),
     census_place_pop AS (
         WITH census_place_pop_count AS (
             SELECT census_place_id, COUNT(*) AS pop_count
-            FROM %I
+            FROM %1$I
             GROUP BY census_place_id
         )
         SELECT
+            cp.pixel_row / %2$s AS tile_row,
+            cp.pixel_col / %2$s AS tile_col,
             cp_pop_count.pop_count AS pop_count,
             cp.geom AS geom
         FROM census_place_pop_count AS cp_pop_count
-        JOIN census_place AS cp
-        ON cp_pop_count.census_place_id = cp.id),
+        JOIN census_place_pixel AS cp
+        ON cp_pop_count.census_place_id = cp.census_place_id),
    census_places_geomval AS (
-       SELECT ARRAY_AGG((ST_Transform(geom::geometry, 5070), pop_count::float)::geomval) AS geomvalset
+       SELECT tile_row, tile_col, ARRAY_AGG((geom, pop_count::float)::geomval) AS geomvalset
        FROM census_place_pop
+       GROUP BY tile_row, tile_col
    )
-   SELECT ST_SetValues(usa_raster.rast, 1, census_places_geomval.geomvalset, FALSE) AS rast
-   FROM census_places_geomval
-   CROSS JOIN usa_raster;
-        $f$, data_table, data_table);
+   -- Each census place only sets the tile holding its pixel, tiles without census places stay empty
+   SELECT CASE WHEN census_places_geomval.geomvalset IS NULL THEN usa_tiles_position.rast
+               ELSE ST_SetValues(usa_tiles_position.rast, 1, census_places_geomval.geomvalset, FALSE) END AS rast
+   FROM usa_tiles_position
+   LEFT JOIN census_places_geomval
+   ON usa_tiles_position.tile_row = census_places_geomval.tile_row AND usa_tiles_position.tile_col = census_places_geomval.tile_col
+   ORDER BY usa_tiles_position.tile_row, usa_tiles_position.tile_col;
+        $f$, data_table, tile_size);
 END;
 $$
-LANGUAGE plpgsql;
\ No newline at end of file
+LANGUAGE plpgsql;